@@ -0,0 +1,115 @@
+"""Runs the benchmarks: generates a synthetic account, stores its graph, then times each scenario against it and writes
+the results as JSON, for comparing runs across commits.
+
+Example: python -m benchmarks --users 2000 --roles 2000 --output results.json
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import principalmapper
+from benchmarks.scenarios import registered_scenarios, run_scenarios
+from benchmarks.synthetic import build_synthetic_graph
+
+
+RESULTS_FORMAT = 'pmapper-benchmarks'
+RESULTS_VERSION = 1
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """Point of entry for command-line"""
+    argument_parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    argument_parser.add_argument('--users', type=int, default=200, help='Number of IAM users to generate')
+    argument_parser.add_argument('--roles', type=int, default=200, help='Number of IAM roles to generate')
+    argument_parser.add_argument('--groups', type=int, default=20, help='Number of IAM groups to generate')
+    argument_parser.add_argument('--policies', type=int, default=60, help='Number of managed policies to generate')
+    argument_parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic account generator')
+    argument_parser.add_argument('--zipf-exponent', type=float, default=1.2,
+                                 help='Skew of how popular managed policies and groups are')
+    argument_parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs of each scenario')
+    argument_parser.add_argument('--scenario', action='append', choices=list(registered_scenarios.keys()),
+                                 help='A scenario to run, may be repeated (default: every scenario)')
+    argument_parser.add_argument('--output', help='File to write the JSON results to (default: stdout)')
+    parsed_args = argument_parser.parse_args(args)
+
+    parameters = {
+        'users': parsed_args.users,
+        'roles': parsed_args.roles,
+        'groups': parsed_args.groups,
+        'managed_policies': parsed_args.policies,
+        'seed': parsed_args.seed,
+        'zipf_exponent': parsed_args.zipf_exponent
+    }
+    sys.stderr.write('Generating a synthetic account: {}\n'.format(parameters))
+    start = time.perf_counter()
+    graph = build_synthetic_graph(**parameters)
+    generation_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as graph_dir:
+        graph.store_graph_as_json(graph_dir)
+        scenario_results = run_scenarios(graph_dir, parsed_args.scenario, parsed_args.repeat, sys.stderr)
+
+    results = {
+        'format': RESULTS_FORMAT,
+        'version': RESULTS_VERSION,
+        'pmapper_version': principalmapper.__version__,
+        'git_commit': _get_git_commit(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'graph': {
+            'nodes': len(graph.nodes),
+            'admins': len([node for node in graph.nodes if node.is_admin]),
+            'edges': len(graph.edges),
+            'groups': len(graph.groups),
+            'policies': len(graph.policies)
+        },
+        'generation_seconds': generation_seconds,
+        'repeat': parsed_args.repeat,
+        'scenarios': scenario_results
+    }
+    content = json.dumps(results, indent=4)
+    if parsed_args.output is None:
+        print(content)
+    else:
+        with open(parsed_args.output, 'w') as f:
+            f.write(content + '\n')
+    return 0
+
+
+def _get_git_commit() -> Optional[str]:
+    """Returns the commit checked out in the repository holding the benchmarks, or None outside of a repository"""
+    try:
+        process = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return process.stdout.strip()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
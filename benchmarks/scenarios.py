@@ -0,0 +1,160 @@
+"""Timed benchmark scenarios over a stored graph.
+
+Each scenario is registered under a name with the scenario decorator. Its function takes the directory of the stored
+graph and a scratch directory, does any setup (such as loading the graph fresh, so no cached results carry over), and
+returns the callable to time. run_scenarios times each scenario a number of times and reports the wall time and how many
+local authorization checks it made.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import io
+import os
+import os.path
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from principalmapper.analysis import find_risks
+from principalmapper.common import Graph
+from principalmapper.graphing.edge_identification import checker_map, obtain_edges
+from principalmapper.graphing.gathering import update_admin_status
+from principalmapper.querying import query_actions, query_interface
+from principalmapper.querying.presets import privesc
+from principalmapper.querying.query_utils import get_search_list
+
+
+# Scenarios by name, in the order they were registered
+registered_scenarios = {}  # type: Dict[str, Callable[[str, str], Callable[[], None]]]
+
+# The resources and actions of the `who can do` scenario
+WHO_CAN_DO_QUERIES = ['who can do iam:CreateUser with *', 'who can do s3:GetObject with *',
+                      'who can do sts:AssumeRole with *']
+
+
+def scenario(name: str):
+    """Decorator for registering a scenario function under a name."""
+    def _register(function):
+        registered_scenarios[name] = function
+        return function
+    return _register
+
+
+def run_scenarios(graph_dir: str, names: Optional[Iterable[str]] = None, repeat: int = 3,
+                  output: Optional[io.StringIO] = None) -> List[dict]:
+    """Times the named scenarios (by default, every registered scenario) repeat times each, against the graph stored
+    in graph_dir. Returns a dictionary per scenario with its name, the seconds of each run, the fastest and median run,
+    and the local authorization checks of one run. Progress is written to output.
+    """
+    if output is None:
+        output = io.StringIO()
+    if repeat < 1:
+        raise ValueError('Each scenario must run at least once')
+    if names is None:
+        names = list(registered_scenarios.keys())
+    for name in names:
+        if name not in registered_scenarios:
+            raise ValueError('No benchmark scenario is registered under the name {}'.format(name))
+
+    result = []
+    for name in names:
+        seconds = []
+        evaluations = 0
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                timed = registered_scenarios[name](graph_dir, scratch_dir)
+                start_evaluations = query_interface.get_evaluation_count()
+                start = time.perf_counter()
+                timed()
+                seconds.append(time.perf_counter() - start)
+                evaluations = query_interface.get_evaluation_count() - start_evaluations
+        result.append({
+            'name': name,
+            'seconds': seconds,
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+            'evaluations': evaluations
+        })
+        output.write('{}: {:.4f} seconds (median of {}), {} authorization checks\n'.format(
+            name, result[-1]['median'], repeat, evaluations))
+    return result
+
+
+@scenario('graph_load')
+def _graph_load(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    return functools.partial(Graph.create_graph_from_local_disk, graph_dir)
+
+
+@scenario('graph_store')
+def _graph_store(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+    return functools.partial(graph.store_graph_as_json, os.path.join(scratch_dir, 'graph'))
+
+
+@scenario('update_admin_status')
+def _update_admin_status(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+    for node in graph.nodes:
+        node.is_admin = False
+    return functools.partial(update_admin_status, graph.nodes)
+
+
+def _obtain_edges(check: str, graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+    return functools.partial(obtain_edges, None, [check], graph.nodes)
+
+
+for _check in checker_map:
+    scenario('obtain_edges:{}'.format(_check))(functools.partial(_obtain_edges, _check))
+
+
+@scenario('get_search_list')
+def _get_search_list(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+
+    def _run():
+        for node in graph.nodes:
+            get_search_list(graph, node)
+    return _run
+
+
+@scenario('privesc_all')
+def _privesc_all(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+
+    def _run():
+        for node in graph.nodes:
+            privesc.can_privesc(graph, node)
+    return _run
+
+
+@scenario('who_can_do')
+def _who_can_do(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+
+    def _run():
+        with open(os.devnull, 'w') as devnull:
+            for query in WHO_CAN_DO_QUERIES:
+                query_actions.query_response(graph, query, False, devnull)
+    return _run
+
+
+@scenario('gen_report')
+def _gen_report(graph_dir: str, scratch_dir: str) -> Callable[[], None]:
+    graph = Graph.create_graph_from_local_disk(graph_dir)
+    return functools.partial(find_risks.gen_report, graph)
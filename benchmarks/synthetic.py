@@ -0,0 +1,216 @@
+"""Code for generating synthetic accounts that look like real ones at scale, for benchmarking.
+
+A few managed policies are attached to most principals and the rest to a few (a Zipfian distribution by popularity
+rank), the same goes for how many members each group has. Policies mix read-only, full-access, and NotAction
+statements, resource wildcards, policy variables, conditions, and the permissions that edge checkers look for (such as
+iam:PassRole with lambda:CreateFunction). Roles are trusted by services, by the account, by specific users, or by other
+accounts, some with conditions. The same parameters and seed always give the same graph.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+from typing import List, Sequence
+
+import principalmapper
+from principalmapper.common import Graph, Group, Node, Policy
+from principalmapper.graphing.edge_identification import checker_map, obtain_edges
+from principalmapper.graphing.gathering import update_admin_status
+
+
+_SERVICES = ['s3', 'ec2', 'lambda', 'dynamodb', 'sqs', 'sns', 'kms', 'logs', 'cloudwatch', 'rds', 'ssm',
+             'secretsmanager']
+_TRUSTED_SERVICES = ['ec2.amazonaws.com', 'lambda.amazonaws.com', 'cloudformation.amazonaws.com']
+_EXTERNAL_ACCOUNTS = ['111111111111', '222222222222', '333333333333']
+
+# The kinds of managed policies generated, and how often each occurs in the catalog
+_POLICY_KINDS = [
+    ('read_only', 30),
+    ('service_full', 15),
+    ('scoped_resources', 15),
+    ('conditional', 10),
+    ('not_action', 4),
+    ('assume_roles', 8),
+    ('pass_role', 8),
+    ('self_service', 6),
+    ('deny_without_mfa', 3),
+    ('admin', 1)
+]
+
+
+def build_synthetic_graph(users: int = 100, roles: int = 100, groups: int = 20, managed_policies: int = 50,
+                          seed: int = 0, zipf_exponent: float = 1.2, account_id: str = '000000000000',
+                          with_edges: bool = True) -> Graph:
+    """Generates the Graph of a synthetic account. The admin status of each node is computed, as is every edge between
+    nodes (in offline mode) unless with_edges is False. zipf_exponent sets how skewed the popularity of managed
+    policies and groups is: above 1, a few are attached to most principals.
+    """
+    if users < 1 or roles < 1 or groups < 1 or managed_policies < 1:
+        raise ValueError('A synthetic account needs at least one user, role, group, and managed policy')
+    rng = random.Random(seed)
+    prefix = 'arn:aws:iam::{}:'.format(account_id)
+
+    catalog = [_make_managed_policy(rng, index, account_id) for index in range(managed_policies)]
+    rng.shuffle(catalog)  # popularity rank does not follow the kind of policy
+    policy_weights = _zipf_weights(len(catalog), zipf_exponent)
+    inline_policies = []
+
+    group_list = []
+    for index in range(groups):
+        group_arn = prefix + 'group/group-{}'.format(index)
+        attached = _pick(rng, catalog, policy_weights, rng.randint(1, 3))
+        if rng.random() < 0.3:
+            inline_policy = Policy(group_arn, 'inline', _make_policy_document(rng, account_id, 'read_only'))
+            inline_policies.append(inline_policy)
+            attached.append(inline_policy)
+        group_list.append(Group(group_arn, attached))
+    group_weights = _zipf_weights(len(group_list), zipf_exponent)
+
+    nodes = []
+    user_arns = []
+    for index in range(users):
+        user_arn = prefix + 'user/{}user-{}'.format('' if index % 5 else 'ops/', index)
+        user_arns.append(user_arn)
+        attached = _pick(rng, catalog, policy_weights, rng.choice([0, 0, 1, 1, 2]))
+        if rng.random() < 0.2:
+            inline_policy = Policy(user_arn, 'inline', _make_policy_document(rng, account_id))
+            inline_policies.append(inline_policy)
+            attached.append(inline_policy)
+        memberships = _pick(rng, group_list, group_weights, rng.randint(0, 4))
+        nodes.append(Node(user_arn, 'AIDA{:017d}'.format(index), attached, memberships, None, None,
+                          rng.randint(0, 2), rng.random() < 0.7, False))
+
+    for index in range(roles):
+        trust_kind = rng.choices(['service', 'account', 'users', 'external', 'anyone'], [40, 30, 15, 12, 3])[0]
+        if trust_kind == 'service':
+            service = rng.choice(_TRUSTED_SERVICES)
+            role_name = 'service-{}-{}'.format(service.split('.')[0], index)
+            principal = {'Service': service}
+        else:
+            role_name = 'team-{}-{}'.format(index % 10, index)
+            if trust_kind == 'account':
+                principal = {'AWS': rng.choice([prefix + 'root', account_id])}
+            elif trust_kind == 'users':
+                principal = {'AWS': rng.sample(user_arns, min(len(user_arns), rng.randint(1, 3)))}
+            elif trust_kind == 'external':
+                principal = {'AWS': 'arn:aws:iam::{}:root'.format(rng.choice(_EXTERNAL_ACCOUNTS))}
+            else:
+                principal = {'AWS': '*'}
+        role_arn = prefix + 'role/' + role_name
+        trust_statement = {'Effect': 'Allow', 'Principal': principal, 'Action': 'sts:AssumeRole'}
+        if trust_kind == 'external' or trust_kind == 'anyone':
+            trust_statement['Condition'] = {'StringEquals': {'sts:ExternalId': 'external-{}'.format(index)}}
+        elif trust_kind == 'account' and rng.random() < 0.3:
+            trust_statement['Condition'] = {'Bool': {'aws:MultiFactorAuthPresent': 'true'}}
+        attached = _pick(rng, catalog, policy_weights, rng.randint(1, 3))
+        if rng.random() < 0.3:
+            inline_policy = Policy(role_arn, 'inline', _make_policy_document(rng, account_id))
+            inline_policies.append(inline_policy)
+            attached.append(inline_policy)
+        instance_profile = None
+        if principal == {'Service': 'ec2.amazonaws.com'}:
+            instance_profile = prefix + 'instance-profile/' + role_name
+        nodes.append(Node(role_arn, 'AROA{:017d}'.format(index), attached, [],
+                          {'Version': '2012-10-17', 'Statement': [trust_statement]}, instance_profile, 0, False, False))
+
+    update_admin_status(nodes)
+    edges = obtain_edges(None, checker_map.keys(), nodes) if with_edges else []
+    used_policy_arns = {policy.arn for node in nodes for policy in node.attached_policies}
+    used_policy_arns.update(policy.arn for group in group_list for policy in group.attached_policies)
+    policies = [policy for policy in catalog if policy.arn in used_policy_arns] + inline_policies
+    metadata = {'account_id': account_id, 'pmapper_version': principalmapper.__version__}
+    return Graph(nodes, edges, policies, group_list, metadata)
+
+
+def _zipf_weights(count: int, exponent: float) -> List[float]:
+    """Helper function: the relative popularity of each rank, from most to least popular"""
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _pick(rng: random.Random, population: Sequence, weights: List[float], count: int) -> list:
+    """Helper function: picks up to count distinct items, weighted by popularity"""
+    result = []
+    for item in rng.choices(population, weights, k=count):
+        if item not in result:
+            result.append(item)
+    return result
+
+
+def _make_managed_policy(rng: random.Random, index: int, account_id: str) -> Policy:
+    """Helper function: generates a managed policy of a random kind, named after its index in the catalog"""
+    kind = rng.choices([x[0] for x in _POLICY_KINDS], [x[1] for x in _POLICY_KINDS])[0]
+    name = '{}-{}'.format(kind.replace('_', '-'), index)
+    return Policy('arn:aws:iam::{}:policy/{}'.format(account_id, name), name,
+                  _make_policy_document(rng, account_id, kind))
+
+
+def _make_policy_document(rng: random.Random, account_id: str, kind: str = None) -> dict:
+    """Helper function: generates a policy document of the given kind, or of a random kind that is never admin"""
+    if kind is None:
+        kind = rng.choice([x[0] for x in _POLICY_KINDS if x[0] != 'admin'])
+    prefix = 'arn:aws:iam::{}:'.format(account_id)
+    services = rng.sample(_SERVICES, rng.randint(1, 3))
+
+    if kind == 'read_only':
+        statements = [{'Effect': 'Allow', 'Resource': '*',
+                       'Action': [action for service in services
+                                  for action in (service + ':Get*', service + ':List*', service + ':Describe*')]}]
+    elif kind == 'service_full':
+        statements = [{'Effect': 'Allow', 'Action': [service + ':*' for service in services], 'Resource': '*'}]
+    elif kind == 'scoped_resources':
+        bucket = 'bucket-{}'.format(rng.randint(0, 99))
+        statements = [
+            {'Effect': 'Allow', 'Action': ['s3:GetObject', 's3:PutObject'],
+             'Resource': 'arn:aws:s3:::{}/${{aws:username}}/*'.format(bucket)},
+            {'Effect': 'Allow', 'Action': 'dynamodb:*',
+             'Resource': 'arn:aws:dynamodb:*:{}:table/table-{}*'.format(account_id, rng.randint(0, 9))}
+        ]
+    elif kind == 'conditional':
+        statements = [{'Effect': 'Allow', 'Action': [service + ':*' for service in services], 'Resource': '*',
+                       'Condition': rng.choice([
+                           {'IpAddress': {'aws:SourceIp': '10.{}.0.0/16'.format(rng.randint(0, 255))}},
+                           {'Bool': {'aws:MultiFactorAuthPresent': 'true'}},
+                           {'StringEquals': {'aws:RequestedRegion': rng.choice(['us-east-1', 'eu-west-1'])}}
+                       ])}]
+    elif kind == 'not_action':
+        statements = [{'Effect': 'Allow', 'NotAction': ['iam:*', 'organizations:*', 'account:*'], 'Resource': '*'}]
+    elif kind == 'assume_roles':
+        statements = [{'Effect': 'Allow', 'Action': 'sts:AssumeRole',
+                       'Resource': prefix + 'role/team-{}-*'.format(rng.randint(0, 9))}]
+    elif kind == 'pass_role':
+        statements = [
+            {'Effect': 'Allow', 'Action': 'iam:PassRole', 'Resource': prefix + 'role/service-*'},
+            {'Effect': 'Allow', 'Resource': '*', 'Action': rng.choice([
+                ['lambda:CreateFunction', 'lambda:InvokeFunction'],
+                ['ec2:RunInstances', 'ec2:AssociateIamInstanceProfile'],
+                ['cloudformation:CreateStack', 'cloudformation:UpdateStack'],
+                ['ssm:SendCommand', 'ssm:StartSession']
+            ])}
+        ]
+    elif kind == 'self_service':
+        statements = [{'Effect': 'Allow', 'Resource': prefix + 'user/${aws:username}',
+                       'Action': ['iam:CreateAccessKey', 'iam:UpdateLoginProfile', 'iam:ChangePassword']}]
+        if rng.random() < 0.3:  # an over-broad variant that reaches every user
+            statements.append({'Effect': 'Allow', 'Action': 'iam:CreateAccessKey', 'Resource': prefix + 'user/*'})
+    elif kind == 'deny_without_mfa':
+        statements = [
+            {'Effect': 'Allow', 'Action': ['iam:*', 'sts:AssumeRole'], 'Resource': '*'},
+            {'Effect': 'Deny', 'Action': 'iam:*', 'Resource': '*',
+             'Condition': {'BoolIfExists': {'aws:MultiFactorAuthPresent': 'false'}}}
+        ]
+    else:  # kind == 'admin'
+        statements = [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]
+    return {'Version': '2012-10-17', 'Statement': statements}
@@ -18,24 +18,26 @@ Provides a command-line interface to use the principalmapper library
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import atexit
+import datetime as dt
 import os
 import os.path
 from pathlib import Path
 import sys
-from typing import Optional
-
-import botocore.session
+from typing import TYPE_CHECKING, Optional
 
 from principalmapper.analysis.find_risks import gen_findings_and_print
 import principalmapper.graphing.graph_actions
-from principalmapper.graphing.edge_identification import checker_map
-from principalmapper.querying import query_actions
+from principalmapper.querying import profiling, query_actions
 from principalmapper.querying import repl
-from principalmapper.util import botocore_tools
+from principalmapper.util import api_recording, botocore_tools
 from principalmapper.util.debug_print import dprint
 from principalmapper.util.storage import get_storage_root
 from principalmapper.visualizing import graph_writer
 
+if TYPE_CHECKING:
+    import botocore.session
+
 
 def main() -> int:
     """Point of entry for command-line"""
@@ -53,6 +55,43 @@ def main() -> int:
         '--account',
         help='When running offline operations, this parameter determines which account to act against.'
     )
+    recording_group = argument_parser.add_mutually_exclusive_group()
+    recording_group.add_argument(
+        '--record',
+        metavar='ARCHIVE',
+        help='Records the AWS API responses used by this command to a compressed archive.'
+    )
+    recording_group.add_argument(
+        '--replay',
+        metavar='ARCHIVE',
+        help='Answers AWS API calls with the responses recorded in an archive (see --record) instead of calling AWS.'
+    )
+    argument_parser.add_argument(
+        '--replay-latency',
+        type=float,
+        default=0.0,
+        help='With --replay, the number of seconds to wait for each replayed API call.'
+    )
+    argument_parser.add_argument(
+        '--as-of',
+        type=_parse_timestamp,
+        metavar='TIMESTAMP',
+        help='Loads the graph of the account as it was at a date (YYYY-MM-DD) or time (YYYY-MM-DDTHH:MM:SS, UTC), from '
+             'the latest snapshot saved by `graph --snapshot` at or before then.'
+    )
+    argument_parser.add_argument(
+        '--profile-report',
+        action='store_true',
+        help='Prints a profile of local policy evaluation to stderr once done, with the costliest actions and '
+             'principals.'
+    )
+    argument_parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=10,
+        metavar='N',
+        help='With --profile-report, the number of actions and principals to list.'
+    )
 
     # Create subparser for various subcommands
     subparser = argument_parser.add_subparsers(
@@ -89,6 +128,68 @@ def main() -> int:
         action='store_true',
         help='Updates the edges of an AWS account. Does not gather information about IAM users or roles.'
     )
+    command_group.add_argument(
+        '--cross-account',
+        action='store_true',
+        help='Finds the sts:AssumeRole edges between the accounts of every graph stored on this computer.'
+    )
+    command_group.add_argument(
+        '--diff',
+        nargs=2,
+        metavar=('OLD', 'NEW'),
+        help='Writes the differences between two stored graphs (each given by an account ID, a directory, or '
+             'ACCOUNT@TIMESTAMP for a snapshot) as JSON Lines: added, removed, and changed nodes, group memberships, '
+             'groups, policies, edges, and privesc.'
+    )
+    command_group.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='Saves the stored graph of the account to its history of snapshots, storing only what changed.'
+    )
+    command_group.add_argument(
+        '--history',
+        action='store_true',
+        help='Lists the snapshots in the history of the account.'
+    )
+    command_group.add_argument(
+        '--prune-history',
+        type=_parse_timestamp,
+        metavar='TIMESTAMP',
+        help='Removes the snapshots of the account from before a date or time, and the data only they used.'
+    )
+    command_group.add_argument(
+        '--apply-events',
+        metavar='EVENTS_FILE',
+        help='Applies IAM change events (CloudTrail records, one per line) from a file to a stored graph.'
+    )
+    graphparser.add_argument(
+        '--resume',
+        action='store_true',
+        help='With --create, continues from the progress saved by an interrupted run instead of starting over.'
+    )
+    graphparser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='With --create, updates the stored graph for the account instead, only re-gathering what changed.'
+    )
+    graphparser.add_argument(
+        '--accounts-file',
+        metavar='TARGETS_FILE',
+        help='With --create, creates the graphs of many accounts at once. The file lists one role ARN to assume (with '
+             'the credentials of --profile) or AWS CLI profile name per line.'
+    )
+    graphparser.add_argument(
+        '--api-rate',
+        type=float,
+        default=50.0,
+        help='With --accounts-file, the most AWS API calls to make per second across every account.'
+    )
+    graphparser.add_argument(
+        '--compression',
+        choices=['none', 'gzip', 'zstd'],
+        help='How to compress the stored graph files (zstd needs the zstandard package). By default, a stored graph '
+             'keeps the compression it has, and a new graph is not compressed.'
+    )
 
     # Query subcommand
     queryparser = subparser.add_parser(
@@ -183,6 +284,16 @@ def main() -> int:
     dprint(parsed_args.debug, 'Debugging mode enabled.')
     dprint(parsed_args.debug, 'Parsed Args: ' + str(parsed_args))
 
+    if not parsed_args.profile_report:
+        return _handle_subcommand(parsed_args)
+    with profiling.profile_evaluations() as profile:
+        result = _handle_subcommand(parsed_args)
+    profile.write_report(sys.stderr, parsed_args.profile_top)
+    return result
+
+
+def _handle_subcommand(parsed_args) -> int:
+    """Helper function: runs the picked subcommand"""
     if parsed_args.picked_cmd == 'graph':
         return handle_graph(parsed_args)
     elif parsed_args.picked_cmd == 'query':
@@ -201,20 +312,105 @@ def main() -> int:
 
 def handle_graph(parsed_args) -> int:
     """Processes the arguments for the graph subcommand and executes related tasks"""
+    if parsed_args.diff is not None:  # --diff
+        from principalmapper.graphing import graph_diff
+        graph_diff.write_diff_as_json_lines(
+            graph_diff.iter_graph_diff(graph_diff.get_graph_records(parsed_args.diff[0]),
+                                       graph_diff.get_graph_records(parsed_args.diff[1])),
+            sys.stdout
+        )
+        return 0
+
+    # graph building loads every edge checker (and any plugins), so it is only imported by this subcommand
+    from principalmapper.graphing import edge_identification, graph_events
+    edge_identification.ensure_plugin_checkers(parsed_args.debug)
+    checker_map = edge_identification.checker_map
+
+    if parsed_args.create and parsed_args.accounts_file is not None:  # --create --accounts-file
+        if parsed_args.incremental:
+            print('The --incremental argument is not supported along with --accounts-file')
+            return 64
+        from principalmapper.graphing import multi_account
+        results = multi_account.create_graphs(
+            multi_account.load_targets(parsed_args.accounts_file),
+            checker_map.keys(),
+            sys.stdout,
+            parsed_args.debug,
+            calls_per_second=parsed_args.api_rate,
+            session_factory=multi_account.TargetSessionFactory(parsed_args.profile),
+            resume=parsed_args.resume,
+            compression=parsed_args.compression
+        )
+        return 0 if all(result.error is None for result in results) else 1
+
+    if parsed_args.cross_account:  # --cross-account
+        from principalmapper.graphing import cross_account
+        multi_account_graph = cross_account.load_multi_account_graph(debug=parsed_args.debug)
+        print('Loaded the graphs of {} accounts'.format(len(multi_account_graph.graphs)))
+        multi_account_graph.identify_cross_account_edges(sys.stdout, parsed_args.debug)
+        return 0
+
     session = _grab_session(parsed_args)
 
-    if parsed_args.create:  # --create
-        graph = principalmapper.graphing.graph_actions.create_new_graph(session, checker_map.keys(), parsed_args.debug)
+    if parsed_args.create and parsed_args.incremental:  # --create --incremental
+        graph = principalmapper.graphing.graph_actions.get_existing_graph(session, None, parsed_args.debug)
+        graph = principalmapper.graphing.graph_actions.update_existing_graph(session, graph, checker_map.keys(),
+                                                                             parsed_args.debug)
         principalmapper.graphing.graph_actions.print_graph_data(graph)
-        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']))
+        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']),
+                                 parsed_args.compression)
+
+    elif parsed_args.create:  # --create
+        checkpoint = principalmapper.graphing.graph_actions.get_graph_checkpoint(session, parsed_args.account,
+                                                                                 parsed_args.resume)
+        graph = principalmapper.graphing.graph_actions.create_new_graph(session, checker_map.keys(), parsed_args.debug,
+                                                                        checkpoint)
+        principalmapper.graphing.graph_actions.print_graph_data(graph)
+        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']),
+                                 parsed_args.compression)
+        checkpoint.clear()
 
     elif parsed_args.display:  # --display
+        graph = principalmapper.graphing.graph_actions.get_existing_graph(
+            session,
+            parsed_args.account,
+            parsed_args.debug,
+            parsed_args.as_of
+        )
+        principalmapper.graphing.graph_actions.print_graph_data(graph)
+
+    elif parsed_args.apply_events is not None:  # --apply-events
         graph = principalmapper.graphing.graph_actions.get_existing_graph(
             session,
             parsed_args.account,
             parsed_args.debug
         )
+        events = graph_events.load_events_from_file(parsed_args.apply_events)
+        applied = graph_events.apply_events(graph, events, checker_map.keys(), session, sys.stdout, parsed_args.debug)
+        print('Applied {} events'.format(applied))
         principalmapper.graphing.graph_actions.print_graph_data(graph)
+        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']),
+                                 parsed_args.compression)
+
+    elif parsed_args.snapshot or parsed_args.history or parsed_args.prune_history is not None:
+        from principalmapper.graphing.graph_history import GraphHistory
+        graph = principalmapper.graphing.graph_actions.get_existing_graph(
+            session,
+            parsed_args.account,
+            parsed_args.debug
+        )
+        history = GraphHistory.for_account(graph.metadata['account_id'])
+        if parsed_args.snapshot:  # --snapshot
+            snapshot_id, written = history.save_snapshot(graph)
+            print('Saved snapshot {} ({} new objects)'.format(snapshot_id, written))
+        elif parsed_args.history:  # --history
+            print('Snapshots of account {}:'.format(graph.metadata['account_id']))
+            print('---')
+            for snapshot_id, created in history.list_snapshots():
+                print('{}  {}'.format(snapshot_id, created.isoformat()))
+        else:  # --prune-history
+            removed_snapshots, removed_blobs = history.remove_snapshots_before(parsed_args.prune_history)
+            print('Removed {} snapshots and {} objects no longer used'.format(removed_snapshots, removed_blobs))
 
     elif parsed_args.list:  # --list
         print("Account IDs:")
@@ -229,11 +425,11 @@ def handle_graph(parsed_args) -> int:
             parsed_args.account,
             parsed_args.debug
         )
-        graph.edges = principalmapper.graphing.edge_identification.obtain_edges(session, checker_map.keys(),
-                                                                                graph.nodes, sys.stdout,
-                                                                                parsed_args.debug)
+        graph.edges = edge_identification.obtain_edges(session, checker_map.keys(), graph.nodes, sys.stdout,
+                                                       parsed_args.debug)
         principalmapper.graphing.graph_actions.print_graph_data(graph)
-        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']))
+        graph.store_graph_as_json(os.path.join(get_storage_root(), graph.metadata['account_id']),
+                                 parsed_args.compression)
 
     return 0
 
@@ -241,7 +437,8 @@ def handle_graph(parsed_args) -> int:
 def handle_query(parsed_args) -> int:
     """Processes the arguments for the query subcommand and executes related tasks"""
     session = _grab_session(parsed_args)
-    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug)
+    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug,
+                                                                      parsed_args.as_of)
 
     query_actions.query_response(graph, parsed_args.query, parsed_args.skip_admin, sys.stdout, parsed_args.debug)
 
@@ -251,7 +448,8 @@ def handle_query(parsed_args) -> int:
 def handle_argquery(parsed_args) -> int:
     """Processes the arguments for the argquery subcommand and executes related tasks"""
     session = _grab_session(parsed_args)
-    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug)
+    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug,
+                                                                      parsed_args.as_of)
 
     # process condition args to generate input dict
     conditions = {}
@@ -275,9 +473,11 @@ def handle_argquery(parsed_args) -> int:
 def handle_repl(parsed_args):
     """Processes the arguments for the query REPL and initiates"""
     session = _grab_session(parsed_args)
-    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug)
+    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug,
+                                                                      parsed_args.as_of)
 
-    repl_obj = repl.PMapperREPL(graph)
+    repl_obj = repl.PMapperREPL(graph, lambda: principalmapper.graphing.graph_actions.get_existing_graph(
+        session, parsed_args.account, parsed_args.debug, parsed_args.as_of))
     repl_obj.begin_repl()
 
     return 0
@@ -287,7 +487,8 @@ def handle_visualization(parsed_args):
     """Processes the arguments for the visualization subcommand and executes related tasks"""
     # get Graph to draw/write
     session = _grab_session(parsed_args)
-    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug)
+    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug,
+                                                                      parsed_args.as_of)
 
     # create file
     filepath = './{}.{}'.format(graph.metadata['account_id'], parsed_args.filetype)
@@ -300,7 +501,8 @@ def handle_analysis(parsed_args):
     """Processes the arguments for the analysis subcommand and executes related tasks"""
     # get Graph object
     session = _grab_session(parsed_args)
-    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug)
+    graph = principalmapper.graphing.graph_actions.get_existing_graph(session, parsed_args.account, parsed_args.debug,
+                                                                      parsed_args.as_of)
 
     # execute analysis
     gen_findings_and_print(graph, parsed_args.output_type)
@@ -308,9 +510,24 @@ def handle_analysis(parsed_args):
     return 0
 
 
-def _grab_session(parsed_args) -> Optional[botocore.session.Session]:
-    if parsed_args.account is None:
-        return botocore_tools.get_session(parsed_args.profile)
+def _parse_timestamp(value: str) -> dt.datetime:
+    """Argument type for dates and times, see principalmapper.graphing.graph_history.parse_timestamp"""
+    from principalmapper.graphing import graph_history
+    try:
+        return graph_history.parse_timestamp(value)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def _grab_session(parsed_args) -> Optional['botocore.session.Session']:
+    if parsed_args.replay is not None:
+        return api_recording.ReplaySession(parsed_args.replay, parsed_args.replay_latency)
+    elif parsed_args.account is None:
+        session = botocore_tools.get_session(parsed_args.profile)
+        if parsed_args.record is not None:
+            session = api_recording.RecordingSession(session, parsed_args.record)
+            atexit.register(session.close)
+        return session
     else:
         return None
 
@@ -15,13 +15,14 @@
 
 
 """Module defining classes and functions used commonly across Principal Mapper. Importing this package currently gives
-the Node, Edge, Graph, Group, and Policy classes, i.e. you can use `from principalmapper.common import Graph`."""
+the Node, Edge, EdgeList, Graph, Group, and Policy classes, i.e. you can use
+`from principalmapper.common import Graph`."""
 
 from principalmapper.common.nodes import Node
-from principalmapper.common.edges import Edge
+from principalmapper.common.edges import Edge, EdgeList
 from principalmapper.common.graphs import Graph
 from principalmapper.common.groups import Group
 from principalmapper.common.policies import Policy
 
 # Put submodules into __all__ for neater interface of principalmapper.common
-__all__ = ['Node', 'Edge', 'Graph', 'Group', 'Policy']
+__all__ = ['Node', 'Edge', 'EdgeList', 'Graph', 'Group', 'Policy']
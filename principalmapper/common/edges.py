@@ -1,4 +1,4 @@
-"""Python module containing the basic Edge class, as well as any utility functions (currently none)."""
+"""Python module containing the basic Edge class, as well as the EdgeList class for compactly storing many edges."""
 
 
 #  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
@@ -16,15 +16,23 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
+from array import array
+from collections.abc import MutableSequence
+import sys
+from typing import Callable, Iterable, List, Optional
+
 from principalmapper.common.nodes import Node
 from principalmapper.util import arns
 
 
 class Edge(object):
     """The Edge object: contains a source and destination Node object, as well as a string that explains how
-    the source Node is able to access the destination Node.
+    the source Node is able to access the destination Node. Edges compare equal when they have the same source,
+    destination, and reason.
     """
 
+    __slots__ = ['source', 'destination', 'reason']
+
     def __init__(self, source: Node, destination: Node, reason: str):
         """Constructor"""
         if source is None:
@@ -36,7 +44,15 @@ class Edge(object):
 
         self.source = source
         self.destination = destination
-        self.reason = reason
+        self.reason = sys.intern(reason)
+
+    def __eq__(self, other):
+        if not isinstance(other, Edge):
+            return NotImplemented
+        return self.source is other.source and self.destination is other.destination and self.reason == other.reason
+
+    def __hash__(self):
+        return hash((id(self.source), id(self.destination), self.reason))
 
     def describe_edge(self) -> str:
         """Returns a human-readable string explaining the edge"""
@@ -53,3 +69,108 @@ class Edge(object):
             'destination': self.destination.arn,
             'reason': self.reason
         }
+
+
+class EdgeList(MutableSequence):
+    """A list of Edge objects, stored as three parallel arrays of integers: the index of the source Node, the index of
+    the destination Node, and the index of the (deduplicated) reason string. This takes a fraction of the memory of a
+    list of Edge objects. Edge objects are created on access, so modify edges by assigning to an index rather than by
+    setting attributes of a retrieved Edge.
+
+    Graph.edges is an EdgeList. Passing the graph's nodes to the constructor keeps node indexes in the same order as
+    the graph's node list. If on_change is set, it is called with no arguments whenever edges are added, replaced, or
+    removed (Graph sets it to empty its query cache).
+    """
+
+    __slots__ = ['_nodes', '_node_indexes', '_reasons', '_reason_indexes', '_sources', '_destinations', '_reason_ids',
+                 'on_change']
+
+    def __init__(self, edges: Optional[Iterable[Edge]] = None, nodes: Optional[List[Node]] = None):
+        self._nodes = []
+        self._node_indexes = {}
+        self._reasons = []
+        self._reason_indexes = {}
+        self._sources = array('I')
+        self._destinations = array('I')
+        self._reason_ids = array('I')
+        self.on_change = None  # type: Optional[Callable[[], None]]
+        if nodes is not None:
+            for node in nodes:
+                self._get_node_index(node)
+        if edges is not None:
+            self.extend(edges)
+
+    def _get_node_index(self, node: Node) -> int:
+        index = self._node_indexes.get(node)
+        if index is None:
+            index = self._node_indexes[node] = len(self._nodes)
+            self._nodes.append(node)
+        return index
+
+    def _get_reason_index(self, reason: str) -> int:
+        index = self._reason_indexes.get(reason)
+        if index is None:
+            index = self._reason_indexes[reason] = len(self._reasons)
+            self._reasons.append(reason)
+        return index
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change()
+
+    def _make_edge(self, index: int) -> Edge:
+        return Edge(self._nodes[self._sources[index]], self._nodes[self._destinations[index]],
+                    self._reasons[self._reason_ids[index]])
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._make_edge(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('EdgeList index out of range')
+        return self._make_edge(index)
+
+    def __setitem__(self, index, edge: Edge):
+        if isinstance(index, slice):
+            raise TypeError('EdgeList does not support slice assignment')
+        self._sources[index] = self._get_node_index(edge.source)
+        self._destinations[index] = self._get_node_index(edge.destination)
+        self._reason_ids[index] = self._get_reason_index(edge.reason)
+        self._changed()
+
+    def __delitem__(self, index):
+        del self._sources[index]
+        del self._destinations[index]
+        del self._reason_ids[index]
+        self._changed()
+
+    def __iter__(self):
+        nodes, reasons = self._nodes, self._reasons
+        for source, destination, reason_id in zip(self._sources, self._destinations, self._reason_ids):
+            yield Edge(nodes[source], nodes[destination], reasons[reason_id])
+
+    def __repr__(self) -> str:
+        return 'EdgeList({} edges)'.format(len(self))
+
+    def insert(self, index: int, edge: Edge) -> None:
+        """Inserts an Edge before index."""
+        self._sources.insert(index, self._get_node_index(edge.source))
+        self._destinations.insert(index, self._get_node_index(edge.destination))
+        self._reason_ids.insert(index, self._get_reason_index(edge.reason))
+        self._changed()
+
+    def append(self, edge: Edge) -> None:
+        """Appends an Edge to the end of the list."""
+        self._sources.append(self._get_node_index(edge.source))
+        self._destinations.append(self._get_node_index(edge.destination))
+        self._reason_ids.append(self._get_reason_index(edge.reason))
+        self._changed()
+
+    def extend(self, edges: Iterable[Edge]) -> None:
+        """Appends every Edge from an iterable to the end of the list."""
+        for edge in edges:
+            self.append(edge)
@@ -16,19 +16,20 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
 import os
 import os.path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 import packaging
 import packaging.version
 
 import principalmapper
-from principalmapper.common.edges import Edge
+from principalmapper.common.edges import Edge, EdgeList
 from principalmapper.common.groups import Group
 from principalmapper.common.nodes import Node
 from principalmapper.common.policies import Policy
+from principalmapper.common.policy_store import PolicyStore, write_policy_store
+from principalmapper.util import json_files
 
 
 class Graph(object):
@@ -36,6 +37,9 @@ class Graph(object):
     Graph data to/from files stored on-disk. The actual attributes of each graph/node/edge/policy/group object
     will remain the same across the same major/minor version of Principal Mapper, so a graph generated in v1.0.0
     should be loadable in v1.0.1, but not v1.1.0.
+
+    Query results derived from the graph (such as reachability searches) are cached in the cache dictionary, which is
+    emptied whenever edges are assigned, added, replaced, or removed.
     """
 
     def __init__(self, nodes: list = None, edges: list = None, policies: list = None, groups: list = None,
@@ -45,8 +49,9 @@ class Graph(object):
                            'metadata': metadata}.items():
             if value is None:
                 raise ValueError('Required constructor argument {} was None'.format(arg))
+        self.cache = {}
         self.nodes = nodes
-        self.edges = edges
+        self.edges = edges  # converted to an EdgeList, see the edges property
         self.policies = policies
         self.groups = groups
         if 'account_id' not in metadata:
@@ -55,6 +60,20 @@ class Graph(object):
             raise ValueError('Incomplete metadata input, expected key: "pmapper_version"')
         self.metadata = metadata
 
+    @property
+    def edges(self) -> EdgeList:
+        """The edges of this Graph, stored compactly as an EdgeList. Assigning any list of Edge objects converts it."""
+        return self._edges
+
+    @edges.setter
+    def edges(self, value):
+        self.cache.clear()
+        if isinstance(value, EdgeList):
+            self._edges = value
+        else:
+            self._edges = EdgeList(value, self.nodes)
+        self._edges.on_change = self.cache.clear
+
     def get_node_by_searchable_name(self, name: str) -> Optional[Node]:
         """Locates a node by a given searchable name, returns the Node or None"""
         for node in self.nodes:
@@ -62,10 +81,18 @@ class Graph(object):
                 return node
         return None
 
-    def store_graph_as_json(self, root_directory: str):
+    def store_graph_as_json(self, root_directory: str, compression: Optional[str] = None):
         """Stores the current Graph as a set of JSON documents on-disk in a standard layout.
 
-        If the directory does not exist yet, it is created.
+        If the directory does not exist yet, it is created. Files whose contents would not change are not rewritten.
+
+        The documents of the policies are written once each to a memory-mapped policy document store (see
+        principalmapper.common.policy_store), and policies.json refers to them by digest.
+
+        The files under graph/ are compressed with compression: 'none', 'gzip' (adds a .gz suffix), or 'zstd' (adds a
+        .zst suffix, needs the zstandard package), see principalmapper.util.json_files. By default, a graph that is
+        already stored keeps the compression it has, and a new one is not compressed. The policy document store is
+        never compressed, so that it can be memory-mapped.
 
         Structure:
         | <root_directory parameter>
@@ -74,6 +101,7 @@ class Graph(object):
         |-------- nodes.json
         |-------- edges.json
         |-------- policies.json
+        |-------- policy_documents.bin
         |-------- groups.json
 
         The client app (such as __main__.py of principalmapper) will specify where to retrieve the data.
@@ -88,20 +116,28 @@ class Graph(object):
         nodesfilepath = os.path.join(graphdir, 'nodes.json')
         edgesfilepath = os.path.join(graphdir, 'edges.json')
         policiesfilepath = os.path.join(graphdir, 'policies.json')
+        policystorefilepath = os.path.join(graphdir, 'policy_documents.bin')
         groupsfilepath = os.path.join(graphdir, 'groups.json')
 
+        if compression is None:
+            existing_nodes_file = json_files.find_json_file(nodesfilepath)
+            compression = 'none' if existing_nodes_file is None else json_files.get_compression(existing_nodes_file)
+
         old_umask = os.umask(0o077)  # block rwx for group/all
-        with open(metadatafilepath, 'w') as f:
-            json.dump(self.metadata, f, indent=4)
-        with open(nodesfilepath, 'w') as f:
-            json.dump([node.to_dictionary() for node in self.nodes], f, indent=4)
-        with open(edgesfilepath, 'w') as f:
-            json.dump([edge.to_dictionary() for edge in self.edges], f, indent=4)
-        with open(policiesfilepath, 'w') as f:
-            json.dump([policy.to_dictionary() for policy in self.policies], f, indent=4)
-        with open(groupsfilepath, 'w') as f:
-            json.dump([group.to_dictionary() for group in self.groups], f, indent=4)
-        os.umask(old_umask)
+        try:
+            json_files.write_json_if_changed(metadatafilepath, self.metadata)
+            json_files.write_json_if_changed(nodesfilepath, [node.to_dictionary() for node in self.nodes], compression)
+            json_files.write_json_if_changed(edgesfilepath, [edge.to_dictionary() for edge in self.edges], compression)
+            write_policy_store(policystorefilepath, self.policies)
+            json_files.write_json_if_changed(
+                policiesfilepath,
+                [{'arn': policy.arn, 'name': policy.name, 'policy_digest': policy.digest} for policy in self.policies],
+                compression
+            )
+            json_files.write_json_if_changed(groupsfilepath, [group.to_dictionary() for group in self.groups],
+                                             compression)
+        finally:
+            os.umask(old_umask)
 
     @classmethod
     def create_graph_from_local_disk(cls, root_directory: str):
@@ -114,11 +150,17 @@ class Graph(object):
         |-------- nodes.json
         |-------- edges.json
         |-------- policies.json
+        |-------- policy_documents.bin
         |-------- groups.json
 
         Loads metadata, then policies, then groups, then nodes, then edges. Specific ordering is for handling
         different dependencies when generating the objects.
 
+        The files under graph/ may be compressed (see store_graph_as_json). Their arrays are parsed one element at a
+        time, so the text of the files is never held in memory along with the objects made from it. Policy documents
+        in a policy document store are decoded the first time they are accessed. Graphs stored with the documents
+        inline in policies.json load as well.
+
         Validates, using metadata, that the version of Principal Mapper that created the graph is the same
         major/minor version of the current version of Principal Mapper. Raises a ValueError otherwise.
         """
@@ -127,14 +169,33 @@ class Graph(object):
             raise ValueError('Did not find file at: {}'.format(rootpath))
         graphdir = os.path.join(rootpath, 'graph')
         metadatafilepath = os.path.join(rootpath, 'metadata.json')
-        nodesfilepath = os.path.join(graphdir, 'nodes.json')
-        edgesfilepath = os.path.join(graphdir, 'edges.json')
-        policiesfilepath = os.path.join(graphdir, 'policies.json')
-        groupsfilepath = os.path.join(graphdir, 'groups.json')
+        policystorefilepath = os.path.join(graphdir, 'policy_documents.bin')
 
-        with open(metadatafilepath) as f:
-            metadata = json.load(f)
+        metadata = json_files.load_json_file(metadatafilepath)
+        policy_store = PolicyStore(policystorefilepath) if os.path.exists(policystorefilepath) else None
 
+        return cls.create_graph_from_records(
+            metadata,
+            iter_stored_graph_file(graphdir, 'policies.json'),
+            iter_stored_graph_file(graphdir, 'groups.json'),
+            iter_stored_graph_file(graphdir, 'nodes.json'),
+            iter_stored_graph_file(graphdir, 'edges.json'),
+            policy_store
+        )
+
+    @classmethod
+    def create_graph_from_records(cls, metadata: dict, policy_records: Iterable[dict], group_records: Iterable[dict],
+                                  node_records: Iterable[dict], edge_records: Iterable[dict], policy_store=None):
+        """Generates a Graph object from records in the form they are stored in (see store_graph_as_json), such as
+        the elements of policies.json. Each iterable is consumed in turn: policies, groups, nodes, then edges.
+
+        Policy records with a policy_digest instead of a policy_doc refer to a document held by policy_store: a
+        PolicyStore, or any object with the same __contains__ and load_document methods. Those documents are decoded
+        the first time they are accessed.
+
+        Validates, using metadata, that the version of Principal Mapper that created the graph is the same
+        major/minor version of the current version of Principal Mapper. Raises a ValueError otherwise.
+        """
         current_pmapper_version = packaging.version.parse(principalmapper.__version__)
         loaded_graph_version = packaging.version.parse(metadata['pmapper_version'])
         if current_pmapper_version.release[0] != loaded_graph_version.release[0] or \
@@ -145,60 +206,61 @@ class Graph(object):
                                                                                 current_pmapper_version))
 
         policies = []
-        with open(policiesfilepath) as f:
-            policies_file_contents = json.load(f)
-
-        for policy in policies_file_contents:
-            policies.append(Policy(arn=policy['arn'], name=policy['name'], policy_doc=policy['policy_doc']))
+        for policy in policy_records:
+            if 'policy_doc' in policy:
+                policies.append(Policy(arn=policy['arn'], name=policy['name'], policy_doc=policy['policy_doc']))
+            elif policy_store is None:
+                raise ValueError('The policy {} refers to its document by digest, but the graph has no policy document '
+                                 'store (graph/policy_documents.bin) to read it from. Regraph the account.'.format(
+                                     policy['arn']))
+            elif policy['policy_digest'] in policy_store:
+                policies.append(Policy.from_policy_store(policy['arn'], policy['name'], policy['policy_digest'],
+                                                         policy_store))
+            else:
+                raise ValueError('Graph data is inconsistent: there is no document with digest {} for the policy '
+                                 '{}'.format(policy['policy_digest'], policy['arn']))
+        policies_by_ref = {}
+        for policy in policies:
+            policies_by_ref.setdefault((policy.arn, policy.name), policy)
 
-        with open(groupsfilepath) as f:
-            unresolved_groups = json.load(f)
         groups = []
-        for group in unresolved_groups:
-            # dig through string list of attached policies to match up with policy objects with matching ARNs
-            group_policies = []
-            for policy_ref in group['attached_policies']:
-                for policy in policies:
-                    if policy_ref['arn'] == policy.arn and policy_ref['name'] == policy.name:
-                        group_policies.append(policy)
-                        break
+        for group in group_records:
+            # match up the attached policies with policy objects with matching ARNs and names
+            group_policies = [policies_by_ref[(policy_ref['arn'], policy_ref['name'])]
+                              for policy_ref in group['attached_policies']
+                              if (policy_ref['arn'], policy_ref['name']) in policies_by_ref]
             groups.append(Group(arn=group['arn'], attached_policies=group_policies))
+        groups_by_arn = {group.arn: group for group in groups}
 
-        with open(nodesfilepath) as f:
-            unresolved_nodes = json.load(f)
         nodes = []
-        for node in unresolved_nodes:
-            # dig through string list of groups and policies to match up with group and policy objects
-            node_policies = []
-            group_memberships = []
-            for policy_ref in node['attached_policies']:
-                for policy in policies:
-                    if policy_ref['arn'] == policy.arn and policy_ref['name'] == policy.name:
-                        node_policies.append(policy)
-                        break
-            for group in groups:
-                if group.arn in node['group_memberships']:
-                    group_memberships.append(group)
-                    break
+        for node in node_records:
+            # match up the attached policies and groups with policy and group objects
+            node_policies = [policies_by_ref[(policy_ref['arn'], policy_ref['name'])]
+                             for policy_ref in node['attached_policies']
+                             if (policy_ref['arn'], policy_ref['name']) in policies_by_ref]
+            group_memberships = [groups_by_arn[group_arn] for group_arn in node['group_memberships']
+                                 if group_arn in groups_by_arn]
             nodes.append(Node(arn=node['arn'], id_value=node['id_value'], attached_policies=node_policies,
                               group_memberships=group_memberships, trust_policy=node['trust_policy'],
                               instance_profile=node['instance_profile'], num_access_keys=node['access_keys'],
                               active_password=node['active_password'], is_admin=node['is_admin']))
+        nodes_by_arn = {node.arn: node for node in nodes}
 
-        with open(edgesfilepath) as f:
-            unresolved_edges = json.load(f)
         edges = []
-        for edge in unresolved_edges:
-            # dig through nodes to find matching ARNs
-            source = None
-            destination = None
-            for node in nodes:
-                if source is None and node.arn == edge['source']:
-                    source = node
-                if destination is None and node.arn == edge['destination']:
-                    destination = node
-                if source is not None and destination is not None:
-                    break
-            edges.append(Edge(source=source, destination=destination, reason=edge['reason']))
+        for edge in edge_records:
+            edges.append(Edge(source=nodes_by_arn.get(edge['source']),
+                              destination=nodes_by_arn.get(edge['destination']), reason=edge['reason']))
 
         return Graph(nodes=nodes, edges=edges, policies=policies, groups=groups, metadata=metadata)
+
+
+def iter_stored_graph_file(graphdir: str, filename: str) -> Iterator[dict]:
+    """Parses the array in a (possibly compressed) file of a stored graph, such as nodes.json under graphdir (the
+    graph/ directory of the stored graph), yielding one element at a time.
+    """
+    filepath = json_files.find_json_file(os.path.join(graphdir, filename))
+    if filepath is None:
+        raise ValueError('Did not find file at: {}'.format(os.path.join(graphdir, filename)))
+    with json_files.open_json_file(filepath) as f:
+        for element in json_files.iter_json_array(f):
+            yield element
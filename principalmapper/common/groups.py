@@ -27,6 +27,8 @@ class Group(object):
     that the object represents.
     """
 
+    __slots__ = ['arn', 'attached_policies', 'cache']
+
     def __init__(self, arn: str, attached_policies: Optional[List[Policy]]):
         """Constructor"""
         if arn is None or not arns.get_resource(arn).startswith('group/'):
@@ -38,6 +40,8 @@ class Group(object):
         else:
             self.attached_policies = attached_policies
 
+        self.cache = {}
+
     def to_dictionary(self) -> dict:
         """Returns a dictionary representation of this object for storage"""
         return {
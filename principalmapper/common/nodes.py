@@ -29,6 +29,9 @@ class Node(object):
     if a password is active (if IAM User), if there are active access keys (if IAM User), and if the IAM User/Role has
     administrative permissions for the account."""
 
+    __slots__ = ['arn', 'id_value', 'attached_policies', 'group_memberships', 'trust_policy', 'instance_profile',
+                 'active_password', 'access_keys', 'is_admin', 'cache']
+
     def __init__(self, arn: str, id_value: str, attached_policies: Optional[List[Policy]],
                  group_memberships: Optional[List[Group]], trust_policy: Optional[dict],
                  instance_profile: Optional[str], num_access_keys: int, active_password: bool, is_admin: bool):
@@ -1,4 +1,5 @@
-"""Python module containing the Policy class and any Policy-specific utility functions (currently none)."""
+"""Python module containing the Policy class and any Policy-specific utility functions, such as interning policy
+documents by their contents."""
 
 
 #  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
@@ -16,10 +17,23 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
+import json
+import weakref
+from typing import Optional
+
+
 class Policy(object):
     """The basic Policy object: tracks data about the IAM Policy this represents. This includes who the policy
     is attached to (arn is the IAM User/Role for inline, policy ARN otherwose), what its name is (inline),
-    and the contents of the policy (in dictionary form)."""
+    and the contents of the policy (in dictionary form).
+
+    Policy objects with identical policy documents share one interned document (see intern_policy_document), including
+    its cache, so data derived from a document is computed once no matter how many principals use it. Treat policy_doc
+    as immutable: assign a new dictionary instead of editing it in place.
+    """
+
+    __slots__ = ['arn', 'name', '_document']
 
     def __init__(self, arn: str, name: str, policy_doc: dict):
         """Constructor.
@@ -27,15 +41,51 @@ class Policy(object):
         Expects an ARN with either :user/, :role/, :group/, or :policy/ in it (tracked as managed or inline this way)
         Expects a dictionary for the policy document parameter, so you must parse the JSON beforehand
         """
-        if arn is None or \
-                (':user/' not in arn and ':role/' not in arn and ':group/' not in arn and ':policy/' not in arn):
-            raise ValueError('The parameter arn must be a string representing a principal or policy ARN')
+        _check_policy_arn(arn)
         if policy_doc is None or not isinstance(policy_doc, dict):
             raise ValueError('Policy objects must be constructed with a dictionary policy_doc parameter')
 
         self.arn = arn
         self.name = name
-        self.policy_doc = policy_doc
+        self._document = intern_policy_document(policy_doc)
+
+    @classmethod
+    def from_policy_store(cls, arn: str, name: str, digest: str, store) -> 'Policy':
+        """Creates a Policy whose document is held by a PolicyStore (see principalmapper.common.policy_store) under
+        the given digest. The document is only decoded when policy_doc is first accessed, unless a live Policy already
+        uses the same contents.
+        """
+        _check_policy_arn(arn)
+        result = cls.__new__(cls)
+        result.arn = arn
+        result.name = name
+        result._document = intern_stored_policy_document(digest, store)
+        return result
+
+    @property
+    def policy_doc(self) -> dict:
+        """The policy document (in dictionary form)."""
+        return self._document.policy_doc
+
+    @policy_doc.setter
+    def policy_doc(self, value: dict):
+        if value is None or not isinstance(value, dict):
+            raise ValueError('Policy objects must be given a dictionary policy_doc')
+        self._document = intern_policy_document(value)
+
+    @property
+    def digest(self) -> str:
+        """The SHA-256 hex digest of the policy document's contents, see get_policy_digest."""
+        return self._document.digest
+
+    @property
+    def cache(self) -> dict:
+        """Cache for data derived from the policy document, shared by every Policy with the same document."""
+        return self._document.cache
+
+    def __reduce__(self):
+        # re-intern the document when unpickling, rather than restoring a private copy
+        return Policy, (self.arn, self.name, self.policy_doc)
 
     def to_dictionary(self) -> dict:
         """Returns a dictionary representation of this object for storage"""
@@ -44,3 +94,70 @@ class Policy(object):
             'name': self.name,
             'policy_doc': self.policy_doc
         }
+
+
+class PolicyDocument(object):
+    """An interned policy document: the canonical dictionary for a given set of contents, plus a cache for data derived
+    from those contents (such as compiled forms or evaluation results). Get these through intern_policy_document or
+    intern_stored_policy_document.
+
+    A document read from a PolicyStore is decoded the first time policy_doc is accessed.
+    """
+
+    __slots__ = ['digest', '_policy_doc', '_store', 'cache', '__weakref__']
+
+    def __init__(self, digest: str, policy_doc: Optional[dict], store=None):
+        self.digest = digest
+        self._policy_doc = policy_doc
+        self._store = store  # the PolicyStore to decode the document from, until it is decoded
+        self.cache = {}
+
+    @property
+    def policy_doc(self) -> dict:
+        """The policy document (in dictionary form)."""
+        if self._policy_doc is None:
+            self._policy_doc = self._store.load_document(self.digest)
+            self._store = None
+        return self._policy_doc
+
+
+_interned_documents = weakref.WeakValueDictionary()
+
+
+def get_policy_digest(policy_doc: dict) -> str:
+    """Returns the SHA-256 hex digest of a policy document, computed over its JSON form with sorted keys and without
+    whitespace so that equal documents have equal digests.
+    """
+    return hashlib.sha256(
+        json.dumps(policy_doc, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+def intern_policy_document(policy_doc: dict) -> PolicyDocument:
+    """Returns the PolicyDocument for the contents of policy_doc, creating it if no live Policy uses those contents
+    yet. Interned documents are dropped once nothing references them.
+    """
+    digest = get_policy_digest(policy_doc)
+    result = _interned_documents.get(digest)
+    if result is None:
+        result = PolicyDocument(digest, policy_doc)
+        _interned_documents[digest] = result
+    return result
+
+
+def intern_stored_policy_document(digest: str, store) -> PolicyDocument:
+    """Returns the PolicyDocument for the document that a PolicyStore holds under digest. If no live Policy uses
+    those contents yet, the returned PolicyDocument decodes them from the store when they are first accessed.
+    """
+    result = _interned_documents.get(digest)
+    if result is None:
+        result = PolicyDocument(digest, None, store)
+        _interned_documents[digest] = result
+    return result
+
+
+def _check_policy_arn(arn: str) -> None:
+    """Helper function: raises a ValueError unless arn is the ARN of a principal or a policy"""
+    if arn is None or \
+            (':user/' not in arn and ':role/' not in arn and ':group/' not in arn and ':policy/' not in arn):
+        raise ValueError('The parameter arn must be a string representing a principal or policy ARN')
@@ -0,0 +1,165 @@
+"""Python module containing the PolicyStore class: a read-only, memory-mapped file of policy documents, keyed by their
+digests (see get_policy_digest).
+
+Policy documents are the bulk of a graph's data. Every process that loads a graph from a store maps the same file, so
+the operating system's page cache holds one copy of the encoded documents no matter how many processes (such as
+parallel edge-checking workers) use them, and each process only decodes the documents it actually touches.
+
+Layout, all integers little-endian:
+
+    header:  8-byte magic b'PMPOLDOC', uint32 format version, uint32 document count
+    index:   one entry per document, sorted by digest: 32-byte SHA-256 digest, uint64 offset, uint32 length
+    data:    each document as compact UTF-8 JSON, at its offset from the start of the file
+"""
+
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+from typing import Iterable, Optional, Tuple
+
+from principalmapper.common.policies import Policy
+
+
+STORE_MAGIC = b'PMPOLDOC'
+STORE_VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_INDEX_ENTRY = struct.Struct('<32sQI')
+
+
+class PolicyStore(object):
+    """A read-only view of a policy document store file, see the module docstring for its layout. The file is mapped
+    into memory when the store is opened and unmapped when the store is closed or garbage collected.
+
+    Stores are written by replacing the file (see write_policy_store), never by editing it in place, so an open store
+    keeps reading the documents it was opened with.
+    """
+
+    def __init__(self, filepath: str):
+        """Constructor. Raises a ValueError if the file is not a policy document store of a supported version."""
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _HEADER.size:
+                raise ValueError('The file at {} is too short to be a policy document store'.format(filepath))
+            magic, version, self._count = _HEADER.unpack_from(self._map, 0)
+            if magic != STORE_MAGIC:
+                raise ValueError('The file at {} is not a policy document store'.format(filepath))
+            if version != STORE_VERSION:
+                raise ValueError('The policy document store at {} has version {}, but only version {} is '
+                                 'supported'.format(filepath, version, STORE_VERSION))
+            if len(self._map) < _HEADER.size + self._count * _INDEX_ENTRY.size:
+                raise ValueError('The policy document store at {} is truncated'.format(filepath))
+        except ValueError:
+            self._map.close()
+            raise
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, digest: str) -> bool:
+        return self._find(digest) is not None
+
+    def close(self) -> None:
+        """Unmaps the file. Documents that were not decoded yet can no longer be read."""
+        self._map.close()
+
+    def get_encoded_document(self, digest: str) -> bytes:
+        """Returns the encoded (compact JSON) form of the document with the given hex digest. Raises a KeyError if the
+        store does not hold it.
+        """
+        location = self._find(digest)
+        if location is None:
+            raise KeyError('The policy document store at {} has no document with digest {}'.format(self.filepath,
+                                                                                                   digest))
+        offset, length = location
+        return self._map[offset:offset + length]
+
+    def load_document(self, digest: str) -> dict:
+        """Returns the decoded document with the given hex digest. Raises a KeyError if the store does not hold it."""
+        return json.loads(self.get_encoded_document(digest).decode('utf-8'))
+
+    def load_policy(self, arn: str, name: str, digest: str) -> Policy:
+        """Returns a Policy whose document is decoded from this store the first time it is accessed. Raises a
+        KeyError if the store does not hold the document.
+        """
+        if digest not in self:
+            raise KeyError('The policy document store at {} has no document with digest {}'.format(self.filepath,
+                                                                                                   digest))
+        return Policy.from_policy_store(arn, name, digest, self)
+
+    def _find(self, digest: str) -> Optional[Tuple[int, int]]:
+        """Helper function: binary search of the index for a hex digest, returns its (offset, length) or None"""
+        try:
+            key = bytes.fromhex(digest)
+        except (TypeError, ValueError):
+            return None
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_digest, offset, length = _INDEX_ENTRY.unpack_from(self._map, _HEADER.size +
+                                                                    middle * _INDEX_ENTRY.size)
+            if entry_digest == key:
+                return offset, length
+            elif entry_digest < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+def write_policy_store(filepath: str, policies: Iterable[Policy]) -> bool:
+    """Writes the documents of the given policies, once per distinct document, to a policy document store at filepath.
+    Returns True if the file was written, or False if it already held the same contents.
+
+    The new file is written next to the old one and moved over it, so processes that have the old store open keep
+    reading its documents.
+    """
+    documents = {}
+    for policy in policies:
+        if policy.digest not in documents:
+            documents[policy.digest] = json.dumps(policy.policy_doc, separators=(',', ':')).encode('utf-8')
+
+    digests = sorted(documents.keys())
+    offset = _HEADER.size + len(digests) * _INDEX_ENTRY.size
+    parts = [_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(digests))]
+    for digest in digests:
+        parts.append(_INDEX_ENTRY.pack(bytes.fromhex(digest), offset, len(documents[digest])))
+        offset += len(documents[digest])
+    parts.extend(documents[digest] for digest in digests)
+    contents = b''.join(parts)
+
+    if os.path.exists(filepath):
+        with open(filepath, 'rb') as f:
+            if f.read() == contents:
+                return False
+    fd, temp_filepath = tempfile.mkstemp(prefix='.policy_documents', dir=os.path.dirname(os.path.abspath(filepath)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contents)
+        os.replace(temp_filepath, filepath)
+    except BaseException:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
+    return True
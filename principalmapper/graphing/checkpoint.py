@@ -0,0 +1,130 @@
+"""Code for checkpointing the progress of graph creation to disk, so an interrupted run can resume where it stopped."""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import os.path
+import shutil
+from typing import Any, Dict, List
+
+
+class GraphCheckpoint(object):
+    """Tracks the completed stages of graph creation in a directory. Each stage's data is stored as a JSON document,
+    and stages that make progress in small steps (such as fetching the policies of each principal) append records to a
+    JSON Lines file instead. A new GraphCheckpoint object picks up whatever is already stored in its directory.
+
+    Structure:
+    | <directory parameter>
+    |---- state.json
+    |---- <stage>.json
+    |---- <stage>.jsonl
+
+    The directory holds everything needed to resume, so it can be copied to another host to run the remaining stages
+    (such as edge identification) there.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._state_path = os.path.join(directory, 'state.json')
+        if os.path.exists(self._state_path):
+            with open(self._state_path) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'completed_stages': []}
+
+    def has_stage(self, stage: str) -> bool:
+        """Returns True if the given stage was completed."""
+        return stage in self.state['completed_stages']
+
+    def load_stage(self, stage: str) -> Any:
+        """Returns the data stored for a completed stage. Raises a ValueError if the stage was not completed."""
+        if not self.has_stage(stage):
+            raise ValueError('The stage {} was not completed'.format(stage))
+        with open(os.path.join(self.directory, '{}.json'.format(stage))) as f:
+            return json.load(f)
+
+    def save_stage(self, stage: str, data: Any) -> None:
+        """Stores the data for a stage and marks it as completed."""
+        self._write_json(os.path.join(self.directory, '{}.json'.format(stage)), data)
+        if stage not in self.state['completed_stages']:
+            self.state['completed_stages'].append(stage)
+        self._write_json(self._state_path, self.state)
+
+    def load_records(self, stage: str) -> List[dict]:
+        """Returns the records appended so far for a stage. A record cut short by an interruption is ignored."""
+        result = []
+        records_path = os.path.join(self.directory, '{}.jsonl'.format(stage))
+        if not os.path.exists(records_path):
+            return result
+        with open(records_path) as f:
+            for line in f:
+                try:
+                    result.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return result
+
+    def load_records_by_key(self, stage: str, key: str) -> Dict[str, dict]:
+        """Returns the records appended so far for a stage, in a dictionary keyed by the given field of each record."""
+        return {record[key]: record for record in self.load_records(stage)}
+
+    def get_records_path(self, stage: str) -> str:
+        """Returns the path of the JSON Lines file holding the records of a stage, for writers that append records
+        themselves (such as an EdgeStreamWriter). Creates the checkpoint directory if needed.
+        """
+        self._make_directory()
+        return os.path.join(self.directory, '{}.jsonl'.format(stage))
+
+    def clear_records(self, stage: str) -> None:
+        """Deletes the records appended so far for a stage."""
+        records_path = os.path.join(self.directory, '{}.jsonl'.format(stage))
+        if os.path.exists(records_path):
+            os.remove(records_path)
+
+    def append_record(self, stage: str, record: dict) -> None:
+        """Appends a record to a stage that makes progress in small steps."""
+        self._make_directory()
+        old_umask = os.umask(0o077)
+        try:
+            with open(os.path.join(self.directory, '{}.jsonl'.format(stage)), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            os.umask(old_umask)
+
+    def clear(self) -> None:
+        """Deletes everything stored in the checkpoint directory."""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        self.state = {'completed_stages': []}
+
+    def _make_directory(self) -> None:
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, 0o700)
+
+    def _write_json(self, filepath: str, data: Any) -> None:
+        # write to a temporary file, then rename, so an interruption never leaves a truncated file behind
+        self._make_directory()
+        old_umask = os.umask(0o077)
+        try:
+            temp_path = filepath + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, filepath)
+        finally:
+            os.umask(old_umask)
@@ -17,73 +17,90 @@
 
 import io
 import os
-from typing import List
-
-from botocore.exceptions import ClientError
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
+from principalmapper.graphing.regional_inventory import RegionalInventory
 from principalmapper.querying import query_interface
-from principalmapper.querying.local_policy_simulation import resource_policy_authorization, ResourcePolicyEvalResult
+from principalmapper.querying.local_policy_simulation import get_permission_summary, resource_policy_authorization, \
+    ResourcePolicyEvalResult
 from principalmapper.util import arns
 
 
+@register_edge_checker('cloudformation')
 class CloudFormationEdgeChecker(EdgeChecker):
     """Class for identifying if CloudFormation can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges."""
-        result = []
+    destination_types = ('role',)
+    inventory_services = ('cloudformation',)
+
+    def __init__(self, session, inventory: Optional[RegionalInventory] = None):
+        super().__init__(session, inventory)
+        self._stack_list = None
 
-        # Grab existing stacks in each region
-        cloudformation_clients = []
+    def prefetch(self, output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> None:
+        """Starts listing the CloudFormation stacks of every region."""
         if self.session is not None:
-            print('Searching through CloudFormation-supported regions for existing functions.')
-            cf_regions = self.session.get_available_regions('cloudformation')
-            for region in cf_regions:
-                cloudformation_clients.append(self.session.create_client('cloudformation', region_name=region))
-
-        # grab existing cloudformation stacks
-        stack_list = []
-        for cf_client in cloudformation_clients:
-            try:
-                paginator = cf_client.get_paginator('describe_stacks')
-                for page in paginator.paginate():
-                    for stack in page['Stacks']:
-                        if stack['StackStatus'] not in ['CREATE_FAILED', 'DELETE_COMPLETE', 'DELETE_FAILED',
-                                                        'DELETE_IN_PROGRESS']:  # ignore unusable stacks
-                            stack_list.append(stack)
-            except ClientError:
-                output.write('Encountered an exception when listing stacks in the region {}\n'.format(
-                    cf_client.meta.region_name))
+            print('Searching through CloudFormation-supported regions for existing stacks.')
+            self._get_inventory().scan('cloudformation', _list_stacks, output, debug)
+
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges."""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        stack_list = self._get_stack_list(output, debug)
+        stacks_by_role = _index_stacks_by_role(stack_list)
+        cloudformation_assumable_roles = {}  # cache of (account ID, role ARN) -> if CloudFormation can assume the role
 
         # For each node...
-        for node_source in nodes:
-            for node_destination in nodes:
+        for node_source in source_nodes:
+            # skip sources that cannot call any CloudFormation actions
+            if not get_permission_summary(node_source).could_allow_service('cloudformation'):
+                continue
+
+            # check if source is an admin: if so, it can access destination but this is not tracked via an Edge
+            if node_source.is_admin:
+                continue
+
+            # check which stacks the source can change, once per source: unless its policies refer to the role passed
+            # to CloudFormation, the stack it can update to pass a new role is the same for every destination
+            role_arn_dependent = 'cloudformation:RoleArn' in \
+                query_interface.get_referenced_condition_keys_for_node(node_source)
+            updatable_stacks_by_role, change_set_stacks_by_role, pass_role_stack = self._get_stack_capabilities(
+                node_source, stack_list, stacks_by_role, role_arn_dependent, debug
+            )
+
+            source_account = arns.get_account_id(node_source.arn)
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
 
-                # check if source is an admin: if so, it can access destination but this is not tracked via an Edge
-                if node_source.is_admin:
-                    continue
-
                 # check if the destination is a role
                 if ':role/' not in node_destination.arn:
                     continue
 
                 # check that the destination role can be assumed by CloudFormation
-                sim_result = resource_policy_authorization(
-                    'cloudformation.amazonaws.com',
-                    arns.get_account_id(node_source.arn),
-                    node_destination.trust_policy,
-                    'sts:AssumeRole',
-                    node_destination.arn,
-                    {},
-                    debug
-                )
-
-                if sim_result != ResourcePolicyEvalResult.SERVICE_MATCH:
+                assumable_key = (source_account, node_destination.arn)
+                if assumable_key not in cloudformation_assumable_roles:
+                    sim_result = resource_policy_authorization(
+                        'cloudformation.amazonaws.com',
+                        source_account,
+                        node_destination.trust_policy,
+                        'sts:AssumeRole',
+                        node_destination.arn,
+                        {},
+                        debug
+                    )
+                    cloudformation_assumable_roles[assumable_key] = \
+                        sim_result == ResourcePolicyEvalResult.SERVICE_MATCH
+                if not cloudformation_assumable_roles[assumable_key]:
                     continue  # CloudFormation wasn't auth'd to assume the role
 
                 # Get iam:PassRole info
@@ -111,84 +128,158 @@ class CloudFormationEdgeChecker(EdgeChecker):
                         if need_mfa_passrole or need_mfa_create:
                             reason = '(MFA required) ' + reason
 
-                        result.append(Edge(node_source, node_destination, reason))
-
-                relevant_stacks = []  # we'll reuse this for *ChangeSet
-                for stack in stack_list:
-                    if 'RoleArn' in stack:
-                        if stack['RoleARN'] == node_destination.arn:
-                            relevant_stacks.append(stack)
+                        new_edge = Edge(node_source, node_destination, reason)
+                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                        yield new_edge
 
                 # See if source can call UpdateStack to use the current role of a stack (setting a new template)
-                for stack in relevant_stacks:
-                    can_update, need_mfa_update = query_interface.local_check_authorization_handling_mfa(
-                        node_source,
-                        'cloudformation:UpdateStack',
-                        stack['StackId'],
-                        {'cloudformation:RoleArn': node_destination.arn},
-                        debug
+                if node_destination.arn in updatable_stacks_by_role:
+                    stack, need_mfa_update = updatable_stacks_by_role[node_destination.arn]
+                    reason = 'can update the CloudFormation stack {} to access'.format(
+                        stack['StackId']
                     )
-                    if can_update:
-                        reason = 'can update the CloudFormation stack {} to access'.format(
-                            stack['StackId']
-                        )
-                        if need_mfa_update:
-                            reason = '(MFA required) ' + reason
+                    if need_mfa_update:
+                        reason = '(MFA required) ' + reason
 
-                        result.append(Edge(node_source, node_destination, reason))
-                        break  # let's save ourselves having to dig into every CF stack edge possible
+                    new_edge = Edge(node_source, node_destination, reason)
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
 
-                # See if source can call UpdateStack to pass a new role to a stack and use it
+                # See if source can call UpdateStack to pass a new role to a stack and use it (the RoleArn condition
+                # key is the destination here, so this is only checked per destination if the source's policies refer
+                # to it)
                 if can_pass_role:
-                    for stack in stack_list:
-                        can_update, need_mfa_update = query_interface.local_check_authorization_handling_mfa(
-                            node_source,
-                            'cloudformation:UpdateStack',
-                            stack['StackId'],
-                            {'cloudformation:RoleArn': node_destination.arn},
-                            debug
+                    if role_arn_dependent:
+                        pass_role_stack = _find_updatable_stack(node_source, stack_list, node_destination.arn, debug)
+                    if pass_role_stack is not None:
+                        stack, need_mfa_update = pass_role_stack
+                        reason = 'can update the CloudFormation stack {} and pass the role to access'.format(
+                            stack['StackId']
                         )
+                        if need_mfa_update or need_mfa_passrole:
+                            reason = '(MFA required) ' + reason
 
-                        if can_update:
-                            reason = 'can update the CloudFormation stack {} and pass the role to access'.format(
-                                stack['StackId']
-                            )
-                            if need_mfa_update or need_mfa_passrole:
-                                reason = '(MFA required) ' + reason
-
-                            result.append(Edge(node_source, node_destination, reason))
-                            break  # save ourselves from digging into all CF stack edges possible
+                        new_edge = Edge(node_source, node_destination, reason)
+                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                        yield new_edge
 
                 # See if source can call CreateChangeSet and ExecuteChangeSet to alter a stack with a given role
-                for stack in relevant_stacks:
-                    can_make_cs, need_mfa_make = query_interface.local_check_authorization_handling_mfa(
-                        node_source,
-                        'cloudformation:CreateChangeSet',
-                        stack['StackId'],
-                        {'cloudformation:RoleArn': node_destination.arn},
-                        debug
+                if node_destination.arn in change_set_stacks_by_role:
+                    stack, need_mfa_change_set = change_set_stacks_by_role[node_destination.arn]
+                    reason = 'can create and execute a changeset in CloudFormation for stack {} to access'.format(
+                        stack['StackId']
                     )
-                    if not can_make_cs:
-                        continue
+                    if need_mfa_change_set:
+                        reason = '(MFA required) ' + reason
 
-                    can_exe_cs, need_mfa_exe = query_interface.local_check_authorization_handling_mfa(
-                        node_source,
-                        'cloudformation:ExecuteChangeSet',
-                        stack['StackId'],
-                        {},  # docs say no RoleArn context here
-                        debug
-                    )
+                    new_edge = Edge(node_source, node_destination, reason)
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
 
-                    if can_exe_cs:
-                        reason = 'can create and execute a changeset in CloudFormation for stack {} to access'.format(
-                            stack['StackId']
-                        )
-                        if need_mfa_make or need_mfa_exe:
-                            reason = '(MFA required) ' + reason
+    def _get_stack_capabilities(self, node_source: Node, stack_list: List[dict], stacks_by_role: Dict[str, List[dict]],
+                                role_arn_dependent: bool, debug: bool = False) \
+            -> Tuple[Dict[str, Tuple[dict, bool]], Dict[str, Tuple[dict, bool]], Optional[Tuple[dict, bool]]]:
+        """Checks which stacks a source can change, once per source. Returns two dictionaries mapping role ARNs to the
+        first stack with that role (and if that requires MFA) that the source can call UpdateStack on, and that the
+        source can call CreateChangeSet and ExecuteChangeSet on. Then returns the first stack (and if that requires
+        MFA) the source can call UpdateStack on whatever role it passes, or None if there is none or role_arn_dependent
+        is True (the source's policies refer to cloudformation:RoleArn, so the passed role has to be checked).
+        """
+        updatable_stacks_by_role = {}
+        change_set_stacks_by_role = {}
+        pass_role_stack = None
+        if not role_arn_dependent:
+            # UpdateStack is allowed or not whatever the role, so each stack is checked once
+            for stack in stack_list:
+                can_update, need_mfa_update = query_interface.local_check_authorization_handling_mfa(
+                    node_source,
+                    'cloudformation:UpdateStack',
+                    stack['StackId'],
+                    {'cloudformation:RoleArn': stack.get('RoleARN', '')},
+                    debug
+                )
+                if can_update:
+                    if pass_role_stack is None:
+                        pass_role_stack = (stack, need_mfa_update)
+                    if 'RoleARN' in stack:
+                        updatable_stacks_by_role.setdefault(stack['RoleARN'], (stack, need_mfa_update))
+
+        for role_arn, stacks in stacks_by_role.items():
+            if role_arn_dependent:
+                updatable_stack = _find_updatable_stack(node_source, stacks, role_arn, debug)
+                if updatable_stack is not None:
+                    updatable_stacks_by_role[role_arn] = updatable_stack
+
+            for stack in stacks:
+                can_make_cs, need_mfa_make = query_interface.local_check_authorization_handling_mfa(
+                    node_source,
+                    'cloudformation:CreateChangeSet',
+                    stack['StackId'],
+                    {'cloudformation:RoleArn': role_arn},
+                    debug
+                )
+                if not can_make_cs:
+                    continue
+
+                can_exe_cs, need_mfa_exe = query_interface.local_check_authorization_handling_mfa(
+                    node_source,
+                    'cloudformation:ExecuteChangeSet',
+                    stack['StackId'],
+                    {},  # docs say no RoleArn context here
+                    debug
+                )
+                if can_exe_cs:
+                    change_set_stacks_by_role[role_arn] = (stack, need_mfa_make or need_mfa_exe)
+                    break  # save ourselves from digging into all CF stack edges possible
+        return updatable_stacks_by_role, change_set_stacks_by_role, pass_role_stack
+
+    def _get_stack_list(self, output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> List[dict]:
+        """Lists the usable CloudFormation stacks of every region, once per EdgeChecker object. Returns an empty list in
+        offline mode.
+        """
+        if self._stack_list is None:
+            if self.session is None:
+                self._stack_list = []
+            else:
+                self.prefetch(output, debug)
+                self._stack_list = self._get_inventory().scan('cloudformation', _list_stacks).result()
+        return self._stack_list
+
+
+def _list_stacks(cf_client) -> List[dict]:
+    """Helper function: returns the usable CloudFormation stacks of the region of the passed client"""
+    result = []
+    paginator = cf_client.get_paginator('describe_stacks')
+    for page in paginator.paginate():
+        for stack in page['Stacks']:
+            if stack['StackStatus'] not in ['CREATE_FAILED', 'DELETE_COMPLETE', 'DELETE_FAILED',
+                                            'DELETE_IN_PROGRESS']:  # ignore unusable stacks
+                result.append(stack)
+    return result
+
+
+def _find_updatable_stack(node_source: Node, stacks: List[dict], role_arn: str,
+                          debug: bool = False) -> Optional[Tuple[dict, bool]]:
+    """Helper function: returns the first of the stacks (and if that requires MFA) that the source can call UpdateStack
+    on while passing the given role, or None if there is none
+    """
+    for stack in stacks:
+        can_update, need_mfa_update = query_interface.local_check_authorization_handling_mfa(
+            node_source,
+            'cloudformation:UpdateStack',
+            stack['StackId'],
+            {'cloudformation:RoleArn': role_arn},
+            debug
+        )
+        if can_update:
+            return stack, need_mfa_update
+    return None  # no need to dig into every CF stack edge possible
 
-                        result.append(Edge(node_source, node_destination, reason))
-                        break  # save ourselves from digging into all CF stack edges possible
 
-        for edge in result:
-            output.write("Found new edge: {}\n".format(edge.describe_edge()))
-        return result
+def _index_stacks_by_role(stack_list: List[dict]) -> Dict[str, List[dict]]:
+    """Helper function: returns the stacks that have a service role, grouped by the ARN of that role"""
+    result = {}
+    for stack in stack_list:
+        if 'RoleARN' in stack:
+            result.setdefault(stack['RoleARN'], []).append(stack)
+    return result
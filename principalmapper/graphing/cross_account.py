@@ -0,0 +1,228 @@
+"""Code for identifying edges between the IAM principals of different AWS accounts, over a merged view of the graphs
+stored for many accounts.
+
+Checking every principal of every account against every role of every other account does not scale to hundreds of
+accounts, so roles are indexed by the foreign accounts their trust policies name. A principal is only checked against
+the roles that trust its account (by account ID, root ARN, principal ARN, or unique ID) and the roles that trust any
+principal ('*').
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import os
+import os.path
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from principalmapper.common import Edge, Graph, Node
+from principalmapper.querying import query_interface
+from principalmapper.querying.local_policy_simulation import get_permission_summary, resource_policy_authorization, \
+    ResourcePolicyEvalResult
+from principalmapper.util import arns
+from principalmapper.util.debug_print import dprint
+from principalmapper.util.storage import get_storage_root
+
+
+class TrustPolicyIndex(object):
+    """Index of roles by the foreign accounts that their trust policies name in the AWS element of an Allow statement's
+    Principal. Roles whose trust policies allow any principal ('*', or a NotPrincipal element) are kept separately, as
+    they are candidates for every account. Conditions and actions are not considered, so the index only narrows down
+    which roles to check, it does not decide edges.
+
+    Unique IDs (such as AIDA...) in trust policies are resolved through the nodes passed when building the index.
+    """
+
+    def __init__(self, nodes: Iterable[Node]):
+        nodes = list(nodes)
+        accounts_by_id_value = {node.id_value: arns.get_account_id(node.arn) for node in nodes}
+        self.roles_by_account = {}  # type: Dict[str, List[Node]]
+        self.wildcard_roles = []  # type: List[Node]
+        for node in nodes:
+            if ':role/' not in node.arn or node.trust_policy is None:
+                continue
+            role_account = arns.get_account_id(node.arn)
+            trusted_accounts = _get_trusted_accounts(node.trust_policy, accounts_by_id_value)
+            if trusted_accounts is None:
+                self.wildcard_roles.append(node)
+                continue
+            for account in trusted_accounts:
+                if account != role_account:
+                    self.roles_by_account.setdefault(account, []).append(node)
+
+    def get_candidates(self, account_id: str) -> List[Node]:
+        """Returns the roles of other accounts that a principal of the given account might be able to assume."""
+        result = list(self.roles_by_account.get(account_id, []))
+        result.extend(role for role in self.wildcard_roles if arns.get_account_id(role.arn) != account_id)
+        return result
+
+
+class MultiAccountGraph(object):
+    """A merged, read-only view over the graphs of many accounts. The nodes and edges of each account's graph are left
+    as they are, edges between accounts are kept in cross_account_edges (see identify_cross_account_edges).
+    """
+
+    def __init__(self, graphs: List[Graph]):
+        self.graphs = graphs
+        self.graphs_by_account = {}  # type: Dict[str, Graph]
+        for graph in graphs:
+            if graph.metadata['account_id'] in self.graphs_by_account:
+                raise ValueError('More than one graph for the account {}'.format(graph.metadata['account_id']))
+            self.graphs_by_account[graph.metadata['account_id']] = graph
+        self.cross_account_edges = []  # type: List[Edge]
+        self._nodes_by_arn = {node.arn: node for graph in graphs for node in graph.nodes}
+
+    @property
+    def nodes(self) -> List[Node]:
+        """Every node of every account."""
+        return [node for graph in self.graphs for node in graph.nodes]
+
+    @property
+    def edges(self) -> List[Edge]:
+        """Every edge within an account, then every edge between accounts."""
+        result = [edge for graph in self.graphs for edge in graph.edges]
+        result.extend(self.cross_account_edges)
+        return result
+
+    def get_node_by_arn(self, arn: str) -> Optional[Node]:
+        """Returns the node with the given ARN from any account, or None."""
+        return self._nodes_by_arn.get(arn)
+
+    def identify_cross_account_edges(self, output: Optional[io.StringIO] = None,
+                                     debug: bool = False) -> List[Edge]:
+        """Finds the sts:AssumeRole edges between accounts, storing them in cross_account_edges and returning them."""
+        self.cross_account_edges = list(iter_cross_account_edges(self.nodes, output, debug))
+        return self.cross_account_edges
+
+
+def load_multi_account_graph(account_ids: Optional[Iterable[str]] = None,
+                             debug: bool = False) -> MultiAccountGraph:
+    """Returns a MultiAccountGraph of the graphs stored in the standard location for the given accounts, or for every
+    account with a stored graph if account_ids is None. Directories holding no graph (such as one with only the
+    checkpoint of an unfinished run) are skipped in that case.
+    """
+    storage_root = get_storage_root()
+    if account_ids is not None:
+        return MultiAccountGraph([Graph.create_graph_from_local_disk(os.path.join(storage_root, account_id))
+                                  for account_id in account_ids])
+
+    graphs = []
+    for account_id in sorted(os.listdir(storage_root)):
+        graph_dir = os.path.join(storage_root, account_id)
+        if not os.path.exists(os.path.join(graph_dir, 'metadata.json')):
+            dprint(debug, 'Skipping {}, it holds no graph'.format(graph_dir))
+            continue
+        graphs.append(Graph.create_graph_from_local_disk(graph_dir))
+    return MultiAccountGraph(graphs)
+
+
+def iter_cross_account_edges(nodes: List[Node], output: Optional[io.StringIO] = None,
+                             debug: bool = False) -> Iterator[Edge]:
+    """Yields the sts:AssumeRole edges from nodes of one account to roles of another. Like same-account edges, these
+    need the role's trust policy to allow the source (a DIFF_ACCOUNT_MATCH) and, since the source is in another
+    account, the source's own policies to allow it too. Admins are checked as well, being an admin of one account
+    grants nothing in another.
+    """
+    if output is None:
+        output = io.StringIO()
+    index = TrustPolicyIndex(nodes)
+    nodes_by_account = {}  # type: Dict[str, List[Node]]
+    for node in nodes:
+        nodes_by_account.setdefault(arns.get_account_id(node.arn), []).append(node)
+
+    checked_pairs = 0
+    found = 0
+    for account_id, source_nodes in nodes_by_account.items():
+        candidates = index.get_candidates(account_id)
+        if len(candidates) == 0:
+            continue
+        source_nodes = [node for node in source_nodes
+                        if get_permission_summary(node).could_allow_action('sts:AssumeRole')]
+        dprint(debug, 'Checking {} principals of {} against {} roles of other accounts'.format(
+            len(source_nodes), account_id, len(candidates)))
+        for node_source in source_nodes:
+            for node_destination in candidates:
+                checked_pairs += 1
+                edge = _check_assume_role(node_source, node_destination, debug)
+                if edge is not None:
+                    found += 1
+                    # searchable names leave out the account, so the full ARNs are written
+                    output.write('Found new edge: {} {} {}\n'.format(edge.source.arn, edge.reason,
+                                                                    edge.destination.arn))
+                    yield edge
+
+    output.write('Found {} cross-account edges from {} candidate pairs ({} roles indexed by trusted account, {} '
+                 'roles trusting any principal)\n'.format(found, checked_pairs,
+                                                          sum(len(x) for x in index.roles_by_account.values()),
+                                                          len(index.wildcard_roles)))
+
+
+def _check_assume_role(node_source: Node, node_destination: Node, debug: bool) -> Optional[Edge]:
+    """Helper function: returns the edge from a node to a role of another account, if it can assume the role"""
+    sim_result = resource_policy_authorization(
+        node_source,
+        arns.get_account_id(node_destination.arn),
+        node_destination.trust_policy,
+        'sts:AssumeRole',
+        node_destination.arn,
+        {},
+        debug,
+        match_wildcard_principal=True
+    )
+    if sim_result != ResourcePolicyEvalResult.DIFF_ACCOUNT_MATCH:
+        return None  # no match or an explicit deny
+
+    assume_auth, need_mfa = query_interface.local_check_authorization_handling_mfa(
+        node_source, 'sts:AssumeRole', node_destination.arn, {}, debug
+    )
+    if not assume_auth:
+        return None
+    if need_mfa:
+        return Edge(node_source, node_destination, '(requires MFA) can access via sts:AssumeRole')
+    return Edge(node_source, node_destination, 'can access via sts:AssumeRole')
+
+
+def _get_trusted_accounts(trust_policy: dict, accounts_by_id_value: Dict[str, str]) -> Optional[Set[str]]:
+    """Helper function: returns the accounts named as AWS principals by the Allow statements of a trust policy, or None
+    if the trust policy allows any principal. Unique IDs of unknown principals are left out.
+    """
+    result = set()
+    statements = trust_policy.get('Statement', [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    for statement in statements:
+        if statement.get('Effect') != 'Allow':
+            continue
+        if 'NotPrincipal' in statement:
+            return None
+        principal = statement.get('Principal', {})
+        if principal == '*':
+            return None
+        aws_principals = principal.get('AWS', []) if isinstance(principal, dict) else []
+        if isinstance(aws_principals, str):
+            aws_principals = [aws_principals]
+        for value in aws_principals:
+            if value == '*':
+                return None
+            elif value.startswith('arn:'):
+                account = arns.get_account_id(value)
+                if '*' in account or '?' in account:
+                    return None
+                result.add(account)
+            elif value.isdigit():
+                result.add(value)
+            elif value in accounts_by_id_value:
+                result.add(accounts_by_id_value[value])
+    return result
@@ -18,24 +18,38 @@
 
 import io
 import os
-from typing import List
+from typing import Iterator, List, Optional
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
 from principalmapper.querying import query_interface
-from principalmapper.querying.local_policy_simulation import resource_policy_authorization, ResourcePolicyEvalResult
+from principalmapper.querying.local_policy_simulation import get_permission_summary, resource_policy_authorization, \
+    ResourcePolicyEvalResult
 from principalmapper.util import arns
 
 
+@register_edge_checker('ec2')
 class EC2EdgeChecker(EdgeChecker):
     """Class for identifying if EC2 can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges."""
-        result = []
+    destination_types = ('role',)
 
-        for node_source in nodes:
-            for node_destination in nodes:
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges."""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        for node_source in source_nodes:
+            # skip sources that cannot pass a role and run an instance
+            summary = get_permission_summary(node_source)
+            if not (summary.could_allow_action('iam:PassRole') and summary.could_allow_action('ec2:RunInstances')):
+                continue
+
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
@@ -111,7 +125,7 @@ class EC2EdgeChecker(EdgeChecker):
                     mfa_needed = True
 
                 if create_instance_res:
-                    if iprofile is not '*':
+                    if iprofile != '*':
                         reason = 'can use EC2 to run an instance with an existing instance profile to access'
                     else:
                         reason = 'can use EC2 to run an instance with a newly created instance profile to access'
@@ -124,7 +138,7 @@ class EC2EdgeChecker(EdgeChecker):
                         reason
                     )
                     output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                    result.append(new_edge)
+                    yield new_edge
 
                 # check if source can run an instance without an instance profile then add the profile, add edge if so
                 create_instance_res, mfa_res = query_interface.local_check_authorization_handling_mfa(
@@ -147,7 +161,7 @@ class EC2EdgeChecker(EdgeChecker):
                         debug
                     )
 
-                    if iprofile is not '*':
+                    if iprofile != '*':
                         reason = 'can use EC2 to run an instance and then associate an existing instance profile to ' \
                                  'access'
                     else:
@@ -164,6 +178,4 @@ class EC2EdgeChecker(EdgeChecker):
                             reason
                         )
                         output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                        result.append(new_edge)
-
-        return result
+                        yield new_edge
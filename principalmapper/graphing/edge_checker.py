@@ -18,23 +18,101 @@
 
 import io
 import os
-from typing import List
-
-import botocore.session
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Type
 
 from principalmapper.common import Edge, Node
+from principalmapper.graphing.regional_inventory import RegionalInventory
+
+if TYPE_CHECKING:
+    import botocore.session
 
 
 class EdgeChecker(object):
-    """Base class for all edge-identifying classes."""
+    """Base class for all edge-identifying classes. Subclasses are made available to obtain_edges by decorating them
+    with register_edge_checker, or through a 'principalmapper.edge_checkers' entry point in a separate package.
+
+    The class attributes below describe a checker, so obtain_edges can schedule it and skip work up front:
+
+    * source_types and destination_types: the node types ('user' or 'role') the checker can find edges from and to
+    * requires_network: if the checker cannot find any edges without a session (in offline mode)
+    * inventory_services: the services whose regional resources the checker lists through a RegionalInventory
+    """
+
+    source_types = ('user', 'role')
+    destination_types = ('user', 'role')
+    requires_network = False
+    inventory_services = ()
 
-    def __init__(self, session: botocore.session.Session):
+    def __init__(self, session: 'botocore.session.Session', inventory: Optional[RegionalInventory] = None):
+        """Constructor. Checkers that list resources across regions use the passed RegionalInventory, which may be
+        shared by several checkers, or create their own.
+        """
         self.session = session
+        self.inventory = inventory
+
+    def prefetch(self, output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> None:
+        """Starts gathering any data the checker needs from the AWS API in the background, so it overlaps with other
+        work before return_edges is called. Subclasses that call the AWS API may override this, the default does
+        nothing.
+        """
+
+    def _get_inventory(self) -> RegionalInventory:
+        """Returns the RegionalInventory to list regional resources with, creating one if none was passed."""
+        if self.inventory is None:
+            self.inventory = RegionalInventory(self.session)
+        return self.inventory
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
         """Expect subclasses to override. Given a list of nodes, the EdgeChecker should be able to use its session
         object in order to make clients and call the AWS API to resolve information about the account. Then,
-        with this information, it should return a list of edges between the passed nodes.
+        with this information, it should yield the edges between the passed nodes as they are found, so callers can
+        store them without holding every edge in memory.
+
+        If source_nodes or destination_nodes is passed, only edges with a source in source_nodes and a destination in
+        destination_nodes are checked for. Each defaults to nodes.
+
+        Subclasses written before iter_edges existed override return_edges(nodes, output, debug) instead, the default
+        yields its result, leaving out edges that are not from source_nodes to destination_nodes.
         """
-        raise NotImplementedError('The return_edges method should not be called from EdgeChecker, but rather from an '
-                                  'object that subclasses EdgeChecker')
+        if type(self).return_edges is EdgeChecker.return_edges:
+            raise NotImplementedError('The iter_edges method should not be called from EdgeChecker, but rather from '
+                                      'an object that subclasses EdgeChecker')
+        source_set = set(source_nodes) if source_nodes is not None else None
+        destination_set = set(destination_nodes) if destination_nodes is not None else None
+        for edge in self.return_edges(nodes, output, debug):
+            if (source_set is None or edge.source in source_set) and \
+                    (destination_set is None or edge.destination in destination_set):
+                yield edge
+
+    def return_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                     source_nodes: Optional[List[Node]] = None,
+                     destination_nodes: Optional[List[Node]] = None) -> List[Edge]:
+        """Returns a list of the edges found by iter_edges."""
+        return list(self.iter_edges(nodes, output, debug, source_nodes, destination_nodes))
+
+
+# Every registered EdgeChecker subclass, by name (see register_edge_checker)
+registered_checkers = {}  # type: Dict[str, Type[EdgeChecker]]
+
+
+def register_edge_checker(name: str) -> Callable[[Type[EdgeChecker]], Type[EdgeChecker]]:
+    """Class decorator: registers an EdgeChecker subclass under the given name, which is how checker lists passed to
+    obtain_edges refer to it. Raises a ValueError if another class is registered under that name.
+    """
+    def _register(checker_class: Type[EdgeChecker]) -> Type[EdgeChecker]:
+        if not issubclass(checker_class, EdgeChecker):
+            raise ValueError('Only subclasses of EdgeChecker can be registered, not {}'.format(checker_class))
+        if registered_checkers.get(name, checker_class) is not checker_class:
+            raise ValueError('An edge checker is already registered under the name {}'.format(name))
+        registered_checkers[name] = checker_class
+        return checker_class
+    return _register
+
+
+def get_node_type(node: Node) -> str:
+    """Returns the type of a node, as used by the source_types and destination_types of EdgeChecker: 'user' or
+    'role'.
+    """
+    return 'user' if ':user/' in node.arn else 'role'
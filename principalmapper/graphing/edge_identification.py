@@ -17,42 +17,283 @@
 
 import io
 import os
-from typing import List, Optional
-
-import boto3.session
+import sys
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.cloudformation_edges import CloudFormationEdgeChecker
-from principalmapper.graphing.ec2_edges import EC2EdgeChecker
-from principalmapper.graphing.iam_edges import IAMEdgeChecker
-from principalmapper.graphing.lambda_edges import LambdaEdgeChecker
-from principalmapper.graphing.ssm_edges import SSMEdgeChecker
-from principalmapper.graphing.sts_edges import STSEdgeChecker
+# the built-in checkers register themselves when their modules are imported
+from principalmapper.graphing import cloudformation_edges, ec2_edges, iam_edges, lambda_edges, ssm_edges, sts_edges
+from principalmapper.graphing.edge_checker import EdgeChecker, get_node_type, register_edge_checker, \
+    registered_checkers
+from principalmapper.graphing.regional_inventory import RegionalInventory
+from principalmapper.querying import profiling, query_interface
 from principalmapper.util.debug_print import dprint
 
+if TYPE_CHECKING:
+    import botocore.session
+
+
+# Externally referable dictionary with all the supported edge-checking types: the registered EdgeChecker subclasses,
+# by name, including those of plugins once ensure_plugin_checkers has run
+checker_map = registered_checkers
+
+
+# Entry point group that packages outside of Principal Mapper register their EdgeChecker subclasses under
+PLUGIN_ENTRY_POINT_GROUP = 'principalmapper.edge_checkers'
+
+# Set once ensure_plugin_checkers has looked for plugins, so the entry points are only walked once per process
+_plugins_loaded = False
+
+
+class EdgeCheckerStats(object):
+    """Tracks the cost of running one edge checker during obtain_edges: the wall time, how many node pairs it was
+    given, how many local authorization checks it made, and how many edges it found. If the checker was not run,
+    skipped holds the reason.
+    """
+
+    __slots__ = ['name', 'seconds', 'pairs', 'evaluations', 'edges', 'skipped']
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.pairs = 0
+        self.evaluations = 0
+        self.edges = 0
+        self.skipped = None
+
+    def describe(self) -> str:
+        """Returns a one-line summary of the stats."""
+        if self.skipped is not None:
+            return 'edge check for {}: skipped, {}'.format(self.name, self.skipped)
+        return 'edge check for {}: {} edges from {} node pairs in {:.3f} seconds, {} authorization checks'.format(
+            self.name, self.edges, self.pairs, self.seconds, self.evaluations)
+
+
+def load_plugin_checkers(debug: bool = False) -> List[str]:
+    """Registers the EdgeChecker subclasses of installed packages, found through the 'principalmapper.edge_checkers'
+    entry point group, and returns their names. A plugin that fails to load is reported and left out.
+    """
+    result = []
+    try:
+        entry_points = _get_entry_points(PLUGIN_ENTRY_POINT_GROUP)
+    except Exception as ex:
+        sys.stderr.write('Unable to look up edge checker plugins: {}\n'.format(ex))
+        return result
+    for entry_point in entry_points:
+        try:
+            if entry_point.name in checker_map:
+                continue
+            register_edge_checker(entry_point.name)(entry_point.load())
+            result.append(entry_point.name)
+        except Exception as ex:
+            sys.stderr.write('Unable to load the edge checker plugin {}: {}\n'.format(
+                getattr(entry_point, 'name', entry_point), ex))
+    dprint(debug, 'Loaded edge checker plugins: {}'.format(result))
+    return result
+
+
+def ensure_plugin_checkers(debug: bool = False) -> None:
+    """Calls load_plugin_checkers the first time it is called, so plugins are only looked for once graph building
+    needs them rather than whenever this module is imported. Callers that read checker_map before running the edge
+    checks should call this first.
+    """
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    load_plugin_checkers(debug)
+
+
+def obtain_edges(session: Optional['botocore.session.Session'], checker_list: Iterable[str], nodes: List[Node],
+                 output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                 existing_edges: Optional[List[Edge]] = None, changed_nodes: Optional[Iterable[Node]] = None,
+                 changed_sources: Optional[Iterable[Node]] = None,
+                 changed_destinations: Optional[Iterable[Node]] = None,
+                 stats: Optional[List[EdgeCheckerStats]] = None) -> List[Edge]:
+    """Given a list of nodes and a botocore Session, return a list of edges between those nodes. Only checks
+    against services passed in the checker_list param. See iter_edges for the other parameters.
+    """
+    return list(iter_edges(session, checker_list, nodes, output, debug, existing_edges, changed_nodes,
+                           changed_sources, changed_destinations, stats))
+
+
+def iter_edges(session: Optional['botocore.session.Session'], checker_list: Iterable[str], nodes: List[Node],
+               output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+               existing_edges: Optional[List[Edge]] = None, changed_nodes: Optional[Iterable[Node]] = None,
+               changed_sources: Optional[Iterable[Node]] = None,
+               changed_destinations: Optional[Iterable[Node]] = None,
+               stats: Optional[List[EdgeCheckerStats]] = None) -> Iterator[Edge]:
+    """Given a list of nodes and a botocore Session, yields the edges between those nodes as the checkers find them,
+    so they can be stored (see EdgeStreamWriter) without holding every edge in memory. Only checks against services
+    passed in the checker_list param.
 
-# Externally referable dictionary with all the supported edge-checking types
-checker_map = {
-    'cloudformation': CloudFormationEdgeChecker,
-    'ec2': EC2EdgeChecker,
-    'iam': IAMEdgeChecker,
-    'lambda': LambdaEdgeChecker,
-    'ssm': SSMEdgeChecker,
-    'sts': STSEdgeChecker
-}
+    If existing_edges is passed, only edges that could have changed since existing_edges was computed are checked for:
 
+    * changed_sources: nodes whose permissions changed, edges from these are recomputed
+    * changed_destinations: nodes whose trust policy, instance profile, or access keys changed, edges to these are
+      recomputed
+    * changed_nodes: shorthand for nodes that are both, such as nodes new to the list of nodes
 
-def obtain_edges(session: Optional[boto3.session.Session], checker_list: List[str], nodes: List[Node],
-                 output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> List[Edge]:
-    """Given a list of nodes and a boto3 Session, return a list of edges between those nodes. Only checks
-    against services passed in the checker_list param. """
+    Other edges in existing_edges are kept (and yielded first), except those to or from a node that is no longer in
+    nodes.
+
+    Checkers that list resources across regions share one RegionalInventory, so the regions of every service are
+    scanned concurrently, and checkers that do not list resources run first while the scans are in progress. Each
+    checker is only given the node types it declares. Per-region and per-checker timing is written to output once
+    every edge is yielded, and the EdgeCheckerStats of each checker are appended to stats if it is passed.
+    """
+    if existing_edges is None:
+        for _, edge in iter_edges_by_checker(session, checker_list, nodes, output, debug, stats):
+            if edge is not None:
+                yield edge
+        return
+
+    ensure_plugin_checkers(debug)
+    inventory = RegionalInventory(session) if session is not None else None
+    checker_stats = []
+    try:
+        dirty_sources = set(changed_sources) if changed_sources is not None else set()
+        dirty_destinations = set(changed_destinations) if changed_destinations is not None else set()
+        if changed_nodes is not None:
+            for node in changed_nodes:
+                dirty_sources.add(node)
+                dirty_destinations.add(node)
+
+        node_set = set(nodes)
+        kept = 0
+        for edge in existing_edges:
+            if edge.source in node_set and edge.destination in node_set \
+                    and edge.source not in dirty_sources and edge.destination not in dirty_destinations:
+                kept += 1
+                yield edge
+        dprint(debug, 'Kept {} of {} edges'.format(kept, len(existing_edges)))
+
+        # dirty sources are checked against every destination, then the remaining sources against dirty destinations
+        source_list = [node for node in nodes if node in dirty_sources]
+        other_source_list = [node for node in nodes if node not in dirty_sources]
+        destination_list = [node for node in nodes if node in dirty_destinations]
+        if len(source_list) == 0 and len(destination_list) == 0:
+            return
+
+        output.write('Initiating edge checks for {} changed sources and {} changed destinations.\n'.format(
+            len(source_list), len(destination_list)))
+        for check, checker_obj in _create_checkers(session, checker_list, output, debug, inventory):
+            output.write('running edge check for service: {}\n'.format(check))
+            checker_stats.append(EdgeCheckerStats(check))
+            if len(source_list) > 0:
+                yield from _run_checker(checker_obj, checker_stats[-1], nodes, source_list, nodes, output, debug)
+            if len(other_source_list) > 0 and len(destination_list) > 0:
+                yield from _run_checker(checker_obj, checker_stats[-1], nodes, other_source_list, destination_list,
+                                        output, debug)
+    finally:
+        _finish_edge_checks(inventory, checker_stats, stats, output)
+
+
+def iter_edges_by_checker(session: Optional['botocore.session.Session'], checker_list: Iterable[str],
+                          nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                          stats: Optional[List[EdgeCheckerStats]] = None) -> Iterator[Tuple[str, Optional[Edge]]]:
+    """Like iter_edges without existing_edges, but yields each edge paired with the name of the checker that found
+    it, and a (name, None) pair once a checker is done. Every checker in checker_list runs in this one call and shares
+    one RegionalInventory, so callers that store the edges of each checker separately (such as create_graph with a
+    GraphCheckpoint) still scan the regions of every service concurrently.
+    """
+    ensure_plugin_checkers(debug)
+    inventory = RegionalInventory(session) if session is not None else None
+    checker_stats = []
+    try:
+        output.write('Initiating edge checks.\n')
+        dprint(debug, 'Checker map:  {}'.format(checker_map))
+        dprint(debug, 'Checker list: {}'.format(checker_list))
+        for check, checker_obj in _create_checkers(session, checker_list, output, debug, inventory):
+            output.write('running edge check for service: {}\n'.format(check))
+            checker_stats.append(EdgeCheckerStats(check))
+            for edge in _run_checker(checker_obj, checker_stats[-1], nodes, nodes, nodes, output, debug):
+                yield check, edge
+            yield check, None
+    finally:
+        _finish_edge_checks(inventory, checker_stats, stats, output)
+
+
+def _create_checkers(session: Optional['botocore.session.Session'], checker_list: Iterable[str], output: io.StringIO,
+                     debug: bool, inventory: Optional[RegionalInventory]) -> List[Tuple[str, EdgeChecker]]:
+    """Helper function: creates the checkers in checker_list, sharing one RegionalInventory, and starts their
+    prefetching so that regional inventory for every service is gathered concurrently. Returns them in the order to
+    run them: checkers that list regional resources go last, so their scans can finish while the others run.
+    """
     result = []
-    output.write('Initiating edge checks.\n')
-    dprint(debug, 'Checker map:  {}'.format(checker_map))
-    dprint(debug, 'Checker list: {}'.format(checker_list))
     for check in checker_list:
         if check in checker_map:
-            output.write('running edge check for service: {}\n'.format(check))
-            checker_obj = checker_map[check](session)
-            result.extend(checker_obj.return_edges(nodes, output, debug))
+            result.append((check, checker_map[check](session, inventory)))
+        else:
+            dprint(debug, 'No edge checker is registered under the name {}'.format(check))
+    for _, checker_obj in result:
+        checker_obj.prefetch(output, debug)
+    result.sort(key=lambda x: len(x[1].inventory_services) > 0)
     return result
+
+
+def _run_checker(checker_obj: EdgeChecker, checker_stats: EdgeCheckerStats, nodes: List[Node],
+                 source_nodes: List[Node], destination_nodes: List[Node], output: io.StringIO,
+                 debug: bool) -> Iterator[Edge]:
+    """Helper function: yields the edges a checker finds between the source and destination nodes of the types it
+    declares, adding its timing, pair, evaluation, and edge counts to checker_stats. Time spent by the caller between
+    edges is not counted.
+    """
+    if checker_obj.requires_network and checker_obj.session is None:
+        checker_stats.skipped = 'it requires a session'
+        return
+
+    source_nodes = [node for node in source_nodes if get_node_type(node) in checker_obj.source_types]
+    destination_nodes = [node for node in destination_nodes if get_node_type(node) in checker_obj.destination_types]
+    if len(source_nodes) == 0 or len(destination_nodes) == 0:
+        return
+    checker_stats.pairs += len(source_nodes) * len(destination_nodes)
+
+    edge_iterator = checker_obj.iter_edges(nodes, output, debug, source_nodes=source_nodes,
+                                           destination_nodes=destination_nodes)
+    while True:
+        start_evaluations = query_interface.get_evaluation_count()
+        start = time.perf_counter()
+        try:
+            edge = next(edge_iterator)
+        except StopIteration:
+            return
+        finally:
+            checker_stats.seconds += time.perf_counter() - start
+            checker_stats.evaluations += query_interface.get_evaluation_count() - start_evaluations
+        checker_stats.edges += 1
+        yield edge
+
+
+def _finish_edge_checks(inventory: Optional[RegionalInventory], checker_stats: List[EdgeCheckerStats],
+                        stats: Optional[List[EdgeCheckerStats]], output: io.StringIO) -> None:
+    """Helper function: reports per-region timing and error counts of a RegionalInventory, then closes it, then
+    reports per-checker stats and passes them on to the caller
+    """
+    if inventory is not None:
+        inventory.write_report(output)
+        inventory.close()
+    for checker_stat in checker_stats:
+        output.write(checker_stat.describe() + '\n')
+        if profiling.active_profile is not None and checker_stat.skipped is None:
+            profiling.active_profile.record_checker(checker_stat.name, checker_stat.seconds, checker_stat.evaluations)
+    if stats is not None:
+        stats.extend(checker_stats)
+
+
+def _get_entry_points(group: str) -> list:
+    """Helper function: returns the entry points of installed packages in a group"""
+    try:
+        from importlib import metadata  # Python 3.8+
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(group))
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, []))
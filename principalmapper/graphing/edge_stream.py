@@ -0,0 +1,71 @@
+"""Code for storing edges as a stream of JSON Lines while they are found, rather than as one JSON document once edge
+identification is done. Every edge written is kept if the process stops partway.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+from typing import Iterator, List
+
+from principalmapper.common import Edge, Node
+
+
+class EdgeStreamWriter(object):
+    """Appends edges to a JSON Lines file, one edge dictionary (see Edge.to_dictionary) per line. Each edge is handed to
+    the operating system as it is written, so a crash of the process loses none of them. Call close() once done, or
+    use the object as a context manager.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.count = 0
+        self._file = os.fdopen(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), 'w')
+
+    def write(self, edge: Edge) -> None:
+        """Appends an edge to the file."""
+        self._file.write(json.dumps(edge.to_dictionary()) + '\n')
+        self._file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        """Syncs the file to disk and closes it."""
+        if not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_edge_stream(filepath: str, nodes: List[Node]) -> Iterator[Edge]:
+    """Yields the edges stored in a JSON Lines file by an EdgeStreamWriter, between the passed nodes. A final line cut
+    short by an interruption is ignored. Raises a ValueError if an edge refers to a node not in nodes.
+    """
+    nodes_by_arn = {node.arn: node for node in nodes}
+    with open(filepath) as f:
+        for line in f:
+            try:
+                edge = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if edge['source'] not in nodes_by_arn or edge['destination'] not in nodes_by_arn:
+                raise ValueError('The edge stream {} has an edge between unknown nodes: {} to {}'.format(
+                    filepath, edge['source'], edge['destination']))
+            yield Edge(nodes_by_arn[edge['source']], nodes_by_arn[edge['destination']], edge['reason'])
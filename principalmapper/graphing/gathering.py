@@ -18,50 +18,141 @@
 import io
 import os
 
-import boto3.session
 import principalmapper
 from principalmapper.common import Node, Group, Policy, Graph
+from principalmapper.common.edges import EdgeList
+from principalmapper.common.policies import get_policy_digest
 from principalmapper.graphing import edge_identification
+from principalmapper.graphing.checkpoint import GraphCheckpoint
+from principalmapper.graphing.edge_stream import EdgeStreamWriter, load_edge_stream
 from principalmapper.querying import query_interface
+from principalmapper.querying.local_policy_simulation import get_permission_summary
 from principalmapper.util import arns
 from principalmapper.util.debug_print import dprint
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
 
+if TYPE_CHECKING:
+    import botocore.session
 
-def create_graph(session: boto3.session.Session, service_list: list, output: io.StringIO = open(os.devnull, 'w'),
-                 debug=False) -> Graph:
+
+def create_graph(session: Optional['botocore.session.Session'], service_list: list,
+                 output: io.StringIO = open(os.devnull, 'w'), debug=False,
+                 checkpoint: Optional[GraphCheckpoint] = None) -> Graph:
     """Constructs a Graph object.
 
     Information about the graph as it's built will be written to the IO parameter `output`.
-    """
-    stsclient = session.client('sts')
-    caller_identity = stsclient.get_caller_identity()
-    dprint(debug, "Caller Identity: {}".format(caller_identity['Arn']))
-    metadata = {
-        'account_id': caller_identity['Account'],
-        'pmapper_version': principalmapper.__version__
-    }
 
-    iamclient = session.create_client('iam')
+    If a GraphCheckpoint is passed, the progress of each stage is saved to it, and the stages it already holds are
+    loaded from it instead of being redone. Once every gathering stage is in the checkpoint, session may be None, in
+    which case edge checks that call the AWS API find no edges.
+    """
+    if session is None and not all(checkpoint is not None and checkpoint.has_stage(stage)
+                                   for stage in _GATHERING_STAGES):
+        raise ValueError('A session is required to gather data about the account')
+
+    if checkpoint is not None and checkpoint.has_stage('metadata'):
+        output.write('Resuming graph creation from the checkpoint in {}\n'.format(checkpoint.directory))
+        metadata = checkpoint.load_stage('metadata')
+        iamclient = session.create_client('iam') if session is not None else None
+    else:
+        stsclient = session.create_client('sts')
+        caller_identity = stsclient.get_caller_identity()
+        dprint(debug, "Caller Identity: {}".format(caller_identity['Arn']))
+        metadata = {
+            'account_id': caller_identity['Account'],
+            'pmapper_version': principalmapper.__version__
+        }
+
+        iamclient = session.create_client('iam')
+
+        # Record the default versions of managed policies, so later updates can tell which ones changed
+        metadata['policy_versions'] = get_policy_versions(iamclient, output, debug)
+        if checkpoint is not None:
+            checkpoint.save_stage('metadata', metadata)
 
     # Gather users and roles, generating a Node per user and per role
-    nodes_result = get_unfilled_nodes(iamclient, output, debug)
+    if checkpoint is not None and checkpoint.has_stage('nodes'):
+        nodes_result = [_get_unfilled_node_from_dictionary(node) for node in checkpoint.load_stage('nodes')]
+    else:
+        nodes_result = get_unfilled_nodes(iamclient, output, debug)
+        if checkpoint is not None:
+            checkpoint.save_stage('nodes', [node.to_dictionary() for node in nodes_result])
 
     # Gather groups from current list of nodes (users), generate Group objects, attach to nodes in-flight
-    groups_result = get_unfilled_groups(iamclient, nodes_result, output, debug)
+    if checkpoint is not None and checkpoint.has_stage('groups'):
+        groups_data = checkpoint.load_stage('groups')
+        groups_result = [Group(arn=group_arn, attached_policies=[]) for group_arn in groups_data['groups']]
+        groups_by_arn = {group.arn: group for group in groups_result}
+        for node in nodes_result:
+            for group_arn in groups_data['memberships'].get(node.arn, []):
+                node.group_memberships.append(groups_by_arn[group_arn])
+    else:
+        groups_result = get_unfilled_groups(iamclient, nodes_result, output, debug)
+        if checkpoint is not None:
+            checkpoint.save_stage('groups', {
+                'groups': [group.arn for group in groups_result],
+                'memberships': {node.arn: [group.arn for group in node.group_memberships] for node in nodes_result}
+            })
 
     # Resolve all policies, generate Policy objects, attach to all groups and nodes
-    policies_result = get_policies_and_fill_out(iamclient, nodes_result, groups_result, output, debug)
+    policies_result = get_policies_and_fill_out(iamclient, nodes_result, groups_result, output, debug,
+                                                checkpoint=checkpoint)
+    if checkpoint is not None and not checkpoint.has_stage('policies'):
+        checkpoint.save_stage('policies', {'count': len(policies_result)})
 
     # Determine which nodes are admins and update node objects
-    update_admin_status(nodes_result, output, debug)
-
-    # Generate edges, generate Edge objects
-    edges_result = edge_identification.obtain_edges(session, service_list, nodes_result, output, debug)
+    if checkpoint is not None and checkpoint.has_stage('admins'):
+        admin_arns = set(checkpoint.load_stage('admins'))
+        for node in nodes_result:
+            node.is_admin = node.arn in admin_arns
+    else:
+        update_admin_status(nodes_result, output, debug)
+        if checkpoint is not None:
+            checkpoint.save_stage('admins', [node.arn for node in nodes_result if node.is_admin])
+
+    # Generate edges, generate Edge objects, adding them to the graph's compact EdgeList as they are found
+    edges_result = EdgeList(nodes=nodes_result)
+    if checkpoint is None:
+        edges_result.extend(edge_identification.iter_edges(session, service_list, nodes_result, output, debug))
+    else:
+        # checkpoint the edges of each checker separately, streaming them to the checkpoint as they are found, while
+        # the checkers that are not done yet run together so their regional scans share one inventory
+        pending_checks = []
+        for check in service_list:
+            stage = 'edges_{}'.format(check)
+            if check in pending_checks:
+                continue
+            elif checkpoint.has_stage(stage):
+                edges_result.extend(load_edge_stream(checkpoint.get_records_path(stage), nodes_result))
+            else:
+                checkpoint.clear_records(stage)  # drop edges from an interrupted run of this check
+                pending_checks.append(check)
+        writers = {check: EdgeStreamWriter(checkpoint.get_records_path('edges_{}'.format(check)))
+                   for check in pending_checks}
+        try:
+            for check, edge in edge_identification.iter_edges_by_checker(session, pending_checks, nodes_result,
+                                                                         output, debug):
+                if edge is None:  # the checker is done
+                    writers[check].close()
+                    checkpoint.save_stage('edges_{}'.format(check), {'edges': writers.pop(check).count})
+                else:
+                    writers[check].write(edge)
+                    edges_result.append(edge)
+            for check, writer in writers.items():  # no checker is registered under these names
+                writer.close()
+                checkpoint.save_stage('edges_{}'.format(check), {'edges': writer.count})
+            writers.clear()
+        finally:
+            for writer in writers.values():
+                writer.close()
 
     return Graph(nodes_result, edges_result, policies_result, groups_result, metadata)
 
 
+# The stages of create_graph that call the IAM API, in order
+_GATHERING_STAGES = ('metadata', 'nodes', 'groups', 'policies', 'admins')
+
+
 def get_unfilled_nodes(iamclient, output: io.StringIO = open(os.devnull, 'w'), debug=False) -> List[Node]:
     """Using an IAM.Client object, return a list of Node object for each IAM user and role in an account.
 
@@ -178,17 +269,34 @@ def get_unfilled_groups(iamclient, nodes: List[Node], output: io.StringIO = open
 
 
 def get_policies_and_fill_out(iamclient, nodes: List[Node], groups: List[Group],
-                              output: io.StringIO = open(os.devnull, 'w'), debug=False) -> List[Policy]:
+                              output: io.StringIO = open(os.devnull, 'w'), debug=False,
+                              existing_policies: Optional[List[Policy]] = None,
+                              checkpoint: Optional[GraphCheckpoint] = None) -> List[Policy]:
     """Using an IAM.Client object, return a list of Policy objects. Adds references to each passed Node and
     Group object where applicable.
 
+    If existing_policies is passed, managed policies are looked up from it before calling the API. Policies found
+    there are attached to nodes and groups, but are not included in the returned list.
+
+    If a GraphCheckpoint is passed, the policies of each node and group are recorded to it as they are fetched, and
+    nodes and groups with recorded policies are filled out from the checkpoint instead of the API.
+
     Writes high-level progress information to parameter output
     """
     result = []
+    if existing_policies is None:
+        existing_policies = []
+    if checkpoint is not None:
+        checkpoint_records = checkpoint.load_records_by_key('principal_policies', 'arn')
+    else:
+        checkpoint_records = {}
 
     # navigate through nodes and add policy objects if they do not already exist in result
     output.write("Obtaining policies used by all IAM users and roles\n")
     for node in nodes:
+        if node.arn in checkpoint_records:
+            _fill_out_from_checkpoint(node, checkpoint_records[node.arn], result, existing_policies)
+            continue
         node_name_components = arns.get_resource(node.arn).split('/')
         node_type, node_name = node_name_components[0], node_name_components[-1]
         dprint(debug, 'Grabbing inline policies for {}'.format(node.arn))
@@ -223,6 +331,8 @@ def get_policies_and_fill_out(iamclient, nodes: List[Node], groups: List[Group],
             dprint(debug, '   Grabbing managed policy: {}'.format(policy_arn))
             # reduce API calls, search existing policies for matching arns
             policy_object = _get_policy_by_arn(policy_arn, result)
+            if policy_object is None:
+                policy_object = _get_policy_by_arn(policy_arn, existing_policies)
             if policy_object is None:
                 # Gotta retrieve the policy's current default version
                 dprint(debug, '      Policy cache miss, calling API')
@@ -239,9 +349,14 @@ def get_policies_and_fill_out(iamclient, nodes: List[Node], groups: List[Group],
                 )
                 result.append(policy_object)
             node.attached_policies.append(policy_object)
+        if checkpoint is not None:
+            checkpoint.append_record('principal_policies', _get_checkpoint_record(node))
 
     output.write("Obtaining policies used by IAM groups\n")
     for group in groups:
+        if group.arn in checkpoint_records:
+            _fill_out_from_checkpoint(group, checkpoint_records[group.arn], result, existing_policies)
+            continue
         group_name = arns.get_resource(group.arn).split('/')[-1]  # split by slashes and take the final item
         dprint(debug, 'Getting policies for: {}'.format(group.arn))
         # get inline policies
@@ -260,6 +375,8 @@ def get_policies_and_fill_out(iamclient, nodes: List[Node], groups: List[Group],
             dprint(debug, '   Grabbing managed policy: {}'.format(policy_arn))
             # check cached policies first
             policy_object = _get_policy_by_arn(policy_arn, result)
+            if policy_object is None:
+                policy_object = _get_policy_by_arn(policy_arn, existing_policies)
             if policy_object is None:
                 dprint(debug, '      Policy cache miss, calling API')
                 policy_response = iamclient.get_policy(PolicyArn=policy_arn)
@@ -275,16 +392,193 @@ def get_policies_and_fill_out(iamclient, nodes: List[Node], groups: List[Group],
                 )
                 result.append(policy_object)
             group.attached_policies.append(policy_object)
+        if checkpoint is not None:
+            checkpoint.append_record('principal_policies', _get_checkpoint_record(group))
 
     return result
 
 
+def update_graph(session: 'botocore.session.Session', graph: Graph, service_list: list,
+                 output: io.StringIO = open(os.devnull, 'w'), debug=False) -> Graph:
+    """Brings a previously-created Graph object up to date, re-gathering only what changed since it was created.
+    Returns the same (updated) Graph object.
+
+    Users and roles are listed and compared against the graph: new principals, deleted principals, and principals
+    that were deleted and recreated (detected by a different unique ID) are handled, and changes to trust policies,
+    passwords, instance profiles, access keys, group memberships, group policies, and managed policy default versions
+    are picked up. The inline and attached policies of every user and role are compared against a fresh pull of
+    GetAccountAuthorizationDetails, and principals whose policies differ have them gathered again. Only nodes affected
+    by these changes have their admin status and edges recomputed.
+    """
+    stsclient = session.create_client('sts')
+    caller_identity = stsclient.get_caller_identity()
+    dprint(debug, "Caller Identity: {}".format(caller_identity['Arn']))
+    if caller_identity['Account'] != graph.metadata['account_id']:
+        raise ValueError('The passed Graph is for account {}, but the session is for account {}'.format(
+            graph.metadata['account_id'], caller_identity['Account']))
+
+    iamclient = session.create_client('iam')
+    affected_nodes = set()  # type: Set[Node]
+
+    # Compare the listed users and roles against the nodes of the graph
+    listed_nodes = get_unfilled_nodes(iamclient, output, debug)
+    existing_nodes = {node.arn: node for node in graph.nodes}
+    fresh_nodes = []
+    updated_node_list = []
+    for listed_node in listed_nodes:
+        node = existing_nodes.get(listed_node.arn)
+        if node is None or node.id_value != listed_node.id_value:
+            dprint(debug, 'New or recreated principal: {}'.format(listed_node.arn))
+            fresh_nodes.append(listed_node)
+            updated_node_list.append(listed_node)
+            continue
+        if _get_trust_policy_digest(node) != _get_trust_policy_digest(listed_node) or \
+                node.active_password != listed_node.active_password or \
+                node.instance_profile != listed_node.instance_profile:
+            dprint(debug, 'Changed principal: {}'.format(node.arn))
+            node.trust_policy = listed_node.trust_policy
+            node.active_password = listed_node.active_password
+            node.instance_profile = listed_node.instance_profile
+            affected_nodes.add(node)
+        if node.access_keys != listed_node.access_keys:
+            dprint(debug, 'Changed access keys: {}'.format(node.arn))
+            node.access_keys = listed_node.access_keys
+            affected_nodes.add(node)  # the iam:CreateAccessKey edge depends on the number of access keys
+        updated_node_list.append(node)
+    affected_nodes.update(fresh_nodes)
+    graph.nodes = updated_node_list
+
+    # Gather groups, reusing the existing Group objects, and check which had their memberships or policies change
+    existing_groups = {group.arn: group for group in graph.groups}
+    groups_result = []
+    changed_groups = set()
+    output.write("Obtaining IAM groups in the account.\n")
+    group_paginator = iamclient.get_paginator('list_groups')
+    for page in group_paginator.paginate(PaginationConfig={'PageSize': 25}):
+        dprint(debug, 'list_groups page: {}'.format(page))
+        for group_data in page['Groups']:
+            group = existing_groups.get(group_data['Arn'])
+            if group is None:
+                group = Group(arn=group_data['Arn'], attached_policies=[])
+                changed_groups.add(group)
+            groups_result.append(group)
+
+    old_group_policies = {}
+    for group in groups_result:
+        old_group_policies[group] = _get_policy_identities(group.attached_policies)
+        group.attached_policies = []
+    new_policies = get_policies_and_fill_out(iamclient, [], groups_result, output, debug, graph.policies)
+    for group in groups_result:
+        if _get_policy_identities(group.attached_policies) != old_group_policies[group]:
+            dprint(debug, 'Changed group policies: {}'.format(group.arn))
+            changed_groups.add(group)
+
+    output.write("Connecting IAM users to their groups.\n")
+    group_members = _get_group_members(iamclient, groups_result, debug)
+    for node in graph.nodes:
+        if not arns.get_resource(node.arn).startswith('user/'):
+            continue
+        memberships = [group for group in groups_result if node.arn in group_members[group.arn]]
+        if [group.arn for group in memberships] != [group.arn for group in node.group_memberships]:
+            affected_nodes.add(node)
+        node.group_memberships = memberships
+        if any(group in changed_groups for group in memberships):
+            affected_nodes.add(node)
+    graph.groups = groups_result
+
+    # Update managed policies that have a new default version
+    output.write("Checking for updated managed policies\n")
+    policy_versions = get_policy_versions(iamclient, output, debug)
+    old_policy_versions = graph.metadata.get('policy_versions', {})
+    changed_policies = set()
+    for policy in graph.policies:
+        if ':policy/' not in policy.arn or policy.arn not in policy_versions:
+            continue
+        if old_policy_versions.get(policy.arn) != policy_versions[policy.arn]:
+            dprint(debug, 'Changed managed policy: {}'.format(policy.arn))
+            policy_version_response = iamclient.get_policy_version(
+                PolicyArn=policy.arn,
+                VersionId=policy_versions[policy.arn]
+            )
+            new_doc = policy_version_response['PolicyVersion']['Document']
+            if get_policy_digest(new_doc) != policy.digest:
+                policy.policy_doc = new_doc
+                changed_policies.add(policy)
+    graph.metadata['policy_versions'] = policy_versions
+
+    # Compare the inline and attached policies of the other principals against the account's authorization details,
+    # then fill out policies for new and recreated principals and for principals whose policies changed
+    output.write("Checking for changed policies of IAM users and roles\n")
+    principal_policies = _get_principal_policy_identities(iamclient, debug)
+    fresh_node_set = set(fresh_nodes)
+    changed_policy_nodes = []
+    for node in graph.nodes:
+        if node in fresh_node_set:
+            continue
+        if principal_policies.get(node.arn) != _get_node_policy_identities(node):
+            dprint(debug, 'Changed principal policies: {}'.format(node.arn))
+            node.attached_policies = []
+            changed_policy_nodes.append(node)
+            affected_nodes.add(node)
+    new_policies.extend(get_policies_and_fill_out(iamclient, fresh_nodes + changed_policy_nodes, [], output, debug,
+                                                  graph.policies + new_policies))
+
+    for node in graph.nodes:
+        if node in affected_nodes:
+            continue
+        if any(policy in changed_policies for policy in node.attached_policies) or \
+                any(policy in changed_policies for group in node.group_memberships
+                    for policy in group.attached_policies):
+            affected_nodes.add(node)
+
+    # Keep the policies still in use, in their previous order
+    used_policies = set()
+    for holder in list(graph.nodes) + list(graph.groups):
+        used_policies.update(holder.attached_policies)
+    graph.policies = [policy for policy in graph.policies + new_policies if policy in used_policies]
+
+    # Clear stale cached data, then recompute admin status and edges for affected nodes. Groups keep their managed
+    # policy objects, so a group with a policy that has a new default version is not in changed_groups
+    for group in graph.groups:
+        if group in changed_groups or any(policy in changed_policies for policy in group.attached_policies):
+            group.cache.clear()
+    affected_node_list = [node for node in graph.nodes if node in affected_nodes]
+    output.write('{} of {} nodes changed\n'.format(len(affected_node_list), len(graph.nodes)))
+    for node in affected_node_list:
+        node.cache.clear()
+        node.is_admin = False
+    update_admin_status(affected_node_list, output, debug)
+
+    graph.edges = edge_identification.obtain_edges(session, service_list, graph.nodes, output, debug,
+                                                   existing_edges=graph.edges, changed_nodes=affected_node_list)
+    graph.metadata['pmapper_version'] = principalmapper.__version__
+    return graph
+
+
+def get_policy_versions(iamclient, output: io.StringIO = open(os.devnull, 'w'), debug=False) -> Dict[str, str]:
+    """Using an IAM.Client object, returns a dictionary mapping the ARN of each attached managed policy to the ID of
+    its default version.
+    """
+    result = {}
+    output.write("Obtaining default versions of managed policies\n")
+    policy_paginator = iamclient.get_paginator('list_policies')
+    for page in policy_paginator.paginate(OnlyAttached=True, PaginationConfig={'PageSize': 100}):
+        dprint(debug, 'list_policies page: {}'.format(page))
+        for policy in page['Policies']:
+            result[policy['Arn']] = policy['DefaultVersionId']
+    return result
+
+
 def update_admin_status(nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> None:
     """Given a list of nodes, goes through and updates each node's is_admin data."""
     for node in nodes:
         output.write("checking if {} is an admin\n".format(node.searchable_name()))
         node_type = arns.get_resource(node.arn).split('/')[0]
 
+        # every check below needs access to IAM actions, skip nodes that cannot call any
+        if not get_permission_summary(node).could_allow_service('iam'):
+            continue
+
         # check if node can modify its own inline policies
         if node_type == 'user':
             action = 'iam:PutUserPolicy'
@@ -352,3 +646,92 @@ def _get_policy_by_arn(arn: str, policies: List[Policy]) -> Optional[Policy]:
         if arn == policy.arn:
             return policy
     return None
+
+
+def _get_trust_policy_digest(node: Node) -> Optional[str]:
+    """Helper function: return the digest of a node's trust policy, or None for users"""
+    if node.trust_policy is None:
+        return None
+    return get_policy_digest(node.trust_policy)
+
+
+def _get_policy_identities(policies: List[Policy]) -> List[tuple]:
+    """Helper function: return a comparable (ARN, name, digest) tuple per policy"""
+    return [(policy.arn, policy.name, policy.digest) for policy in policies]
+
+
+def _get_node_policy_identities(node: Node) -> Set[tuple]:
+    """Helper function: return comparable identities of a node's policies, (ARN, name, digest) for inline policies and
+    (ARN, name) for managed policies, whose documents are compared by default version instead
+    """
+    result = set()
+    for policy in node.attached_policies:
+        if policy.arn == node.arn:
+            result.add((policy.arn, policy.name, policy.digest))
+        else:
+            result.add((policy.arn, policy.name))
+    return result
+
+
+def _get_principal_policy_identities(iamclient, debug=False) -> Dict[str, Set[tuple]]:
+    """Helper function: return a dictionary mapping the ARN of each user and role to the identities of its policies
+    (see _get_node_policy_identities), using GetAccountAuthorizationDetails
+    """
+    result = {}
+    details_paginator = iamclient.get_paginator('get_account_authorization_details')
+    for page in details_paginator.paginate(Filter=['User', 'Role'], PaginationConfig={'PageSize': 100}):
+        dprint(debug, 'get_account_authorization_details page: {}'.format(page))
+        for details_key, inline_key in (('UserDetailList', 'UserPolicyList'), ('RoleDetailList', 'RolePolicyList')):
+            for detail in page.get(details_key, []):
+                identities = set()
+                for inline_policy in detail.get(inline_key, []):
+                    identities.add((detail['Arn'], inline_policy['PolicyName'],
+                                    get_policy_digest(inline_policy['PolicyDocument'])))
+                for attached_policy in detail.get('AttachedManagedPolicies', []):
+                    identities.add((attached_policy['PolicyArn'], attached_policy['PolicyName']))
+                result[detail['Arn']] = identities
+    return result
+
+
+def _get_group_members(iamclient, groups: List[Group], debug=False) -> Dict[str, Set[str]]:
+    """Helper function: return a dictionary mapping each group's ARN to the ARNs of its member users"""
+    result = {}
+    for group in groups:
+        group_name = arns.get_resource(group.arn).split('/')[-1]
+        result[group.arn] = set()
+        group_paginator = iamclient.get_paginator('get_group')
+        for page in group_paginator.paginate(GroupName=group_name):
+            dprint(debug, 'get_group page: {}'.format(page))
+            for user in page['Users']:
+                result[group.arn].add(user['Arn'])
+    return result
+
+
+def _get_unfilled_node_from_dictionary(node: dict) -> Node:
+    """Helper function: recreate a Node without policies or groups from its dictionary form"""
+    return Node(arn=node['arn'], id_value=node['id_value'], attached_policies=[], group_memberships=[],
+                trust_policy=node['trust_policy'], instance_profile=node['instance_profile'],
+                num_access_keys=node['access_keys'], active_password=node['active_password'],
+                is_admin=node['is_admin'])
+
+
+def _get_checkpoint_record(holder) -> dict:
+    """Helper function: return the checkpoint record of the policies attached to a node or group"""
+    return {'arn': holder.arn, 'policies': [policy.to_dictionary() for policy in holder.attached_policies]}
+
+
+def _fill_out_from_checkpoint(holder, record: dict, result: List[Policy], existing_policies: List[Policy]) -> None:
+    """Helper function: attach the policies in a checkpoint record to a node or group, reusing managed policies that
+    were already loaded and adding the rest to result
+    """
+    for policy_data in record['policies']:
+        policy_object = None
+        if policy_data['arn'] != holder.arn:  # managed policy
+            policy_object = _get_policy_by_arn(policy_data['arn'], result)
+            if policy_object is None:
+                policy_object = _get_policy_by_arn(policy_data['arn'], existing_policies)
+        if policy_object is None:
+            policy_object = Policy(arn=policy_data['arn'], name=policy_data['name'],
+                                   policy_doc=policy_data['policy_doc'])
+            result.append(policy_object)
+        holder.attached_policies.append(policy_object)
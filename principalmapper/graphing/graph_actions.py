@@ -15,24 +15,56 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
+import datetime as dt
 import os
 import os.path
 import sys
 
-import boto3.session
 from principalmapper.common import Graph
-from principalmapper.graphing import gathering
+from principalmapper.graphing.checkpoint import GraphCheckpoint
 from principalmapper.util.debug_print import dprint
 from principalmapper.util.storage import get_storage_root
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
+if TYPE_CHECKING:
+    import botocore.session
 
-def create_new_graph(session: boto3.session.Session, service_list: List[str], debug=False) -> Graph:
+
+def create_new_graph(session: Optional['botocore.session.Session'], service_list: List[str], debug=False,
+                     checkpoint: Optional[GraphCheckpoint] = None) -> Graph:
     """Wraps around principalmapper.graphing.gathering.create_graph(...), specifying to print data to stdout. This
     fulfills `pmapper graph --create`.
     """
+    # gathering loads every edge checker (and any plugins), so it is only imported by subcommands that need it
+    from principalmapper.graphing import gathering
+
+    return gathering.create_graph(session, service_list, sys.stdout, debug, checkpoint)
+
+
+def get_graph_checkpoint(session: Optional['botocore.session.Session'], account: Optional[str],
+                         resume: bool = False) -> GraphCheckpoint:
+    """Returns the GraphCheckpoint for an account, stored in a standard location under the storage root. Uses the
+    session/account parameter to pick the account. Unless resume is True, any progress already stored is cleared.
+    """
+    if account is None:
+        if session is None:
+            raise ValueError('One of the parameters `account` or `session` must not be None')
+        stsclient = session.create_client('sts')
+        account = stsclient.get_caller_identity()['Account']
+    checkpoint = GraphCheckpoint(os.path.join(get_storage_root(), account, 'checkpoint'))
+    if not resume:
+        checkpoint.clear()
+    return checkpoint
+
 
-    return gathering.create_graph(session, service_list, sys.stdout, debug)
+def update_existing_graph(session: 'botocore.session.Session', graph: Graph, service_list: List[str],
+                          debug=False) -> Graph:
+    """Wraps around principalmapper.graphing.gathering.update_graph(...), specifying to print data to stdout. This
+    fulfills `pmapper graph --create --incremental`.
+    """
+    from principalmapper.graphing import gathering
+
+    return gathering.update_graph(session, graph, service_list, sys.stdout, debug)
 
 
 def print_graph_data(graph: Graph) -> None:
@@ -58,20 +90,25 @@ def get_graph_from_disk(location: str) -> Graph:
     return Graph.create_graph_from_local_disk(location)
 
 
-def get_existing_graph(session: Optional[botocore.session.Session], account: Optional[str], debug=False) -> Graph:
+def get_existing_graph(session: Optional['botocore.session.Session'], account: Optional[str], debug=False,
+                       as_of: Optional[dt.datetime] = None) -> Graph:
     """Returns a Graph object stored on-disk in a standard location (per-OS, using the get_storage_root utility function
     in principalmapper.util.storage). Uses the session/account parameter to choose the directory from under the
-    standard location.
+    standard location. If as_of is set, returns the graph of the latest snapshot in the account's history (see
+    principalmapper.graphing.graph_history) created at or before then instead.
     """
     if account is not None:
         dprint(debug, 'Loading account data based on parameter --account')
-        graph = get_graph_from_disk(os.path.join(get_storage_root(), account))
+        account_id = account
     elif session is not None:
         dprint(debug, 'Loading account data using a botocore session object')
         stsclient = session.create_client('sts')
         response = stsclient.get_caller_identity()
-        graph = get_graph_from_disk(os.path.join(get_storage_root(), response['Account']))
+        account_id = response['Account']
     else:
         raise ValueError('One of the parameters `account` or `session` must not be None')
-    return graph
-
+    if as_of is not None:
+        from principalmapper.graphing.graph_history import GraphHistory
+        dprint(debug, 'Loading the snapshot of the account as of {}'.format(as_of.isoformat()))
+        return GraphHistory.for_account(account_id).load_graph_as_of(as_of)
+    return get_graph_from_disk(os.path.join(get_storage_root(), account_id))
@@ -0,0 +1,246 @@
+"""Code for computing the differences between two graphs of an account, such as yesterday's and today's.
+
+Both graphs are read as records in their stored form (see Graph.store_graph_as_json), either straight from the stored
+files (StoredGraphRecords) or from Graph objects (GraphObjectRecords). The old graph's records are indexed by identity
+(ARN, policy ARN and name, or edge source, destination, and reason) in dictionaries and sets, then the new graph's
+records are streamed past the indexes, so the time taken grows linearly with the size of the graphs and only one
+graph's records are held at a time.
+
+Each difference is a dictionary with a type (node, group_membership, group, policy, edge, or privesc), a change
+(added, removed, or changed), and the identity of what changed:
+
+    {"type": "node", "change": "changed", "arn": "...", "fields": {"is_admin": {"before": false, "after": true}}}
+    {"type": "group_membership", "change": "added", "node": "...", "group": "..."}
+    {"type": "policy", "change": "changed", "arn": "...", "name": "...", "before_digest": "...", "after_digest": "..."}
+    {"type": "edge", "change": "removed", "source": "...", "destination": "...", "reason": "..."}
+    {"type": "privesc", "change": "added", "arn": "..."}
+
+A privesc difference with the change added means that the principal can escalate its privileges (it is not an admin,
+but reaches an admin through edges) in the new graph and could not in the old one, removed means the opposite.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import os
+import os.path
+from typing import Dict, Iterable, Iterator, List, Set
+
+from principalmapper.common import Graph
+from principalmapper.common.graphs import iter_stored_graph_file
+from principalmapper.common.policies import get_policy_digest
+from principalmapper.graphing.graph_history import GraphHistory, SnapshotRecords, parse_timestamp
+from principalmapper.util.storage import get_storage_root
+
+
+class StoredGraphRecords(object):
+    """The records of a graph stored on-disk at root_directory, read from its files each time they are iterated."""
+
+    def __init__(self, root_directory: str):
+        if not os.path.exists(os.path.join(root_directory, 'metadata.json')):
+            raise ValueError('Did not find a stored graph at: {}'.format(root_directory))
+        self.root_directory = root_directory
+
+    def iter_records(self, kind: str) -> Iterator[dict]:
+        """Yields the records of the given kind: nodes, edges, policies, or groups."""
+        return iter_stored_graph_file(os.path.join(self.root_directory, 'graph'), kind + '.json')
+
+
+class GraphObjectRecords(object):
+    """The records of a Graph object, in the same form as they are stored."""
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+
+    def iter_records(self, kind: str) -> Iterator[dict]:
+        """Yields the records of the given kind: nodes, edges, policies, or groups."""
+        if kind == 'policies':
+            return ({'arn': policy.arn, 'name': policy.name, 'policy_digest': policy.digest}
+                    for policy in self.graph.policies)
+        return (x.to_dictionary() for x in getattr(self.graph, kind))
+
+
+def diff_graphs(old_graph: Graph, new_graph: Graph) -> Iterator[dict]:
+    """Yields the differences between two Graph objects, see the module docstring."""
+    return iter_graph_diff(GraphObjectRecords(old_graph), GraphObjectRecords(new_graph))
+
+
+def diff_stored_graphs(old_directory: str, new_directory: str) -> Iterator[dict]:
+    """Yields the differences between two graphs stored on-disk, without creating Graph objects for them. See the
+    module docstring.
+    """
+    return iter_graph_diff(StoredGraphRecords(old_directory), StoredGraphRecords(new_directory))
+
+
+def get_graph_directory(target: str) -> str:
+    """Returns the directory of a stored graph, given either its path or the ID of an account whose graph is stored
+    under the storage root. Raises a ValueError if there is no such graph.
+    """
+    if os.path.exists(os.path.join(target, 'metadata.json')):
+        return target
+    account_directory = os.path.join(get_storage_root(), target)
+    if os.path.sep not in target and os.path.exists(os.path.join(account_directory, 'metadata.json')):
+        return account_directory
+    raise ValueError('Did not find a stored graph for: {}'.format(target))
+
+
+def get_graph_records(target: str):
+    """Returns the records of a stored graph, given its directory or account ID (see get_graph_directory), or of a
+    snapshot in an account's history, given the account ID and a date or time as ACCOUNT@TIMESTAMP (see
+    graph_history.parse_timestamp). Raises a ValueError if there is no such graph.
+    """
+    if '@' in target:
+        account_id, timestamp = target.split('@', 1)
+        history = GraphHistory.for_account(account_id)
+        return SnapshotRecords(history, history.load_manifest(history.get_snapshot_as_of(parse_timestamp(timestamp))))
+    return StoredGraphRecords(get_graph_directory(target))
+
+
+def iter_graph_diff(old, new) -> Iterator[dict]:
+    """Yields the differences between the records of two graphs (StoredGraphRecords, GraphObjectRecords, or
+    graph_history.SnapshotRecords): nodes and group memberships, then groups, policies, edges, and changes in which
+    principals can escalate privileges.
+    """
+    # nodes, with their group memberships as separate (node ARN, group ARN) pairs
+    old_nodes = {}
+    old_memberships = set()
+    old_admins = set()
+    for record in old.iter_records('nodes'):
+        old_memberships.update((record['arn'], group_arn) for group_arn in record.pop('group_memberships'))
+        old_nodes[record['arn']] = record
+        if record['is_admin']:
+            old_admins.add(record['arn'])
+    old_arns = set(old_nodes.keys())
+
+    new_arns = set()
+    new_admins = set()
+    for record in new.iter_records('nodes'):
+        arn = record['arn']
+        new_arns.add(arn)
+        if record['is_admin']:
+            new_admins.add(arn)
+        for group_arn in record.pop('group_memberships'):
+            if (arn, group_arn) in old_memberships:
+                old_memberships.remove((arn, group_arn))
+            else:
+                yield {'type': 'group_membership', 'change': 'added', 'node': arn, 'group': group_arn}
+        before = old_nodes.pop(arn, None)
+        if before is None:
+            yield {'type': 'node', 'change': 'added', 'arn': arn}
+        elif before != record:
+            yield {'type': 'node', 'change': 'changed', 'arn': arn, 'fields': _get_changed_fields(before, record)}
+    for arn in old_nodes:
+        yield {'type': 'node', 'change': 'removed', 'arn': arn}
+    for arn, group_arn in sorted(old_memberships):
+        yield {'type': 'group_membership', 'change': 'removed', 'node': arn, 'group': group_arn}
+    del old_nodes, old_memberships
+
+    # groups, which change when their attached policies do
+    old_groups = {record['arn']: record for record in old.iter_records('groups')}
+    for record in new.iter_records('groups'):
+        before = old_groups.pop(record['arn'], None)
+        if before is None:
+            yield {'type': 'group', 'change': 'added', 'arn': record['arn']}
+        elif before != record:
+            yield {'type': 'group', 'change': 'changed', 'arn': record['arn'],
+                   'fields': _get_changed_fields(before, record)}
+    for arn in old_groups:
+        yield {'type': 'group', 'change': 'removed', 'arn': arn}
+    del old_groups
+
+    # policies, compared by the digests of their documents
+    old_policies = {(record['arn'], record['name']): _get_record_digest(record)
+                    for record in old.iter_records('policies')}
+    for record in new.iter_records('policies'):
+        key = (record['arn'], record['name'])
+        digest = _get_record_digest(record)
+        if key not in old_policies:
+            yield {'type': 'policy', 'change': 'added', 'arn': key[0], 'name': key[1]}
+        elif old_policies[key] != digest:
+            yield {'type': 'policy', 'change': 'changed', 'arn': key[0], 'name': key[1],
+                   'before_digest': old_policies[key], 'after_digest': digest}
+        old_policies.pop(key, None)
+    for arn, name in old_policies:
+        yield {'type': 'policy', 'change': 'removed', 'arn': arn, 'name': name}
+    del old_policies
+
+    # edges, which only have an identity, along with the reverse adjacency of each graph for finding privesc
+    old_edges = set()
+    old_sources_by_destination = {}
+    for record in old.iter_records('edges'):
+        old_edges.add((record['source'], record['destination'], record['reason']))
+        old_sources_by_destination.setdefault(record['destination'], []).append(record['source'])
+    new_sources_by_destination = {}
+    for record in new.iter_records('edges'):
+        key = (record['source'], record['destination'], record['reason'])
+        new_sources_by_destination.setdefault(record['destination'], []).append(record['source'])
+        if key in old_edges:
+            old_edges.remove(key)
+        else:
+            yield {'type': 'edge', 'change': 'added', 'source': key[0], 'destination': key[1], 'reason': key[2]}
+    for source, destination, reason in sorted(old_edges):
+        yield {'type': 'edge', 'change': 'removed', 'source': source, 'destination': destination, 'reason': reason}
+    del old_edges
+
+    old_privesc = _get_privesc_arns(old_arns, old_admins, old_sources_by_destination)
+    new_privesc = _get_privesc_arns(new_arns, new_admins, new_sources_by_destination)
+    for arn in sorted(new_privesc - old_privesc):
+        yield {'type': 'privesc', 'change': 'added', 'arn': arn}
+    for arn in sorted(old_privesc - new_privesc):
+        yield {'type': 'privesc', 'change': 'removed', 'arn': arn}
+
+
+def write_diff_as_json_lines(differences: Iterable[dict], output: io.StringIO) -> int:
+    """Writes each difference to output as a line of JSON, as soon as it is computed. Returns how many were written."""
+    count = 0
+    for difference in differences:
+        output.write(json.dumps(difference) + '\n')
+        count += 1
+    return count
+
+
+def _get_changed_fields(before: dict, after: dict) -> Dict[str, dict]:
+    """Helper function: returns the before and after values of each field that differs between two records"""
+    result = {}
+    for field in list(before.keys()) + [key for key in after.keys() if key not in before]:
+        if before.get(field) != after.get(field):
+            result[field] = {'before': before.get(field), 'after': after.get(field)}
+    return result
+
+
+def _get_record_digest(record: dict) -> str:
+    """Helper function: returns the digest of a policy record's document, stored by digest or inline"""
+    if 'policy_digest' in record:
+        return record['policy_digest']
+    return get_policy_digest(record['policy_doc'])
+
+
+def _get_privesc_arns(arns: Set[str], admins: Set[str], sources_by_destination: Dict[str, List[str]]) -> Set[str]:
+    """Helper function: returns the ARNs of the non-admin principals that reach an admin through edges, with one
+    breadth-first search backwards from every admin at once
+    """
+    reached = set(admins)
+    frontier = list(admins)
+    while len(frontier) > 0:
+        next_frontier = []
+        for destination in frontier:
+            for source in sources_by_destination.get(destination, []):
+                if source not in reached:
+                    reached.add(source)
+                    next_frontier.append(source)
+        frontier = next_frontier
+    return (reached - admins) & arns
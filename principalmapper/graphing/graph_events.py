@@ -0,0 +1,317 @@
+"""Code for applying IAM change events (in the form of CloudTrail records) to a Graph, without regathering the data
+of the account.
+
+Each event mutates the Node, Group, or Policy objects it concerns. Once a batch of events is applied, the admin status
+of nodes whose permissions changed is re-evaluated, the cached data of changed nodes and groups is dropped, and only
+the edges from or to changed nodes are recomputed (see principalmapper.graphing.edge_identification.obtain_edges).
+
+Events that cannot be applied from the data in the Graph, such as attaching a managed policy the Graph has never seen,
+are reported and skipped. Use principalmapper.graphing.gathering.update_graph to catch up on those.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import urllib.parse
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from principalmapper.common import Graph, Group, Node, Policy
+from principalmapper.graphing import edge_identification
+from principalmapper.graphing.gathering import update_admin_status
+from principalmapper.util import arns
+from principalmapper.util.debug_print import dprint
+
+if TYPE_CHECKING:
+    import botocore.session
+
+
+def load_events_from_file(filepath: str) -> Iterator[dict]:
+    """Yields the events stored in a JSON Lines file: one CloudTrail record per line. Blank lines are skipped."""
+    with open(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            yield json.loads(line)
+
+
+def apply_events(graph: Graph, events: Iterable[dict], service_list: Iterable[str],
+                 session: Optional['botocore.session.Session'] = None, output: Optional[io.StringIO] = None,
+                 debug: bool = False) -> int:
+    """Applies a sequence of CloudTrail records to the passed Graph, then updates the admin status, cached data, and
+    edges of the nodes they changed. Returns the number of events that were applied.
+
+    Edges are recomputed with the checkers in service_list. Without a session, checkers that call the AWS API (Lambda,
+    CloudFormation) find no edges, so leave them out of service_list when working offline.
+    """
+    if output is None:
+        output = io.StringIO()
+    changed_sources = set()  # type: Set[Node]
+    changed_destinations = set()  # type: Set[Node]
+    changed_groups = set()  # type: Set[Group]
+    applied = 0
+    for event in events:
+        try:
+            sources, destinations, groups = apply_event(graph, event, debug)
+        except ValueError as ex:
+            output.write('Skipped {} event: {}\n'.format(event.get('eventName'), ex))
+            continue
+        changed_sources.update(sources)
+        changed_destinations.update(destinations)
+        changed_groups.update(groups)
+        applied += 1
+
+    # members of changed groups have changed permissions
+    for node in graph.nodes:
+        if any(group in changed_groups for group in node.group_memberships):
+            changed_sources.add(node)
+
+    refresh_changed_nodes(graph, service_list, changed_sources, changed_destinations, changed_groups, session, output,
+                          debug)
+    return applied
+
+
+def refresh_changed_nodes(graph: Graph, service_list: Iterable[str], changed_sources: Set[Node],
+                          changed_destinations: Set[Node], changed_groups: Set[Group],
+                          session: Optional['botocore.session.Session'] = None,
+                          output: Optional[io.StringIO] = None, debug: bool = False) -> None:
+    """Drops the cached data of changed nodes and groups, re-evaluates the admin status of nodes with changed
+    permissions, and recomputes the edges from changed sources and to changed destinations.
+    """
+    if output is None:
+        output = io.StringIO()
+    for group in changed_groups:
+        group.cache.clear()
+    for node in changed_sources | changed_destinations:
+        node.cache.clear()
+
+    source_list = [node for node in graph.nodes if node in changed_sources]
+    for node in source_list:
+        node.is_admin = False
+    update_admin_status(source_list, output, debug)
+
+    output.write('{} changed sources, {} changed destinations\n'.format(len(changed_sources),
+                                                                          len(changed_destinations)))
+    graph.edges = edge_identification.obtain_edges(session, list(service_list), graph.nodes, output, debug,
+                                                   existing_edges=graph.edges, changed_sources=changed_sources,
+                                                   changed_destinations=changed_destinations)
+
+
+def apply_event(graph: Graph, event: dict, debug: bool = False) -> Tuple[Set[Node], Set[Node], Set[Group]]:
+    """Applies a single CloudTrail record to the passed Graph. Returns the nodes whose permissions changed, the nodes
+    whose trust policy or instance profile changed, and the groups whose policies changed. Does not update edges or
+    admin status, see apply_events.
+
+    Records for failed calls, non-IAM services, and events that do not change the Graph are ignored. Raises a
+    ValueError if the event cannot be applied using the data in the Graph.
+    """
+    event_name = event.get('eventName')
+    if event.get('errorCode') is not None or event.get('eventSource', 'iam.amazonaws.com') != 'iam.amazonaws.com':
+        dprint(debug, 'Ignoring event: {}'.format(event_name))
+        return set(), set(), set()
+
+    params = event.get('requestParameters') or {}
+    response = event.get('responseElements') or {}
+    dprint(debug, 'Applying event {} with parameters {}'.format(event_name, params))
+
+    # inline policy changes
+    if event_name in ('PutUserPolicy', 'PutRolePolicy', 'PutGroupPolicy'):
+        holder = _get_policy_holder(graph, event_name, params)
+        policy_doc = _parse_policy_document(params['policyDocument'])
+        for policy in holder.attached_policies:
+            if policy.arn == holder.arn and policy.name == params['policyName']:
+                policy.policy_doc = policy_doc
+                break
+        else:
+            policy = Policy(holder.arn, params['policyName'], policy_doc)
+            holder.attached_policies.append(policy)
+            graph.policies.append(policy)
+        return _changed_holder(holder)
+
+    if event_name in ('DeleteUserPolicy', 'DeleteRolePolicy', 'DeleteGroupPolicy'):
+        holder = _get_policy_holder(graph, event_name, params)
+        for policy in holder.attached_policies:
+            if policy.arn == holder.arn and policy.name == params['policyName']:
+                holder.attached_policies.remove(policy)
+                _remove_unused_policy(graph, policy)
+                return _changed_holder(holder)
+        raise ValueError('No inline policy {} for {}'.format(params['policyName'], holder.arn))
+
+    # managed policy changes
+    if event_name in ('AttachUserPolicy', 'AttachRolePolicy', 'AttachGroupPolicy'):
+        holder = _get_policy_holder(graph, event_name, params)
+        policy = _get_managed_policy(graph, params['policyArn'])
+        if policy not in holder.attached_policies:
+            holder.attached_policies.append(policy)
+        return _changed_holder(holder)
+
+    if event_name in ('DetachUserPolicy', 'DetachRolePolicy', 'DetachGroupPolicy'):
+        holder = _get_policy_holder(graph, event_name, params)
+        policy = _get_managed_policy(graph, params['policyArn'])
+        if policy in holder.attached_policies:
+            holder.attached_policies.remove(policy)
+            _remove_unused_policy(graph, policy)
+        return _changed_holder(holder)
+
+    if event_name == 'CreatePolicyVersion':
+        if str(params.get('setAsDefault')).lower() != 'true':
+            return set(), set(), set()
+        policy = _get_managed_policy(graph, params['policyArn'])
+        policy.policy_doc = _parse_policy_document(params['policyDocument'])
+        version_id = (response.get('policyVersion') or {}).get('versionId')
+        if version_id is not None:
+            graph.metadata.setdefault('policy_versions', {})[policy.arn] = version_id
+        changed_nodes = set(node for node in graph.nodes if policy in node.attached_policies)
+        changed_groups = set(group for group in graph.groups if policy in group.attached_policies)
+        return changed_nodes, set(), changed_groups
+
+    # trust policy and instance profile changes
+    if event_name == 'UpdateAssumeRolePolicy':
+        node = _get_node_by_name(graph, 'role', params['roleName'])
+        node.trust_policy = _parse_policy_document(params['policyDocument'])
+        return set(), {node}, set()
+
+    if event_name in ('AddRoleToInstanceProfile', 'RemoveRoleFromInstanceProfile'):
+        node = _get_node_by_name(graph, 'role', params['roleName'])
+        if event_name == 'AddRoleToInstanceProfile':
+            node.instance_profile = 'arn:{}:iam::{}:instance-profile/{}'.format(
+                arns.get_partition(node.arn), arns.get_account_id(node.arn), params['instanceProfileName'])
+        else:
+            node.instance_profile = None
+        return set(), {node}, set()
+
+    # group memberships
+    if event_name in ('AddUserToGroup', 'RemoveUserFromGroup'):
+        node = _get_node_by_name(graph, 'user', params['userName'])
+        group = _get_group_by_name(graph, params['groupName'])
+        if event_name == 'AddUserToGroup' and group not in node.group_memberships:
+            node.group_memberships.append(group)
+        elif event_name == 'RemoveUserFromGroup' and group in node.group_memberships:
+            node.group_memberships.remove(group)
+        return {node}, set(), set()
+
+    # principals and groups being created or deleted
+    if event_name in ('CreateUser', 'CreateRole'):
+        principal_data = response.get('user') or response.get('role')
+        if principal_data is None:
+            raise ValueError('Missing responseElements for {}'.format(event_name))
+        trust_policy = None
+        if event_name == 'CreateRole':
+            trust_policy = _parse_policy_document(principal_data['assumeRolePolicyDocument'])
+        node = Node(principal_data['arn'], principal_data.get('userId') or principal_data.get('roleId'), [], [],
+                    trust_policy, None, 0, False, False)
+        graph.nodes.append(node)
+        return {node}, {node}, set()
+
+    if event_name in ('DeleteUser', 'DeleteRole'):
+        node = _get_node_by_name(graph, 'user' if event_name == 'DeleteUser' else 'role',
+                                 params.get('userName') or params.get('roleName'))
+        graph.nodes.remove(node)
+        for policy in node.attached_policies:
+            _remove_unused_policy(graph, policy)
+        return set(), set(), set()  # edges to or from removed nodes are dropped when edges are recomputed
+
+    if event_name == 'CreateGroup':
+        group_data = response.get('group')
+        if group_data is None:
+            raise ValueError('Missing responseElements for CreateGroup')
+        graph.groups.append(Group(group_data['arn'], []))
+        return set(), set(), set()
+
+    if event_name == 'DeleteGroup':
+        group = _get_group_by_name(graph, params['groupName'])
+        graph.groups.remove(group)
+        members = set(node for node in graph.nodes if group in node.group_memberships)
+        for node in members:
+            node.group_memberships.remove(group)
+        for policy in group.attached_policies:
+            _remove_unused_policy(graph, policy)
+        return members, set(), set()
+
+    dprint(debug, 'Ignoring event: {}'.format(event_name))
+    return set(), set(), set()
+
+
+def _parse_policy_document(policy_document: Union[str, dict]) -> dict:
+    """Helper function: returns a policy document in dictionary form, from either a dictionary or a (possibly
+    URL-encoded) JSON string.
+    """
+    if isinstance(policy_document, dict):
+        return policy_document
+    try:
+        return json.loads(policy_document)
+    except json.JSONDecodeError:
+        return json.loads(urllib.parse.unquote(policy_document))
+
+
+def _changed_holder(holder: Union[Node, Group]) -> Tuple[Set[Node], Set[Node], Set[Group]]:
+    """Helper function: returns the apply_event result for a node or group whose policies changed"""
+    if isinstance(holder, Group):
+        return set(), set(), {holder}
+    return {holder}, set(), set()
+
+
+def _get_policy_holder(graph: Graph, event_name: str, params: dict) -> Union[Node, Group]:
+    """Helper function: returns the node or group that a *UserPolicy, *RolePolicy, or *GroupPolicy event is about"""
+    if 'UserPolicy' in event_name:
+        return _get_node_by_name(graph, 'user', params['userName'])
+    elif 'RolePolicy' in event_name:
+        return _get_node_by_name(graph, 'role', params['roleName'])
+    else:
+        return _get_group_by_name(graph, params['groupName'])
+
+
+def _get_node_by_name(graph: Graph, node_type: str, name: str) -> Node:
+    """Helper function: returns the user or role with the given name (ignoring paths), raises a ValueError if there is
+    no such node.
+    """
+    for node in graph.nodes:
+        components = arns.get_resource(node.arn).split('/')
+        if components[0] == node_type and components[-1] == name:
+            return node
+    raise ValueError('No {} named {} in the graph'.format(node_type, name))
+
+
+def _get_group_by_name(graph: Graph, name: str) -> Group:
+    """Helper function: returns the group with the given name (ignoring paths), raises a ValueError if there is no such
+    group.
+    """
+    for group in graph.groups:
+        if arns.get_resource(group.arn).split('/')[-1] == name:
+            return group
+    raise ValueError('No group named {} in the graph'.format(name))
+
+
+def _get_managed_policy(graph: Graph, policy_arn: str) -> Policy:
+    """Helper function: returns the managed policy with the given ARN, raises a ValueError if the graph does not have
+    it (its document cannot be known from a CloudTrail record).
+    """
+    for policy in graph.policies:
+        if policy.arn == policy_arn:
+            return policy
+    raise ValueError('Managed policy {} is not in the graph'.format(policy_arn))
+
+
+def _remove_unused_policy(graph: Graph, policy: Policy) -> None:
+    """Helper function: removes a policy from the graph if no node or group has it attached anymore. Managed policies
+    are kept, so that they can be attached again later.
+    """
+    if ':policy/' in policy.arn:
+        return
+    holders = list(graph.nodes) + list(graph.groups)  # type: List[Union[Node, Group]]
+    if not any(policy in holder.attached_policies for holder in holders) and policy in graph.policies:
+        graph.policies.remove(policy)
@@ -0,0 +1,303 @@
+"""Code for keeping a de-duplicated history of snapshots of an account's graph, and for loading the graph as it was at
+an earlier time.
+
+Snapshots are stored under the account's directory in the storage root (see get_storage_root), content-addressed like
+git's objects:
+
+| <storage root>/<account ID>/history/
+|---- blobs/
+|-------- <first two hex digits>/<SHA-256 hex digest>
+|---- manifests/
+|-------- <snapshot ID>.json.gz
+
+Each blob holds one object as compact JSON with sorted keys: a node, a group, the edges out of one node, or a policy
+document. Blobs are named by the SHA-256 digest of their contents (for a policy document, the same as its
+get_policy_digest), so an object that is the same in many snapshots is stored once, and saving a snapshot only writes
+the objects that changed since any earlier one. A manifest lists the blobs of a snapshot along with its creation time,
+the graph's metadata, and its policies, so loading the graph as of a time costs a manifest lookup plus reading the
+blobs it names.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+from principalmapper.common import Graph
+from principalmapper.util.storage import get_storage_root
+
+
+MANIFEST_FORMAT = 'pmapper-snapshot'
+MANIFEST_VERSION = 1
+
+_SNAPSHOT_ID_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+
+
+class GraphHistory(object):
+    """The snapshot history of one account's graph, stored in directory. See the module docstring for its layout."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blobs_directory = os.path.join(directory, 'blobs')
+        self.manifests_directory = os.path.join(directory, 'manifests')
+
+    @classmethod
+    def for_account(cls, account_id: str) -> 'GraphHistory':
+        """Returns the history of an account's graph, under the storage root."""
+        return cls(os.path.join(get_storage_root(), account_id, 'history'))
+
+    def save_snapshot(self, graph: Graph, created: Optional[dt.datetime] = None) -> Tuple[str, int]:
+        """Saves a snapshot of graph, created at the given time (by default, now). Returns the ID of the snapshot and
+        the number of blobs written, which is the number of objects that are not in any earlier snapshot. Raises a
+        ValueError if there is a snapshot created at the same time already.
+        """
+        if created is None:
+            created = dt.datetime.now(dt.timezone.utc)
+        created = _to_utc(created)
+        snapshot_id = created.strftime(_SNAPSHOT_ID_FORMAT)
+        manifest_path = os.path.join(self.manifests_directory, snapshot_id + '.json.gz')
+        if os.path.exists(manifest_path):
+            raise ValueError('There is a snapshot created at {} already'.format(created.isoformat()))
+
+        edges_by_source = {}
+        for edge in graph.edges:
+            edges_by_source.setdefault(edge.source.arn, []).append(edge.to_dictionary())
+
+        old_umask = os.umask(0o077)  # block rwx for group/all
+        try:
+            os.makedirs(self.manifests_directory, 0o700, exist_ok=True)
+            written = 0
+            manifest = {
+                'format': MANIFEST_FORMAT,
+                'version': MANIFEST_VERSION,
+                'created': created.isoformat(),
+                'metadata': graph.metadata,
+                'policies': [],
+                'groups': [],
+                'nodes': [],
+                'edges': []
+            }
+            for policy in graph.policies:
+                manifest['policies'].append({'arn': policy.arn, 'name': policy.name, 'policy_digest': policy.digest})
+                written += self._write_blob(policy.digest, _encode(policy.policy_doc))
+            for group in graph.groups:
+                digest, was_written = self._put_record(group.to_dictionary())
+                manifest['groups'].append(digest)
+                written += was_written
+            for node in graph.nodes:
+                digest, was_written = self._put_record(node.to_dictionary())
+                manifest['nodes'].append(digest)
+                written += was_written
+            for source in sorted(edges_by_source.keys()):
+                digest, was_written = self._put_record(sorted(edges_by_source[source],
+                                                              key=lambda x: (x['destination'], x['reason'])))
+                manifest['edges'].append(digest)
+                written += was_written
+            _write_atomically(manifest_path, gzip.compress(_encode(manifest)))
+        finally:
+            os.umask(old_umask)
+        return snapshot_id, written
+
+    def list_snapshots(self) -> List[Tuple[str, dt.datetime]]:
+        """Returns the ID and creation time of every snapshot, oldest first."""
+        result = []
+        if os.path.exists(self.manifests_directory):
+            for filename in os.listdir(self.manifests_directory):
+                if filename.endswith('.json.gz'):
+                    snapshot_id = filename[:-len('.json.gz')]
+                    created = dt.datetime.strptime(snapshot_id, _SNAPSHOT_ID_FORMAT).replace(tzinfo=dt.timezone.utc)
+                    result.append((snapshot_id, created))
+        return sorted(result, key=lambda x: x[1])
+
+    def get_snapshot_as_of(self, when: dt.datetime) -> str:
+        """Returns the ID of the latest snapshot created at or before when. Raises a ValueError if there is none."""
+        when = _to_utc(when)
+        result = None
+        for snapshot_id, created in self.list_snapshots():
+            if created > when:
+                break
+            result = snapshot_id
+        if result is None:
+            raise ValueError('There is no snapshot in {} from {} or earlier'.format(self.directory, when.isoformat()))
+        return result
+
+    def load_manifest(self, snapshot_id: str) -> dict:
+        """Returns the manifest of a snapshot. Raises a ValueError if there is no such snapshot."""
+        manifest_path = os.path.join(self.manifests_directory, snapshot_id + '.json.gz')
+        if os.path.sep in snapshot_id or not os.path.exists(manifest_path):
+            raise ValueError('There is no snapshot {} in {}'.format(snapshot_id, self.directory))
+        with gzip.open(manifest_path, 'rt', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != MANIFEST_FORMAT or manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError('The manifest of snapshot {} has an unsupported format'.format(snapshot_id))
+        return manifest
+
+    def load_graph(self, snapshot_id: str) -> Graph:
+        """Returns the Graph of a snapshot. Its policy documents are read from their blobs when first accessed."""
+        manifest = self.load_manifest(snapshot_id)
+        records = SnapshotRecords(self, manifest)
+        return Graph.create_graph_from_records(manifest['metadata'], records.iter_records('policies'),
+                                               records.iter_records('groups'), records.iter_records('nodes'),
+                                               records.iter_records('edges'), self)
+
+    def load_graph_as_of(self, when: dt.datetime) -> Graph:
+        """Returns the Graph of the latest snapshot created at or before when. Raises a ValueError if there is none."""
+        return self.load_graph(self.get_snapshot_as_of(when))
+
+    def remove_snapshots_before(self, when: dt.datetime) -> Tuple[int, int]:
+        """Removes the snapshots created before when, then the blobs that no remaining snapshot uses. Returns the
+        number of snapshots and blobs removed.
+        """
+        when = _to_utc(when)
+        removed_snapshots = 0
+        for snapshot_id, created in self.list_snapshots():
+            if created < when:
+                os.remove(os.path.join(self.manifests_directory, snapshot_id + '.json.gz'))
+                removed_snapshots += 1
+
+        used = set()
+        for snapshot_id, _ in self.list_snapshots():
+            manifest = self.load_manifest(snapshot_id)
+            used.update(policy['policy_digest'] for policy in manifest['policies'])
+            for kind in ('groups', 'nodes', 'edges'):
+                used.update(manifest[kind])
+        removed_blobs = 0
+        for digest, path in self._iter_blob_paths():
+            if digest not in used:
+                os.remove(path)
+                removed_blobs += 1
+                if len(os.listdir(os.path.dirname(path))) == 0:
+                    os.rmdir(os.path.dirname(path))
+        return removed_snapshots, removed_blobs
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self._get_blob_path(digest))
+
+    def load_document(self, digest: str) -> dict:
+        """Returns the contents of a blob, such as a policy document. Raises a KeyError if there is no such blob."""
+        try:
+            with open(self._get_blob_path(digest), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except FileNotFoundError:
+            raise KeyError('There is no blob {} in {}'.format(digest, self.directory))
+
+    def _get_blob_path(self, digest: str) -> str:
+        """Helper function: the path of the blob with a given digest"""
+        return os.path.join(self.blobs_directory, digest[:2], digest)
+
+    def _iter_blob_paths(self) -> Iterator[Tuple[str, str]]:
+        """Helper function: yields the digest and path of each blob"""
+        if not os.path.exists(self.blobs_directory):
+            return
+        for prefix in os.listdir(self.blobs_directory):
+            for digest in os.listdir(os.path.join(self.blobs_directory, prefix)):
+                if not digest.startswith('.'):  # skip the temporary files of unfinished writes
+                    yield digest, os.path.join(self.blobs_directory, prefix, digest)
+
+    def _put_record(self, record) -> Tuple[str, int]:
+        """Helper function: stores a record as a blob named by the digest of its contents, returns the digest and
+        whether (1) or not (0) the blob was written
+        """
+        contents = _encode(record)
+        digest = hashlib.sha256(contents).hexdigest()
+        return digest, self._write_blob(digest, contents)
+
+    def _write_blob(self, digest: str, contents: bytes) -> int:
+        """Helper function: writes a blob unless it exists already, returns 1 if it was written and 0 otherwise"""
+        path = self._get_blob_path(digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), 0o700, exist_ok=True)
+        _write_atomically(path, contents)
+        return 1
+
+
+class SnapshotRecords(object):
+    """The records of a snapshot's graph, in the same form as they are stored by Graph.store_graph_as_json, read from
+    the snapshot's blobs. These can be compared with graph_diff.iter_graph_diff.
+    """
+
+    def __init__(self, history: GraphHistory, manifest: dict):
+        self.history = history
+        self.manifest = manifest
+
+    def iter_records(self, kind: str) -> Iterator[dict]:
+        """Yields the records of the given kind: nodes, edges, policies, or groups."""
+        if kind == 'policies':
+            for policy in self.manifest['policies']:
+                yield dict(policy)
+        elif kind == 'edges':
+            for digest in self.manifest['edges']:
+                for edge in self.history.load_document(digest):
+                    yield edge
+        else:
+            for digest in self.manifest[kind]:
+                yield self.history.load_document(digest)
+
+
+def parse_timestamp(value: str) -> dt.datetime:
+    """Parses a date (YYYY-MM-DD) or a date and time (YYYY-MM-DDTHH:MM[:SS], optionally ending with Z) as UTC. A date
+    alone means the end of that day, so that the graph as of a date includes that day's snapshots. Raises a ValueError
+    if the value is in neither form.
+    """
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1]
+    try:
+        result = dt.datetime.strptime(value, '%Y-%m-%d') + dt.timedelta(days=1, microseconds=-1)
+    except ValueError:
+        result = None
+        for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+            try:
+                result = dt.datetime.strptime(value, time_format)
+                break
+            except ValueError:
+                pass
+        if result is None:
+            raise ValueError('Expected a date (YYYY-MM-DD) or a date and time (YYYY-MM-DDTHH:MM:SS), not {}'.format(
+                value))
+    return result.replace(tzinfo=dt.timezone.utc)
+
+
+def _to_utc(value: dt.datetime) -> dt.datetime:
+    """Helper function: converts a datetime to UTC, treating one without a timezone as UTC already"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=dt.timezone.utc)
+    return value.astimezone(dt.timezone.utc)
+
+
+def _encode(data) -> bytes:
+    """Helper function: the compact JSON form of data, with sorted keys so that equal data has equal contents"""
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _write_atomically(path: str, contents: bytes) -> None:
+    """Helper function: writes a file next to path then moves it into place, so readers never see part of it"""
+    fd, temp_path = tempfile.mkstemp(prefix='.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contents)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
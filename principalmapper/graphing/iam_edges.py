@@ -18,21 +18,33 @@
 
 import io
 import os
-from typing import List
+from typing import Iterator, List, Optional
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
 from principalmapper.querying import query_interface
+from principalmapper.querying.local_policy_simulation import get_permission_summary
 
 
+@register_edge_checker('iam')
 class IAMEdgeChecker(EdgeChecker):
     """Class for identifying if IAM can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges."""
-        result = []
-        for node_source in nodes:
-            for node_destination in nodes:
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges."""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        for node_source in source_nodes:
+            # skip sources that cannot call any IAM actions
+            if not get_permission_summary(node_source).could_allow_service('iam'):
+                continue
+
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
@@ -75,11 +87,9 @@ class IAMEdgeChecker(EdgeChecker):
                         if access_keys_mfa:
                             reason = '(MFA required) ' + reason
 
-                        result.append(
-                            Edge(
-                                node_source, node_destination, reason
-                            )
-                        )
+                        new_edge = Edge(node_source, node_destination, reason)
+                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                        yield new_edge
 
                     # Change the user's password
                     if node_destination.active_password:
@@ -102,7 +112,9 @@ class IAMEdgeChecker(EdgeChecker):
                         reason = 'can set the password to authenticate as'
                         if mfa_res:
                             reason = '(MFA required) ' + reason
-                        result.append(Edge(node_source, node_destination, reason))
+                        new_edge = Edge(node_source, node_destination, reason)
+                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                        yield new_edge
 
                 if ':role/' in node_destination.arn:
                     # Change the role's trust doc
@@ -117,8 +129,6 @@ class IAMEdgeChecker(EdgeChecker):
                         reason = 'can update the trust document to access'
                         if mfa_res:
                             reason = '(MFA required) ' + reason
-                        result.append(Edge(node_source, node_destination, reason))
-
-        for edge in result:
-            output.write("Found new edge: {}\n".format(edge.describe_edge()))
-        return result
+                        new_edge = Edge(node_source, node_destination, reason)
+                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                        yield new_edge
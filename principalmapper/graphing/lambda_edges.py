@@ -17,161 +17,203 @@
 
 import io
 import os
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from botocore.exceptions import ClientError
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
-from principalmapper.querying.local_policy_simulation import resource_policy_authorization, ResourcePolicyEvalResult
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
+from principalmapper.graphing.regional_inventory import RegionalInventory
+from principalmapper.querying.local_policy_simulation import get_permission_summary, resource_policy_authorization, \
+    ResourcePolicyEvalResult
 from principalmapper.querying import query_interface
 from principalmapper.util import arns
 
 
+@register_edge_checker('lambda')
 class LambdaEdgeChecker(EdgeChecker):
     """Class for identifying if Lambda can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges. If session object is None, runs checks in offline mode."""
-        result = []
+    destination_types = ('role',)
+    inventory_services = ('lambda',)
 
-        lambda_clients = []
+    def __init__(self, session, inventory: Optional[RegionalInventory] = None):
+        super().__init__(session, inventory)
+        self._function_list = None
+
+    def prefetch(self, output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> None:
+        """Starts listing the Lambda functions of every region."""
         if self.session is not None:
             print('Searching through Lambda-supported regions for existing functions.')
-            lambda_regions = self.session.get_available_regions('lambda')
-            for region in lambda_regions:
-                lambda_clients.append(self.session.create_client('lambda', region_name=region))
-
-        # grab existing lambda functions
-        function_list = []
-        for lambda_client in lambda_clients:
-            try:
-                paginator = lambda_client.get_paginator('list_functions')
-                for page in paginator.paginate(PaginationConfig={'PageSize': 25}):
-                    for func in page['Functions']:
-                        function_list.append(func)
-            except ClientError:
-                output.write('Encountered an exception when listing functions in the region {}\n'.format(
-                    lambda_client.meta.region_name))
-
-        for node_source in nodes:
-            for node_destination in nodes:
+            self._get_inventory().scan('lambda', _list_functions, output, debug)
+
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges. If session object is None, runs checks in offline mode."""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        function_list = self._get_function_list(output, debug)
+        lambda_assumable_roles = {}  # (account ID, role ARN) -> if Lambda can assume the role
+
+        for node_source in source_nodes:
+            # skip sources that cannot call any Lambda actions
+            if not get_permission_summary(node_source).could_allow_service('lambda'):
+                continue
+
+            # check if source is an admin, if so it can access destination but this is not tracked via an Edge
+            if node_source.is_admin:
+                continue
+
+            # everything except iam:PassRole depends only on the source, so check it once per source
+            can_create_function, need_mfa_create = query_interface.local_check_authorization_handling_mfa(
+                node_source,
+                'lambda:CreateFunction',
+                '*',
+                {},
+                debug
+            )
+            editable_functions_by_role, reconfigurable_function = self._get_function_capabilities(
+                node_source, function_list, debug
+            )
+            if not can_create_function and reconfigurable_function is None and len(editable_functions_by_role) == 0:
+                continue
+
+            source_account = arns.get_account_id(node_source.arn)
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
 
-                # check if source is an admin, if so it can access destination but this is not tracked via an Edge
-                if node_source.is_admin:
-                    continue
-
                 # check that destination is a role
                 if ':role/' not in node_destination.arn:
                     continue
 
                 # check that the destination role can be assumed by Lambda
-                sim_result = resource_policy_authorization(
-                    'lambda.amazonaws.com',
-                    arns.get_account_id(node_source.arn),
-                    node_destination.trust_policy,
-                    'sts:AssumeRole',
-                    node_destination.arn,
-                    {},
-                    debug
-                )
-
-                if sim_result != ResourcePolicyEvalResult.SERVICE_MATCH:
-                    continue  # Lambda wasn't auth'd to assume the role
-
-                # check that source can pass the destination role (store result for future reference)
-                can_pass_role, need_mfa_passrole = query_interface.local_check_authorization_handling_mfa(
-                    node_source,
-                    'iam:PassRole',
-                    node_destination.arn,
-                    {
-                        'iam:PassedToService': 'lambda.amazonaws.com'
-                    },
-                    debug
-                )
-
-                # check that source can create a Lambda function and pass it an execution role
-                if can_pass_role:
-                    can_create_function, need_mfa_0 = query_interface.local_check_authorization_handling_mfa(
-                        node_source,
-                        'lambda:CreateFunction',
-                        '*',
+                assumable_key = (source_account, node_destination.arn)
+                if assumable_key not in lambda_assumable_roles:
+                    sim_result = resource_policy_authorization(
+                        'lambda.amazonaws.com',
+                        source_account,
+                        node_destination.trust_policy,
+                        'sts:AssumeRole',
+                        node_destination.arn,
                         {},
                         debug
                     )
-                    if can_create_function:
-                        if need_mfa_0 or need_mfa_passrole:
-                            reason = '(requires MFA) can use Lambda to create a new function with arbitrary code, ' \
-                                     'then pass and access'
-                        else:
-                            reason = 'can use Lambda to create a new function with arbitrary code, then pass and access'
-                        new_edge = Edge(
-                            node_source,
-                            node_destination,
-                            reason
-                        )
-                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                        result.append(new_edge)
-
-                # List of (<function>, bool, bool, bool)
-                func_data = []
-                for func in function_list:
-                    can_change_code, need_mfa_1 = query_interface.local_check_authorization_handling_mfa(
+                    lambda_assumable_roles[assumable_key] = sim_result == ResourcePolicyEvalResult.SERVICE_MATCH
+                if not lambda_assumable_roles[assumable_key]:
+                    continue  # Lambda wasn't auth'd to assume the role
+
+                # check that source can pass the destination role, if any check below needs it
+                can_pass_role, need_mfa_passrole = False, False
+                if can_create_function or reconfigurable_function is not None:
+                    can_pass_role, need_mfa_passrole = query_interface.local_check_authorization_handling_mfa(
                         node_source,
-                        'lambda:UpdateFunctionCode',
-                        func['FunctionArn'],
-                        {},
+                        'iam:PassRole',
+                        node_destination.arn,
+                        {
+                            'iam:PassedToService': 'lambda.amazonaws.com'
+                        },
                         debug
                     )
-                    can_change_config, need_mfa_2 = query_interface.local_check_authorization_handling_mfa(
+
+                # check that source can create a Lambda function and pass it an execution role
+                if can_pass_role and can_create_function:
+                    if need_mfa_create or need_mfa_passrole:
+                        reason = '(requires MFA) can use Lambda to create a new function with arbitrary code, ' \
+                                 'then pass and access'
+                    else:
+                        reason = 'can use Lambda to create a new function with arbitrary code, then pass and access'
+                    new_edge = Edge(
                         node_source,
-                        'lambda:UpdateFunctionConfiguration',
-                        func['FunctionArn'],
-                        {},
-                        debug
+                        node_destination,
+                        reason
                     )
-                    func_data.append((func, can_change_code, can_change_config, need_mfa_passrole or need_mfa_1 or need_mfa_2))
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
 
                 # check that source can modify a Lambda function and use its existing role
-                for func, can_change_code, can_change_config, need_mfa in func_data:
-                    if node_destination.arn == func['Role']:
-                        if can_change_code:
-                            if need_mfa:
-                                reason = '(requires MFA) can use Lambda to edit an existing function ({}) to access'.format(
-                                    func['FunctionArn']
-                                )
-                            else:
-                                reason = 'can use Lambda to edit an existing function ({}) to access'.format(
-                                    func['FunctionArn']
-                                )
-                            new_edge = Edge(
-                                node_source,
-                                node_destination,
-                                reason
-                            )
-                            output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                            break
-
-                # check that source can modify a Lambda function and pass it another execution role
-                for func, can_change_code, can_change_config, need_mfa in func_data:
-                    if can_change_config and can_change_code and can_pass_role:
-                        if need_mfa:
-                            reason = '(requires MFA) can use Lambda to edit an existing function ({}) to access'.format(
-                                func['FunctionArn']
-                            )
-                        else:
-                            reason = 'can use Lambda to edit an existing function ({}) to access'.format(
-                                func['FunctionArn']
-                            )
-                        new_edge = Edge(
-                            node_source,
-                            node_destination,
-                            reason
-                        )
-                        output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                        break
-
-        return result
+                if node_destination.arn in editable_functions_by_role:
+                    func, need_mfa = editable_functions_by_role[node_destination.arn]
+                    new_edge = Edge(
+                        node_source,
+                        node_destination,
+                        _get_edit_function_reason(func, need_mfa)
+                    )
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
+
+                # check that source can modify a Lambda function and pass it another execution role (skipped if the
+                # destination is already reachable by editing one of its functions, as the edge would be the same)
+                elif can_pass_role and reconfigurable_function is not None:
+                    func, need_mfa = reconfigurable_function
+                    new_edge = Edge(
+                        node_source,
+                        node_destination,
+                        _get_edit_function_reason(func, need_mfa or need_mfa_passrole)
+                    )
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
+
+    def _get_function_capabilities(self, node_source: Node, function_list: List[dict], debug: bool = False) \
+            -> Tuple[Dict[str, Tuple[dict, bool]], Optional[Tuple[dict, bool]]]:
+        """Checks which functions a source can change, once per source. Returns a dictionary mapping execution role
+        ARNs to the first function with that role whose code the source can change (and if that requires MFA), and
+        the first function whose code and configuration the source can change (and if that requires MFA) or None.
+        """
+        editable_functions_by_role = {}
+        reconfigurable_function = None
+        for func in function_list:
+            can_change_code, need_mfa_code = query_interface.local_check_authorization_handling_mfa(
+                node_source,
+                'lambda:UpdateFunctionCode',
+                func['FunctionArn'],
+                {},
+                debug
+            )
+            if not can_change_code:
+                continue
+            if func['Role'] not in editable_functions_by_role:
+                editable_functions_by_role[func['Role']] = (func, need_mfa_code)
+            if reconfigurable_function is None:
+                can_change_config, need_mfa_config = query_interface.local_check_authorization_handling_mfa(
+                    node_source,
+                    'lambda:UpdateFunctionConfiguration',
+                    func['FunctionArn'],
+                    {},
+                    debug
+                )
+                if can_change_config:
+                    reconfigurable_function = (func, need_mfa_code or need_mfa_config)
+        return editable_functions_by_role, reconfigurable_function
+
+    def _get_function_list(self, output: io.StringIO = open(os.devnull, 'w'), debug: bool = False) -> List[dict]:
+        """Lists the Lambda functions of every region, once per EdgeChecker object. Returns an empty list in offline
+        mode.
+        """
+        if self._function_list is None:
+            if self.session is None:
+                self._function_list = []
+            else:
+                self.prefetch(output, debug)
+                self._function_list = self._get_inventory().scan('lambda', _list_functions).result()
+        return self._function_list
+
+
+def _get_edit_function_reason(func: dict, need_mfa: bool) -> str:
+    """Helper function: returns the reason of an edge through editing an existing function"""
+    if need_mfa:
+        return '(requires MFA) can use Lambda to edit an existing function ({}) to access'.format(func['FunctionArn'])
+    return 'can use Lambda to edit an existing function ({}) to access'.format(func['FunctionArn'])
+
+
+def _list_functions(lambda_client) -> List[dict]:
+    """Helper function: returns the Lambda functions of the region of the passed client"""
+    result = []
+    paginator = lambda_client.get_paginator('list_functions')
+    for page in paginator.paginate(PaginationConfig={'PageSize': 25}):
+        result.extend(page['Functions'])
+    return result
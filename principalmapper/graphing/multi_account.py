@@ -0,0 +1,353 @@
+"""Code for creating the graphs of many AWS accounts at once, such as every member account of an organization.
+
+Each account is given as a role ARN to assume or an AWS CLI profile name. Accounts are gathered concurrently on a thread
+pool, with every API call drawing from one global rate budget, and the edge checks that do not call the AWS API run in
+a process pool so that they use every CPU. The gathered data is handed from thread to process through the account's
+GraphCheckpoint, and each graph is stored in the standard location for its account.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import os.path
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Tuple
+
+from principalmapper.graphing import gathering
+from principalmapper.graphing.checkpoint import GraphCheckpoint
+from principalmapper.graphing.edge_identification import checker_map, ensure_plugin_checkers
+from principalmapper.util import arns, botocore_tools
+from principalmapper.util.debug_print import dprint
+from principalmapper.util.storage import get_storage_root
+
+if TYPE_CHECKING:
+    import botocore.session
+
+
+DEFAULT_CALLS_PER_SECOND = 50.0
+DEFAULT_GATHER_WORKERS = 8
+
+
+class ApiRateLimiter(object):
+    """A rate budget for AWS API calls shared by every thread: acquire() blocks until the next call may be made, so
+    calls are spaced evenly at calls_per_second at most. Tracks how many calls were made and how long callers waited.
+    """
+
+    def __init__(self, calls_per_second: float = DEFAULT_CALLS_PER_SECOND):
+        if calls_per_second <= 0:
+            raise ValueError('The API rate budget must be above zero calls per second')
+        self.calls_per_second = calls_per_second
+        self.calls = 0
+        self.seconds_waited = 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Waits for the next free slot in the budget, then takes it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1.0 / self.calls_per_second
+            self.calls += 1
+            if slot > now:
+                self.seconds_waited += slot - now
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RateLimitedSession(object):
+    """Wraps a botocore Session (or a RecordingSession/ReplaySession), making each API call of the clients it creates
+    wait for an ApiRateLimiter first. Counts the calls made through it.
+    """
+
+    def __init__(self, session: 'botocore.session.Session', limiter: ApiRateLimiter):
+        self._session = session
+        self.limiter = limiter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create_client(self, service_name: str, region_name: Optional[str] = None, **kwargs):
+        """Creates a client from the wrapped session whose API calls are rate-limited."""
+        client = self._session.create_client(service_name, region_name=region_name, **kwargs)
+        # ahead of other before-call handlers, which may answer the call themselves (see ReplaySession)
+        client.meta.events.register_first('before-call', self._before_call)
+        return client
+
+    def __getattr__(self, item):
+        return getattr(self._session, item)
+
+    def _before_call(self, **kwargs):
+        self.limiter.acquire()
+        with self._lock:
+            self.calls += 1
+
+
+class TargetSessionFactory(object):
+    """Creates the session for an account given as a role ARN or an AWS CLI profile name. Roles are assumed with the
+    credentials of the profile passed when creating the factory (or those from the environment), and their credentials
+    are refreshed by assuming them again when they expire. Safe to call from multiple threads.
+    """
+
+    def __init__(self, profile: Optional[str] = None):
+        self.profile = profile
+        self._stsclient = None
+        self._lock = threading.Lock()
+
+    def __call__(self, target: str) -> 'botocore.session.Session':
+        import botocore.credentials
+        import botocore.session
+
+        if not is_role_arn(target):
+            return botocore.session.Session(profile=target)
+
+        with self._lock:
+            if self._stsclient is None:
+                self._stsclient = botocore_tools.get_session(self.profile).create_client('sts')
+        stsclient = self._stsclient
+
+        def _assume_role() -> dict:
+            credentials = stsclient.assume_role(RoleArn=target, RoleSessionName='pmapper')['Credentials']
+            return {
+                'access_key': credentials['AccessKeyId'],
+                'secret_key': credentials['SecretAccessKey'],
+                'token': credentials['SessionToken'],
+                'expiry_time': credentials['Expiration'].isoformat()
+            }
+
+        class _TargetRoleProvider(botocore.credentials.CredentialProvider):
+            METHOD = 'pmapper-assume-role'
+
+            def load(self):
+                return botocore.credentials.RefreshableCredentials.create_from_metadata(
+                    _assume_role(), _assume_role, self.METHOD)
+
+        # the role's credentials come first in the session's credential provider chain
+        result = botocore.session.Session()
+        result.get_component('credential_provider').insert_before('env', _TargetRoleProvider())
+        return result
+
+
+class AccountGraphResult(object):
+    """Tracks the outcome of creating the graph for one account: its timing, size, and API calls, or the error that
+    stopped it.
+    """
+
+    __slots__ = ['target', 'account_id', 'gather_seconds', 'edge_seconds', 'api_calls', 'nodes', 'edges', 'error']
+
+    def __init__(self, target: str):
+        self.target = target
+        self.account_id = None
+        self.gather_seconds = 0.0
+        self.edge_seconds = 0.0
+        self.api_calls = 0
+        self.nodes = 0
+        self.edges = 0
+        self.error = None
+
+
+class SpawnPoolExecutor(object):
+    """Stands in for a ProcessPoolExecutor of spawned processes on Python 3.5 and 3.6, where ProcessPoolExecutor does
+    not take mp_context: runs functions on a multiprocessing Pool from the spawn context, and submit() returns a
+    concurrent.futures.Future that is resolved with the function's result or exception.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._pool = multiprocessing.get_context('spawn').Pool(processes=max_workers)
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """Runs fn(*args) in one of the processes."""
+        future = concurrent.futures.Future()
+        self._pool.apply_async(fn, args, callback=future.set_result, error_callback=future.set_exception)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops accepting work, and waits for the submitted work to finish if wait is True."""
+        self._pool.close()
+        if wait:
+            self._pool.join()
+
+
+def is_role_arn(target: str) -> bool:
+    """Returns True if an account target is a role ARN rather than a profile name."""
+    return target.startswith('arn:') and arns.validate_arn(target) and arns.get_resource(target).startswith('role/')
+
+
+def load_targets(filepath: str) -> List[str]:
+    """Reads account targets from a file, one role ARN or profile name per line. Blank lines and lines starting with
+    # are skipped.
+    """
+    result = []
+    with open(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                result.append(line)
+    return result
+
+
+def create_graphs(targets: Iterable[str], service_list: Iterable[str], output: Optional[io.StringIO] = None,
+                  debug: bool = False, calls_per_second: float = DEFAULT_CALLS_PER_SECOND,
+                  gather_workers: int = DEFAULT_GATHER_WORKERS, edge_processes: Optional[int] = None,
+                  session_factory: Optional[Callable[[str], 'botocore.session.Session']] = None,
+                  resume: bool = False, compression: Optional[str] = None) -> List[AccountGraphResult]:
+    """Creates and stores the graph of every account in targets (role ARNs or profile names), then writes a timing
+    summary to output. Returns an AccountGraphResult per target, in order.
+
+    Up to gather_workers accounts are gathered at once, with every API call drawing from one budget of
+    calls_per_second. Edge checks that call the AWS API run along with gathering, the others run in a pool of
+    edge_processes processes (one per CPU by default) as soon as an account is gathered. session_factory turns a target
+    into a session, by default a TargetSessionFactory using the credentials from the environment.
+
+    A failure in one account is reported and does not stop the others. If resume is True, the progress saved by an
+    interrupted run for each account is kept (see GraphCheckpoint). Graphs are stored with the given compression, see
+    Graph.store_graph_as_json.
+    """
+    if output is None:
+        output = io.StringIO()
+    if session_factory is None:
+        session_factory = TargetSessionFactory()
+    ensure_plugin_checkers(debug)
+    service_list = list(service_list)
+    limiter = ApiRateLimiter(calls_per_second)
+    results = [AccountGraphResult(target) for target in targets]
+    claimed_accounts = set()
+    claim_lock = threading.Lock()
+    start = time.perf_counter()
+
+    edge_pool = _create_edge_pool(edge_processes)
+    gather_pool = concurrent.futures.ThreadPoolExecutor(max_workers=gather_workers)
+    try:
+        gather_futures = {}
+        for result in results:
+            future = gather_pool.submit(_gather_account, result, session_factory, limiter, service_list,
+                                        claimed_accounts, claim_lock, resume, debug)
+            gather_futures[future] = result
+
+        edge_futures = {}
+        for future in concurrent.futures.as_completed(gather_futures):
+            result = gather_futures[future]
+            graph_dir = future.result()
+            if graph_dir is None:
+                output.write('Unable to gather {}: {}\n'.format(result.target, result.error))
+                continue
+            output.write('Gathered account {} ({}) in {:.3f} seconds\n'.format(result.account_id, result.target,
+                                                                              result.gather_seconds))
+            edge_futures[edge_pool.submit(_identify_edges, graph_dir, service_list, debug, compression)] = result
+
+        for future in concurrent.futures.as_completed(edge_futures):
+            result = edge_futures[future]
+            try:
+                result.nodes, result.edges, result.edge_seconds = future.result()
+            except Exception as ex:
+                result.error = 'edge identification failed: {}'.format(ex)
+                output.write('Unable to identify edges for account {}: {}\n'.format(result.account_id, ex))
+                continue
+            output.write('Stored the graph of account {}\n'.format(result.account_id))
+    finally:
+        gather_pool.shutdown(wait=True)
+        edge_pool.shutdown(wait=True)
+
+    write_summary(results, time.perf_counter() - start, limiter, output)
+    return results
+
+
+def write_summary(results: List[AccountGraphResult], wall_seconds: float, limiter: ApiRateLimiter,
+                  output: Optional[io.StringIO] = None) -> None:
+    """Writes the timing, size, and API calls of each account, then the totals across accounts."""
+    if output is None:
+        output = io.StringIO()
+    output.write('{:<14} {:>8} {:>8} {:>12} {:>12} {:>10}\n'.format('Account', 'Nodes', 'Edges', 'Gather (s)',
+                                                                   'Edges (s)', 'API calls'))
+    for result in results:
+        if result.error is None:
+            output.write('{:<14} {:>8} {:>8} {:>12.3f} {:>12.3f} {:>10}\n'.format(
+                result.account_id, result.nodes, result.edges, result.gather_seconds, result.edge_seconds,
+                result.api_calls))
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        output.write('Failed: {}: {}\n'.format(result.target, result.error))
+    output.write('Created {} of {} graphs in {:.3f} seconds: {:.3f} seconds gathering and {:.3f} seconds identifying '
+                 'edges in total\n'.format(len(results) - len(failed), len(results), wall_seconds,
+                                           sum(result.gather_seconds for result in results),
+                                           sum(result.edge_seconds for result in results)))
+    output.write('{} API calls at up to {} per second, {:.3f} seconds spent waiting on the rate budget\n'.format(
+        limiter.calls, limiter.calls_per_second, limiter.seconds_waited))
+
+
+def _create_edge_pool(max_workers: Optional[int]):
+    """Helper function: returns the process pool for edge checks. Its processes are spawned rather than forked, since
+    forking while the gathering threads hold locks can deadlock the child processes.
+    """
+    if sys.version_info >= (3, 7):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+    return SpawnPoolExecutor(max_workers)
+
+
+def _gather_account(result: AccountGraphResult, session_factory: Callable[[str], 'botocore.session.Session'],
+                    limiter: ApiRateLimiter, service_list: List[str], claimed_accounts: set,
+                    claim_lock: threading.Lock, resume: bool, debug: bool) -> Optional[str]:
+    """Helper function, runs on the thread pool: gathers an account into its checkpoint along with the edge checks that
+    call the AWS API, and returns the directory to store its graph in. On failure, records the error in result and
+    returns None.
+    """
+    start = time.perf_counter()
+    session = None
+    try:
+        session = RateLimitedSession(session_factory(result.target), limiter)
+        result.account_id = session.create_client('sts').get_caller_identity()['Account']
+        with claim_lock:
+            if result.account_id in claimed_accounts:
+                result.error = 'account {} is already gathered for another target'.format(result.account_id)
+                return None
+            claimed_accounts.add(result.account_id)
+
+        graph_dir = os.path.join(get_storage_root(), result.account_id)
+        checkpoint = GraphCheckpoint(os.path.join(graph_dir, 'checkpoint'))
+        if not resume:
+            checkpoint.clear()
+        network_checks = [check for check in service_list if check in checker_map and
+                          (checker_map[check].requires_network or len(checker_map[check].inventory_services) > 0)]
+        dprint(debug, 'Gathering {} with the edge checks {}'.format(result.target, network_checks))
+        with open(os.devnull, 'w') as devnull:
+            gathering.create_graph(session, network_checks, devnull, debug, checkpoint)
+        return graph_dir
+    except Exception as ex:
+        result.error = str(ex)
+        return None
+    finally:
+        result.gather_seconds = time.perf_counter() - start
+        if session is not None:
+            result.api_calls = session.calls
+
+
+def _identify_edges(graph_dir: str, service_list: List[str], debug: bool,
+                    compression: Optional[str]) -> Tuple[int, int, float]:
+    """Helper function, runs on the process pool: finishes the graph of a gathered account from its checkpoint, without
+    calling the AWS API, then stores it. Returns the number of nodes, the number of edges, and the seconds it took.
+    """
+    start = time.perf_counter()
+    checkpoint = GraphCheckpoint(os.path.join(graph_dir, 'checkpoint'))
+    with open(os.devnull, 'w') as devnull:
+        graph = gathering.create_graph(None, service_list, devnull, debug, checkpoint)
+    graph.store_graph_as_json(graph_dir, compression)
+    checkpoint.clear()
+    return len(graph.nodes), len(graph.edges), time.perf_counter() - start
@@ -0,0 +1,150 @@
+"""Code for listing resources in every region of a service concurrently, such as the Lambda functions and
+CloudFormation stacks that edge checkers look through.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import io
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from principalmapper.util.debug_print import dprint
+
+if TYPE_CHECKING:
+    import botocore.session
+
+
+DEFAULT_MAX_WORKERS = 16
+
+
+class RegionScanResult(object):
+    """Tracks the outcome of listing a service's resources in one region."""
+
+    __slots__ = ['service', 'region', 'items', 'seconds', 'errors']
+
+    def __init__(self, service: str, region: str):
+        self.service = service
+        self.region = region
+        self.items = []
+        self.seconds = 0.0
+        self.errors = 0
+
+
+class RegionalScan(object):
+    """A listing of a service's resources across its regions, running on a RegionalInventory's thread pool. Call
+    result() to wait for every region and get the combined list of resources, in region order.
+    """
+
+    def __init__(self, service: str, futures: List[Tuple[str, concurrent.futures.Future]]):
+        self.service = service
+        self._futures = futures
+
+    def result(self) -> List[dict]:
+        """Waits for every region, then returns their resources."""
+        result = []
+        for _, future in self._futures:
+            result.extend(future.result().items)
+        return result
+
+    def region_results(self) -> List[RegionScanResult]:
+        """Waits for every region, then returns the outcome of each."""
+        return [future.result() for _, future in self._futures]
+
+
+class RegionalInventory(object):
+    """Lists resources across every region of one or more services concurrently. One thread pool is shared by every
+    service scanned, so the regions of different services are scanned in parallel too, and one client is kept per
+    service and region so its connections are reused.
+
+    Clients are created from the calling thread, since botocore sessions are not thread-safe (clients are).
+    """
+
+    def __init__(self, session: 'botocore.session.Session', max_workers: int = DEFAULT_MAX_WORKERS):
+        self.session = session
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._clients = {}
+        self._scans = {}  # type: Dict[str, RegionalScan]
+        self._lock = threading.Lock()
+
+    def get_client(self, service: str, region: str):
+        """Returns the client for a service in a region, creating it the first time."""
+        key = (service, region)
+        if key not in self._clients:
+            self._clients[key] = self.session.create_client(service, region_name=region)
+        return self._clients[key]
+
+    def scan(self, service: str, list_function: Callable[[object], List[dict]],
+             output: Optional[io.StringIO] = None, debug: bool = False) -> RegionalScan:
+        """Starts listing a service's resources in each of its regions, returning a RegionalScan to get the results
+        from. list_function is called with the client for each region and returns the resources in that region.
+
+        A service is only scanned once per RegionalInventory: later calls return the first scan.
+        """
+        if output is None:
+            output = io.StringIO()
+        with self._lock:
+            if service in self._scans:
+                return self._scans[service]
+            futures = []
+            for region in self.session.get_available_regions(service):
+                client = self.get_client(service, region)
+                futures.append((region, self._executor.submit(_scan_region, service, region, client, list_function,
+                                                              output, debug)))
+            result = RegionalScan(service, futures)
+            self._scans[service] = result
+            return result
+
+    def write_report(self, output: Optional[io.StringIO] = None) -> None:
+        """Writes the timing, number of resources, and number of errors of each region scanned, then totals for each
+        service.
+        """
+        if output is None:
+            output = io.StringIO()
+        for service, scan in self._scans.items():
+            total_seconds, total_items, total_errors = 0.0, 0, 0
+            for region_result in scan.region_results():
+                output.write('{} in {}: {} resources in {:.3f} seconds, {} errors\n'.format(
+                    service, region_result.region, len(region_result.items), region_result.seconds,
+                    region_result.errors))
+                total_seconds += region_result.seconds
+                total_items += len(region_result.items)
+                total_errors += region_result.errors
+            output.write('{} total: {} resources from {} regions in {:.3f} seconds of API time, {} errors\n'.format(
+                service, total_items, len(scan.region_results()), total_seconds, total_errors))
+
+    def close(self) -> None:
+        """Waits for any scan still running, then stops the thread pool."""
+        self._executor.shutdown(wait=True)
+
+
+def _scan_region(service: str, region: str, client, list_function: Callable[[object], List[dict]],
+                 output: io.StringIO, debug: bool) -> RegionScanResult:
+    """Helper function, runs on the thread pool: lists a service's resources in one region"""
+    from botocore.exceptions import BotoCoreError, ClientError  # only scanned with a session, so botocore is loaded
+
+    result = RegionScanResult(service, region)
+    start = time.perf_counter()
+    try:
+        result.items = list_function(client)
+    except (ClientError, BotoCoreError) as ex:
+        result.errors += 1
+        output.write('Encountered an exception when listing {} resources in the region {}\n'.format(service, region))
+        dprint(debug, 'Exception for {} in {}: {}'.format(service, region, ex))
+    result.seconds = time.perf_counter() - start
+    return result
+
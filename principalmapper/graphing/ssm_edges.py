@@ -17,21 +17,36 @@
 
 import io
 import os
-from typing import List
+from typing import Iterator, List, Optional
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
 from principalmapper.querying import query_interface
+from principalmapper.querying.local_policy_simulation import get_permission_summary
 
 
+@register_edge_checker('ssm')
 class SSMEdgeChecker(EdgeChecker):
     """Class for identifying if SSM can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges. If session object is None, runs checks in offline mode."""
-        result = []
-        for node_source in nodes:
-            for node_destination in nodes:
+    destination_types = ('role',)
+
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges. If session object is None, runs checks in offline mode."""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        for node_source in source_nodes:
+            # skip sources that cannot send commands or start sessions
+            summary = get_permission_summary(node_source)
+            if not (summary.could_allow_action('ssm:SendCommand') or summary.could_allow_action('ssm:StartSession')):
+                continue
+
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
@@ -63,7 +78,9 @@ class SSMEdgeChecker(EdgeChecker):
                     reason = 'can call ssm:SendCommand to access an EC2 instance with access to'
                     if mfa_res_1:
                         reason = '(Requires MFA) ' + reason
-                    result.append(Edge(node_source, node_destination, reason))
+                    new_edge = Edge(node_source, node_destination, reason)
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
 
                 sesh_auth_res, mfa_res_2 = query_interface.local_check_authorization_handling_mfa(
                     node_source,
@@ -77,8 +94,6 @@ class SSMEdgeChecker(EdgeChecker):
                     reason = 'can call ssm:StartSession to access an EC2 instance with access to'
                     if mfa_res_2:
                         reason = '(Requires MFA) ' + reason
-                    result.append(Edge(node_source, node_destination, reason))
-
-        for edge in result:
-            output.write("Found new edge: {}\n".format(edge.describe_edge()))
-        return result
+                    new_edge = Edge(node_source, node_destination, reason)
+                    output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
+                    yield new_edge
@@ -17,23 +17,32 @@
 
 import io
 import os
-from typing import List
+from typing import Iterator, List, Optional
 
 from principalmapper.common import Edge, Node
-from principalmapper.graphing.edge_checker import EdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
 from principalmapper.querying import query_interface
 from principalmapper.querying.local_policy_simulation import resource_policy_authorization, ResourcePolicyEvalResult, has_matching_statement
 from principalmapper.util import arns
 
 
+@register_edge_checker('sts')
 class STSEdgeChecker(EdgeChecker):
     """Class for identifying if STS can be used by IAM principals to gain access to other IAM principals."""
 
-    def return_edges(self, nodes: List[Node], output: io.StringIO = os.devnull, debug: bool = False) -> List[Edge]:
-        """Fulfills expected method return_edges. If the session object is None, performs checks in offline-mode"""
-        result = []
-        for node_source in nodes:
-            for node_destination in nodes:
+    destination_types = ('role',)
+
+    def iter_edges(self, nodes: List[Node], output: io.StringIO = open(os.devnull, 'w'), debug: bool = False,
+                   source_nodes: Optional[List[Node]] = None,
+                   destination_nodes: Optional[List[Node]] = None) -> Iterator[Edge]:
+        """Fulfills expected method iter_edges. If the session object is None, performs checks in offline-mode"""
+        if source_nodes is None:
+            source_nodes = nodes
+        if destination_nodes is None:
+            destination_nodes = nodes
+
+        for node_source in source_nodes:
+            for node_destination in destination_nodes:
                 # skip self-access checks
                 if node_source == node_destination:
                     continue
@@ -95,7 +104,7 @@ class STSEdgeChecker(EdgeChecker):
                             reason
                         )
                         output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                        result.append(new_edge)
+                        yield new_edge
                     elif not (policy_denies_mfa and policy_denies) and sim_result == ResourcePolicyEvalResult.NODE_MATCH:
                         # testing same-account scenario, so NODE_MATCH will override a lack of an allow from iam policy
                         new_edge = Edge(
@@ -104,6 +113,4 @@ class STSEdgeChecker(EdgeChecker):
                             'can access via sts:AssumeRole'
                         )
                         output.write('Found new edge: {}\n'.format(new_edge.describe_edge()))
-                        result.append(new_edge)
-
-        return result
+                        yield new_edge
@@ -19,13 +19,13 @@ API calls to AWS."""
 
 import ast
 import datetime as dt
-import dateutil.parser as dup
 from enum import Enum
 import ipaddress
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Set, Union
 import re
 
-from principalmapper.common import Node, Policy
+from principalmapper.common import Group, Node, Policy
+from principalmapper.querying import profiling
 from principalmapper.util.debug_print import dprint
 from principalmapper.util import arns
 
@@ -51,22 +51,133 @@ def has_matching_statement(principal: Node, effect_value: str, action_to_check:
             return True
 
     for group in principal.group_memberships:
-        for policy in group.attached_policies:
-            if policy_has_matching_statement(policy, effect_value, action_to_check, resource_to_check,
-                                             condition_keys_to_check, debug):
-                return True
+        if group_has_matching_statement(group, effect_value, action_to_check, resource_to_check,
+                                        condition_keys_to_check, debug):
+            return True
 
     return False
 
 
+def group_has_matching_statement(group: Group, effect_value: str, action_to_check: str, resource_to_check: str,
+                                 condition_keys_to_check: dict, debug: bool = False) -> bool:
+    """Searches the policies of a specific Group object.
+
+    Results are cached with the Group, keyed by the effect, action, resource, and the values of the condition keys
+    that the group's policies reference, so every member of the group reuses them. If the group's policies reference
+    principal-specific keys (such as aws:username), the results would differ per member, so they are not cached at
+    the group level.
+    """
+    referenced_keys = _get_referenced_condition_keys_for_group(group)
+    if any(_is_principal_specific_condition_key(key) for key in referenced_keys):
+        dprint(debug, 'policies of group {} reference principal-specific keys, evaluating per member'.format(group.arn))
+        return _group_has_matching_statement(group, effect_value, action_to_check, resource_to_check,
+                                             condition_keys_to_check, debug)
+
+    results = group.cache.get('evaluation_results')
+    if results is None:
+        results = group.cache['evaluation_results'] = {}
+    cache_key = (effect_value, action_to_check, resource_to_check,
+                 _get_context_fingerprint(condition_keys_to_check, referenced_keys))
+    profile = profiling.active_profile
+    if cache_key in results:
+        dprint(debug, 'reusing cached result for group {}'.format(group.arn))
+        if profile is not None:
+            profile.group_cache_hits += 1
+        return results[cache_key]
+    if profile is not None:
+        profile.group_cache_misses += 1
+
+    result = _group_has_matching_statement(group, effect_value, action_to_check, resource_to_check,
+                                           condition_keys_to_check, debug)
+    if len(results) >= _EVALUATION_CACHE_LIMIT:
+        results.clear()
+    results[cache_key] = result
+    return result
+
+
+def _group_has_matching_statement(group: Group, effect_value: str, action_to_check: str, resource_to_check: str,
+                                  condition_keys_to_check: dict, debug: bool = False) -> bool:
+    """Helper function that does the uncached work of group_has_matching_statement"""
+    for policy in group.attached_policies:
+        if policy_has_matching_statement(policy, effect_value, action_to_check, resource_to_check,
+                                         condition_keys_to_check, debug):
+            return True
+    return False
+
+
+def _get_referenced_condition_keys_for_group(group: Group) -> Set[str]:
+    """Helper function that returns the condition keys referenced by a Group's policies, cached with the Group."""
+    if 'condition_keys' not in group.cache:
+        result = set()
+        for policy in group.attached_policies:
+            result.update(get_referenced_condition_keys(policy))
+        group.cache['condition_keys'] = frozenset(result)
+    return group.cache['condition_keys']
+
+
+def _is_principal_specific_condition_key(key: str) -> bool:
+    """Helper function that returns True if a condition key's value depends on which principal makes the request."""
+    key = key.lower()
+    return key in ('aws:username', 'aws:userid', 'aws:principalarn') or key.startswith('aws:principaltag/')
+
+
 def policy_has_matching_statement(policy: Policy, effect_value: str, action_to_check: str, resource_to_check: str,
                                   condition_keys_to_check: dict, debug: bool = False) -> bool:
-    """Searches a specific Policy object"""
+    """Searches a specific Policy object.
+
+    Results are cached with the Policy's interned document, keyed by the effect, action, resource, and the values of
+    the condition keys the document references. Other condition keys cannot change the result, so principals that
+    share a policy document (attached managed policies, identical inline policies) reuse each other's results.
+    """
 
     dprint(debug, 'looking at policy named: {}\n'.format(policy.name))
 
+    results = policy.cache.get('evaluation_results')
+    if results is None:
+        results = policy.cache['evaluation_results'] = {}
+    cache_key = (effect_value, action_to_check, resource_to_check,
+                 _get_context_fingerprint(condition_keys_to_check, get_referenced_condition_keys(policy)))
+    profile = profiling.active_profile
+    if cache_key in results:
+        dprint(debug, 'reusing cached result for policy named: {}'.format(policy.name))
+        if profile is not None:
+            profile.policy_cache_hits += 1
+        return results[cache_key]
+    if profile is not None:
+        profile.policy_cache_misses += 1
+
+    result = _policy_has_matching_statement(policy, effect_value, action_to_check, resource_to_check,
+                                            condition_keys_to_check, debug)
+    if len(results) >= _EVALUATION_CACHE_LIMIT:
+        results.clear()  # cheap bound on memory use, the cache refills with whatever is being asked about now
+    results[cache_key] = result
+    return result
+
+
+# Max number of cached evaluation results per policy document
+_EVALUATION_CACHE_LIMIT = 8192
+
+
+def _get_context_fingerprint(context: dict, keys: Set[str]) -> tuple:
+    """Helper function that returns a hashable representation of the values of the given keys in the context."""
+    result = []
+    for key in keys:
+        if key in context:
+            value = context[key]
+            result.append((key, tuple(value) if isinstance(value, list) else value))
+    result.sort()
+    return tuple(result)
+
+
+def _policy_has_matching_statement(policy: Policy, effect_value: str, action_to_check: str, resource_to_check: str,
+                                   condition_keys_to_check: dict, debug: bool = False) -> bool:
+    """Helper function that does the uncached work of policy_has_matching_statement"""
+    profile = profiling.active_profile
+
     # go through each policy_doc
     for statement in _listify_dictionary(policy.policy_doc['Statement']):
+        if profile is not None:
+            profile.statements_scanned += 1
         if statement['Effect'] != effect_value:
             continue  # skip if effect doesn't match
 
@@ -118,6 +229,34 @@ def policy_has_matching_statement(policy: Policy, effect_value: str, action_to_c
     return False
 
 
+_policy_variable_re = re.compile(r'\$\{([^}]+)\}')
+
+
+def get_referenced_condition_keys(policy: Policy) -> Set[str]:
+    """Returns the set of condition context keys that the statements of a Policy object reference, either as a key of
+    a Condition element or as a policy variable (${...}) in the Resource, NotResource, or Condition elements. Context
+    keys outside this set cannot change the result of evaluating the policy, so callers can skip inferring them.
+
+    The result is cached with the Policy object.
+    """
+    if 'condition_keys' not in policy.cache:
+        result = set()
+        for statement in _listify_dictionary(policy.policy_doc['Statement']):
+            for element in ('Resource', 'NotResource'):
+                if element in statement:
+                    for value in _listify_string(statement[element]):
+                        result.update(_policy_variable_re.findall(value))
+            if 'Condition' in statement:
+                for block in statement['Condition'].values():
+                    for key, value in block.items():
+                        result.add(key)
+                        for subvalue in _listify_string(value):
+                            if isinstance(subvalue, str):
+                                result.update(_policy_variable_re.findall(subvalue))
+        policy.cache['condition_keys'] = frozenset(result)
+    return policy.cache['condition_keys']
+
+
 def _get_condition_match(condition: Dict[str, Dict[str, Union[str, List]]], context: Dict, debug: bool = False) -> bool:
     """
     Internal method. It digs through Null, Bool, DateX, NumericX, StringX conditions and returns false if any of
@@ -127,6 +266,8 @@ def _get_condition_match(condition: Dict[str, Dict[str, Union[str, List]]], cont
 
     See: https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements_condition_operators.html
     """
+    if profiling.active_profile is not None:
+        profiling.active_profile.condition_evaluations += 1
     for block in condition.keys():
         dprint(debug, 'Testing condition field: {}'.format(block))
 
@@ -640,7 +781,8 @@ def _get_date_match(block: str, policy_key: str, policy_value: Union[str, List[s
 def _convert_timestamp_to_datetime_obj(timestamp: str):
     """Helper method for the helper method: converts string to datetime object"""
     if '-' in timestamp:  # policy simulator behavior: datetimestamps need dashes, even though ISO 8601 doesn't (?)
-        # parse as ISO 8601/RFC 3339
+        # parse as ISO 8601/RFC 3339, importing dateutil only when a policy has a date condition
+        import dateutil.parser as dup
         result = dup.parse(timestamp)
         if result.tzinfo is None:
             result.replace(tzinfo=dt.timezone.utc)
@@ -762,8 +904,12 @@ def resource_policy_has_matching_statement_for_principal(principal: Node, resour
 
 def resource_policy_matching_statements(node_or_service: Union[Node, str], resource_policy: dict,
                                         action_to_check: str, resource_to_check: str, condition_keys_to_check: dict,
-                                        debug: bool = False) -> list:
-    """Returns if a resource policy has a matching statement for a given service (ec2.amazonaws.com for example)."""
+                                        debug: bool = False, match_wildcard_principal: bool = False) -> list:
+    """Returns if a resource policy has a matching statement for a given service (ec2.amazonaws.com for example).
+
+    Statements with a '*' principal only match a node if match_wildcard_principal is True, and then only if their
+    Condition holds (see _wildcard_principal_condition_matches).
+    """
 
     dprint(debug, 'local resource policy check - service: {}, action: {}, resource: {}, conditions: {}, '
                   'resource_policy: {}'.format(node_or_service, action_to_check, resource_to_check,
@@ -778,6 +924,10 @@ def resource_policy_matching_statements(node_or_service: Union[Node, str], resou
                 if 'AWS' in statement['Principal']:
                     if _principal_matches_in_statement(node_or_service, _listify_string(statement['Principal']['AWS'])):
                         matches_principal = True
+                if not matches_principal and match_wildcard_principal and \
+                        _statement_has_wildcard_principal(statement):
+                    matches_principal = _wildcard_principal_condition_matches(node_or_service, statement,
+                                                                              condition_keys_to_check, debug)
             else:
                 if 'Service' in statement['Principal']:
                     if node_or_service in _listify_string(statement['Principal']['Service']):
@@ -854,14 +1004,17 @@ class ResourcePolicyEvalResult(Enum):
 
 def resource_policy_authorization(node_or_service: Union[Node, str], resource_owner: str, resource_policy: dict,
                                   action_to_check: str, resource_to_check: str, condition_keys_to_check: dict,
-                                  debug: bool) -> ResourcePolicyEvalResult:
-    """Returns a ResourcePolicyEvalResult for a given request, based on the resource policy."""
+                                  debug: bool, match_wildcard_principal: bool = False) -> ResourcePolicyEvalResult:
+    """Returns a ResourcePolicyEvalResult for a given request, based on the resource policy. See
+    resource_policy_matching_statements for match_wildcard_principal.
+    """
     dprint(debug, "Local resource policy authorization check: Principal {}, Action {}, Resource {}, Condition Keys {}, "
                   "Resource Owner {}".format(node_or_service, action_to_check, resource_to_check,
                                              condition_keys_to_check, resource_owner))
 
     matching_statements = resource_policy_matching_statements(node_or_service, resource_policy, action_to_check,
-                                                              resource_to_check, condition_keys_to_check, debug)
+                                                              resource_to_check, condition_keys_to_check, debug,
+                                                              match_wildcard_principal)
     if len(matching_statements) == 0:
         return ResourcePolicyEvalResult.NO_MATCH
 
@@ -918,6 +1071,27 @@ def _principal_matches_in_statement(principal: Node, aws_principal_field: list):
     return False
 
 
+def _statement_has_wildcard_principal(statement: dict) -> bool:
+    """Helper function: returns True if a resource policy statement's Principal is '*' or has '*' as an AWS principal"""
+    if statement['Principal'] == '*':
+        return True
+    return 'AWS' in statement['Principal'] and '*' in _listify_string(statement['Principal']['AWS'])
+
+
+def _wildcard_principal_condition_matches(principal: Node, statement: dict, condition_keys_to_check: dict,
+                                          debug: bool = False) -> bool:
+    """Helper function: returns True if a statement with a '*' principal applies to the principal. Its Condition is
+    evaluated against the caller's context, filled in with the aws:PrincipalAccount and aws:PrincipalArn of the
+    principal when the context does not have them.
+    """
+    if 'Condition' not in statement:
+        return True
+    context = dict(condition_keys_to_check)
+    context.setdefault('aws:PrincipalAccount', arns.get_account_id(principal.arn))
+    context.setdefault('aws:PrincipalArn', principal.arn)
+    return _get_condition_match(statement['Condition'], context, debug)
+
+
 def policies_include_matching_allow_action(principal: Node, action_to_check: str, debug: bool = False) -> bool:
     """Helper function for online-testing. Does a 'light' scan of a principal's policies to determine if any of
     their statements have an Allow statement with a matching action. Helps reduce unecessary API calls to
@@ -926,17 +1100,110 @@ def policies_include_matching_allow_action(principal: Node, action_to_check: str
     dprint(debug, 'optimization check, determine if {} could even possibly call {}'.format(
         principal.arn, action_to_check
     ))
-    for policy in principal.attached_policies:
-        for statement in _listify_dictionary(policy.policy_doc['Statement']):
-            if statement['Effect'] != 'Allow':
-                continue
-            if 'Action' in statement:
-                for action in _listify_string(statement['Action']):
-                    if _matches_after_expansion(action_to_check, action, debug=debug):
-                        return True
-            else:  # 'NotAction' in statement
-                return True  # so broad that we'd need to simulate to make sure
-    return False
+    return get_permission_summary(principal).could_allow_action(action_to_check)
+
+
+class PermissionSummary(object):
+    """Summary of the actions that a principal could possibly be allowed to call. It is built from the Allow
+    statements of the principal's attached and group policies, minus what unconditional Deny statements (Deny
+    statements with an Action element, a '*' Resource element, and no Condition element) block.
+
+    This ignores resources and conditions of Allow statements, so a True result only means the principal *might* be
+    authorized, and a full evaluation is still needed. A False result means the principal is never authorized, which
+    is what edge checkers use to skip work.
+    """
+
+    def __init__(self, allowed_actions: List[str], not_action_allows: List[List[str]], denied_actions: List[str]):
+        """Constructor. Expects the Action values of Allow statements, the NotAction values of Allow statements
+        (one list per statement), and the Action values of unconditional Deny statements.
+        """
+        self.allowed_actions = allowed_actions
+        self.not_action_allows = not_action_allows
+        self.denied_actions = denied_actions
+        self._action_results = {}
+        self._service_results = {}
+
+    def could_allow_action(self, action: str) -> bool:
+        """Returns True if an Allow statement could grant the action and no unconditional Deny blocks it."""
+        if action not in self._action_results:
+            self._action_results[action] = self._check_action(action)
+        return self._action_results[action]
+
+    def could_allow_service(self, service: str) -> bool:
+        """Returns True if an Allow statement could grant any action of the service (such as 'iam') and no
+        unconditional Deny blocks every action of the service.
+        """
+        if service not in self._service_results:
+            self._service_results[service] = self._check_service(service)
+        return self._service_results[service]
+
+    def _check_action(self, action: str) -> bool:
+        for denied_action in self.denied_actions:
+            if _matches_after_expansion(action, denied_action):
+                return False
+        for allowed_action in self.allowed_actions:
+            if _matches_after_expansion(action, allowed_action):
+                return True
+        for notactions in self.not_action_allows:
+            if not any(_matches_after_expansion(action, notaction) for notaction in notactions):
+                return True
+        return False
+
+    def _check_service(self, service: str) -> bool:
+        for denied_action in self.denied_actions:
+            if _covers_service(denied_action, service):
+                return False
+        for allowed_action in self.allowed_actions:
+            if _matches_after_expansion(service, _split_action(allowed_action)[0]):
+                return True
+        for notactions in self.not_action_allows:
+            if not any(_covers_service(notaction, service) for notaction in notactions):
+                return True
+        return False
+
+
+def get_permission_summary(principal: Node) -> PermissionSummary:
+    """Returns the PermissionSummary for a Node, built from its attached policies and the policies of its groups. The
+    result is cached with the Node object.
+    """
+    if 'permission_summary' not in principal.cache:
+        allowed_actions = []
+        not_action_allows = []
+        denied_actions = []
+
+        policies = list(principal.attached_policies)
+        for group in principal.group_memberships:
+            policies.extend(group.attached_policies)
+
+        for policy in policies:
+            for statement in _listify_dictionary(policy.policy_doc['Statement']):
+                if statement['Effect'] == 'Allow':
+                    if 'Action' in statement:
+                        allowed_actions.extend(_listify_string(statement['Action']))
+                    else:  # 'NotAction' in statement
+                        not_action_allows.append(_listify_string(statement['NotAction']))
+                elif 'Action' in statement and 'Condition' not in statement and 'Resource' in statement and \
+                        '*' in _listify_string(statement['Resource']):
+                    denied_actions.extend(_listify_string(statement['Action']))
+
+        principal.cache['permission_summary'] = PermissionSummary(allowed_actions, not_action_allows, denied_actions)
+    return principal.cache['permission_summary']
+
+
+def _split_action(action: str) -> (str, str):
+    """Helper function that splits an action (or action pattern) into its service and name, treating a bare '*' as
+    '*:*'.
+    """
+    if ':' in action:
+        service, name = action.split(':', 1)
+        return service, name
+    return action, '*'
+
+
+def _covers_service(action_pattern: str, service: str) -> bool:
+    """Helper function that returns True if an action pattern matches every action of a given service."""
+    pattern_service, pattern_name = _split_action(action_pattern)
+    return pattern_name == '*' and _matches_after_expansion(service, pattern_service)
 
 
 def _matches_after_expansion(string_to_check: str, string_to_check_against: str,
@@ -945,6 +1212,8 @@ def _matches_after_expansion(string_to_check: str, string_to_check_against: str,
 
     Handles matching with respect to wildcards, variables.
     """
+    if profiling.active_profile is not None:
+        profiling.active_profile.pattern_matches += 1
     dprint(debug, 'Checking for post-expansion match.\n   string to check: {}\n   '.format(string_to_check) +
            'string to check against: {}\n'.format(string_to_check_against) +
            '   condition_keys: {}'.format(condition_keys))
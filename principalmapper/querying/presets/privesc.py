@@ -22,7 +22,7 @@ import os
 from typing import List
 
 from principalmapper.common import Edge, Node, Graph
-from principalmapper.querying.query_utils import get_search_list
+from principalmapper.querying.query_utils import get_cached_result, get_search_list
 from principalmapper.util.debug_print import dprint
 
 
@@ -65,8 +65,14 @@ def can_privesc(graph: Graph, node: Node, debug: bool = False) -> (bool, List[Ed
     """Method for determining if a given Node in a Graph can escalate privileges.
 
     Returns a bool, List[Edge] tuple. The bool indicates if there is a privesc risk, and the List[Edge] component
-    describes the path of edges the node would have to take to gain access to the admin node.
+    describes the path of edges the node would have to take to gain access to the admin node. The result is cached
+    with the Graph until its edges change.
     """
+    return get_cached_result(graph, 'privesc', node, lambda: _can_privesc(graph, node))
+
+
+def _can_privesc(graph: Graph, node: Node) -> (bool, List[Edge]):
+    """Helper function that does the uncached work of can_privesc"""
     edge_lists = get_search_list(graph, node)
     searched_nodes = []
     for edge_list in edge_lists:
@@ -0,0 +1,129 @@
+"""Code for profiling local policy evaluation: which actions and principals cost the most authorization checks, how
+much work the checks do, and how long each edge checker runs.
+
+Profiling is opt-in: the hooks in local_policy_simulation, query_interface, and edge_identification only record while
+a profile is active, see profile_evaluations.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class EvaluationProfile(object):
+    """Counters for local policy evaluation, filled in while the profile is active:
+
+    * checks and seconds of local_check_authorization, by action and by principal ARN
+    * statements_scanned: policy statements looked at when a policy's result was not cached
+    * pattern_matches: action and resource patterns matched against a value
+    * condition_evaluations: Condition elements evaluated
+    * policy/group cache hits and misses: evaluation results reused from, or added to, the caches of policies and groups
+    * seconds and checks of each edge checker run, by name
+    """
+
+    def __init__(self):
+        self.checks_by_action = {}  # type: Dict[str, int]
+        self.seconds_by_action = {}  # type: Dict[str, float]
+        self.checks_by_principal = {}  # type: Dict[str, int]
+        self.seconds_by_principal = {}  # type: Dict[str, float]
+        self.statements_scanned = 0
+        self.pattern_matches = 0
+        self.condition_evaluations = 0
+        self.policy_cache_hits = 0
+        self.policy_cache_misses = 0
+        self.group_cache_hits = 0
+        self.group_cache_misses = 0
+        self.checker_seconds = {}  # type: Dict[str, float]
+        self.checker_checks = {}  # type: Dict[str, int]
+
+    @property
+    def checks(self) -> int:
+        """The number of local authorization checks recorded."""
+        return sum(self.checks_by_action.values())
+
+    def record_check(self, principal_arn: str, action: str, seconds: float) -> None:
+        """Records one local authorization check."""
+        self.checks_by_action[action] = self.checks_by_action.get(action, 0) + 1
+        self.seconds_by_action[action] = self.seconds_by_action.get(action, 0.0) + seconds
+        self.checks_by_principal[principal_arn] = self.checks_by_principal.get(principal_arn, 0) + 1
+        self.seconds_by_principal[principal_arn] = self.seconds_by_principal.get(principal_arn, 0.0) + seconds
+
+    def record_checker(self, name: str, seconds: float, checks: int) -> None:
+        """Records a run of an edge checker."""
+        self.checker_seconds[name] = self.checker_seconds.get(name, 0.0) + seconds
+        self.checker_checks[name] = self.checker_checks.get(name, 0) + checks
+
+    def get_costliest_actions(self, top: int = 10) -> List[Tuple[str, int, float]]:
+        """Returns the (action, checks, seconds) of the top actions by time spent checking them."""
+        return _get_costliest(self.checks_by_action, self.seconds_by_action, top)
+
+    def get_costliest_principals(self, top: int = 10) -> List[Tuple[str, int, float]]:
+        """Returns the (principal ARN, checks, seconds) of the top principals by time spent checking them."""
+        return _get_costliest(self.checks_by_principal, self.seconds_by_principal, top)
+
+    def write_report(self, output: Optional[io.StringIO] = None, top: int = 10) -> None:
+        """Writes the totals, the time of each edge checker, then the top actions and principals by time spent."""
+        if output is None:
+            output = io.StringIO()
+        output.write('{} authorization checks in {:.3f} seconds: {} statements scanned, {} pattern matches, {} '
+                     'condition evaluations\n'.format(self.checks, sum(self.seconds_by_action.values()),
+                                                      self.statements_scanned, self.pattern_matches,
+                                                      self.condition_evaluations))
+        output.write('Policy result cache: {} hits, {} misses. Group result cache: {} hits, {} misses\n'.format(
+            self.policy_cache_hits, self.policy_cache_misses, self.group_cache_hits, self.group_cache_misses))
+        if len(self.checker_seconds) > 0:
+            output.write('Edge checkers:\n')
+            for name, seconds in sorted(self.checker_seconds.items(), key=lambda x: x[1], reverse=True):
+                output.write('    {}: {:.3f} seconds, {} authorization checks\n'.format(
+                    name, seconds, self.checker_checks[name]))
+        output.write('Costliest actions:\n')
+        for action, checks, seconds in self.get_costliest_actions(top):
+            output.write('    {}: {} checks, {:.3f} seconds\n'.format(action, checks, seconds))
+        output.write('Costliest principals:\n')
+        for principal_arn, checks, seconds in self.get_costliest_principals(top):
+            output.write('    {}: {} checks, {:.3f} seconds\n'.format(principal_arn, checks, seconds))
+
+
+# The profile that hooks record to, None unless inside profile_evaluations
+active_profile = None  # type: Optional[EvaluationProfile]
+
+
+@contextlib.contextmanager
+def profile_evaluations() -> Iterator[EvaluationProfile]:
+    """Context manager that records local policy evaluation to a new EvaluationProfile until it exits:
+
+        with profile_evaluations() as profile:
+            obtain_edges(...)
+        profile.write_report(sys.stdout)
+
+    While a nested profile is active, the outer one records nothing. Only evaluation in the current process is
+    recorded (not that of the process pool used by multi_account, for example).
+    """
+    global active_profile
+    previous = active_profile
+    active_profile = EvaluationProfile()
+    try:
+        yield active_profile
+    finally:
+        active_profile = previous
+
+
+def _get_costliest(checks: Dict[str, int], seconds: Dict[str, float], top: int) -> List[Tuple[str, int, float]]:
+    """Helper function: returns the top keys by seconds, with their checks and seconds"""
+    keys = sorted(seconds, key=lambda x: seconds[x], reverse=True)[:top]
+    return [(key, checks[key], seconds[key]) for key in keys]
@@ -16,56 +16,88 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
-import copy
 import datetime as dt
+import json
+import time
+from typing import Optional, Set
 
 from principalmapper.common import Graph
-from principalmapper.querying import query_utils
+from principalmapper.querying import profiling, query_utils
 from principalmapper.querying.local_policy_simulation import *
 from principalmapper.querying.query_result import QueryResult
 
 
+# Running count of local_check_authorization calls, see get_evaluation_count
+_evaluation_count = 0
+
+
 def search_authorization_for(graph: Graph, principal: Node, action_to_check: str, resource_to_check: str,
                              condition_keys_to_check: dict, debug: bool = False) -> QueryResult:
     """Determines if the passed principal, or any principals it can access, can perform a given action for a
-    given resource/condition."""
+    given resource/condition.
+
+    Results, and the authorization checks of each principal along the way, are cached with the Graph until its edges
+    change, so repeated queries (such as in the REPL) are answered without evaluating policies again.
+    """
+    conditions_key = json.dumps(condition_keys_to_check, sort_keys=True, default=str)
+    return query_utils.get_cached_result(
+        graph, 'authorization_searches', (principal, action_to_check, resource_to_check, conditions_key),
+        lambda: _search_authorization_for(graph, principal, action_to_check, resource_to_check,
+                                          condition_keys_to_check, conditions_key, debug)
+    )
+
+
+def _search_authorization_for(graph: Graph, principal: Node, action_to_check: str, resource_to_check: str,
+                              condition_keys_to_check: dict, conditions_key: str, debug: bool) -> QueryResult:
+    """Helper function that does the uncached work of search_authorization_for"""
     if principal.is_admin:
         return QueryResult(True, [], principal)
 
-    if local_check_authorization(principal, action_to_check, resource_to_check, condition_keys_to_check, debug):
+    def _check(node: Node) -> bool:
+        return query_utils.get_cached_result(
+            graph, 'authorizations', (node, action_to_check, resource_to_check, conditions_key),
+            lambda: local_check_authorization(node, action_to_check, resource_to_check, condition_keys_to_check,
+                                              debug)
+        )
+
+    if _check(principal):
         return QueryResult(True, [], principal)
 
     for edge_list in query_utils.get_search_list(graph, principal):
-        if local_check_authorization(edge_list[-1].destination, action_to_check, resource_to_check,
-                                     condition_keys_to_check, debug):
+        if _check(edge_list[-1].destination):
             return QueryResult(True, edge_list, principal)
 
     return QueryResult(False, [], principal)
 
 
-def _infer_condition_keys(principal: Node, current_keys: dict) -> dict:
+def _infer_condition_keys(principal: Node, current_keys: dict, needed_keys: Optional[Set[str]] = None) -> dict:
     """Returns a dictionary with global condition context keys we can infer are set based on the input Node being
-    checked. We exclude setting keys that are already set in current_keys.
+    checked. We exclude setting keys that are already set in current_keys. If needed_keys is passed, we also exclude
+    setting keys that are not in needed_keys.
 
     Using information from https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_condition-keys.html
     """
 
     result = {}
 
+    def _wanted(key: str) -> bool:
+        return key not in current_keys and (needed_keys is None or key in needed_keys)
+
     # Date and Time: aws:CurrentTime and aws:EpochTime
     # TODO: Examine if using datetime.isoformat() is good enough to avoid bugs
-    if 'aws:CurrentTime' not in current_keys:
-        result['aws:CurrentTime'] = dt.datetime.now(dt.timezone.utc).isoformat()
-
-    if 'aws:EpochTime' not in current_keys:
-        result['aws:EpochTime'] = str(round(dt.datetime.now(dt.timezone.utc).timestamp()))
+    if _wanted('aws:CurrentTime') or _wanted('aws:EpochTime'):
+        current_time = dt.datetime.now(dt.timezone.utc)
+        if _wanted('aws:CurrentTime'):
+            result['aws:CurrentTime'] = current_time.isoformat()
+        if _wanted('aws:EpochTime'):
+            result['aws:EpochTime'] = str(round(current_time.timestamp()))
 
     # UserID and Username: aws:userid and aws:username
     # TODO: Double-check how roles handle aws:username, IIRC it's not filled in
-    if 'aws:userid' not in current_keys:
+    if _wanted('aws:userid'):
         result['aws:userid'] = principal.id_value
 
-    if ':user/' in principal.arn and 'aws:username' not in current_keys:
+    if ':user/' in principal.arn and _wanted('aws:username'):
         result['aws:username'] = principal.searchable_name().split('/')[1]
 
     # TODO: Add aws:SecureTransport and aws:PrincipalArn ?
@@ -73,6 +105,21 @@ def _infer_condition_keys(principal: Node, current_keys: dict) -> dict:
     return result
 
 
+def get_referenced_condition_keys_for_node(principal: Node) -> Set[str]:
+    """Returns the set of condition context keys referenced by any policy that applies to the input Node (attached
+    policies and the policies of its groups). The result is cached with the Node object.
+    """
+    if 'condition_keys' not in principal.cache:
+        result = set()
+        for policy in principal.attached_policies:
+            result.update(get_referenced_condition_keys(policy))
+        for group in principal.group_memberships:
+            for policy in group.attached_policies:
+                result.update(get_referenced_condition_keys(policy))
+        principal.cache['condition_keys'] = frozenset(result)
+    return principal.cache['condition_keys']
+
+
 def local_check_authorization_handling_mfa(principal: Node, action_to_check: str, resource_to_check: str,
                                            condition_keys_to_check: dict, debug: bool = False) -> (bool, bool):
     """Determine if a node is authorized to make an API call. If the node is an IAM User, it will perform authorization
@@ -87,11 +134,8 @@ def local_check_authorization_handling_mfa(principal: Node, action_to_check: str
     if local_check_authorization(principal, action_to_check, resource_to_check, condition_keys_to_check, debug):
         return True, False
 
-    new_condition_keys = copy.deepcopy(condition_keys_to_check)
-    if 'aws:MultiFactorAuthAge' not in new_condition_keys:
-        new_condition_keys.update({'aws:MultiFactorAuthAge': '1'})
-    if 'aws:MultiFactorAuthPresent' not in new_condition_keys:
-        new_condition_keys.update({'aws:MultiFactorAuthPresent': 'true'})
+    new_condition_keys = {'aws:MultiFactorAuthAge': '1', 'aws:MultiFactorAuthPresent': 'true'}
+    new_condition_keys.update(condition_keys_to_check)
 
     if local_check_authorization(principal, action_to_check, resource_to_check, new_condition_keys, debug):
         return True, True
@@ -104,11 +148,34 @@ def local_check_authorization(principal: Node, action_to_check: str, resource_to
     """Determine if a node is authorized to make an API call. It will perform a local evaluation of the attached
     IAM policies to determine authorization.
 
-    NOTE: this will add condition keys that it can infer, assuming they're not set already, such as aws:username or
-    aws:userid.
+    NOTE: this will infer condition keys, assuming they're not set already, such as aws:username or aws:userid. Only
+    keys referenced by the principal's policies are inferred. The passed condition_keys_to_check dictionary is not
+    modified, so it can be shared between calls.
     """
 
-    condition_keys_to_check.update(_infer_condition_keys(principal, condition_keys_to_check))
+    global _evaluation_count
+    _evaluation_count += 1
+
+    profile = profiling.active_profile
+    if profile is None:
+        return _local_check_authorization(principal, action_to_check, resource_to_check, condition_keys_to_check,
+                                          debug)
+    start = time.perf_counter()
+    try:
+        return _local_check_authorization(principal, action_to_check, resource_to_check, condition_keys_to_check,
+                                          debug)
+    finally:
+        profile.record_check(principal.arn, action_to_check, time.perf_counter() - start)
+
+
+def _local_check_authorization(principal: Node, action_to_check: str, resource_to_check: str,
+                               condition_keys_to_check: dict, debug: bool = False) -> bool:
+    """Helper function that does the work of local_check_authorization"""
+    inferred_keys = _infer_condition_keys(principal, condition_keys_to_check,
+                                          get_referenced_condition_keys_for_node(principal))
+    if len(inferred_keys) > 0:
+        inferred_keys.update(condition_keys_to_check)
+        condition_keys_to_check = inferred_keys
 
     dprint(debug, 'Testing authorization for: principal: {}, action: {}, resource: {}, conditions: {}'.format(
         principal.arn,
@@ -127,6 +194,13 @@ def local_check_authorization(principal: Node, action_to_check: str, resource_to
                                       condition_keys_to_check, debug)
 
 
+def get_evaluation_count() -> int:
+    """Returns how many times local_check_authorization has been called in this process. The difference between two
+    calls is the number of local authorization checks made in between.
+    """
+    return _evaluation_count
+
+
 def simulation_api_check_authorization(iamclient, principal: Node, action_to_check: str, resource_to_check: str,
                                        condition_keys_to_check: dict, debug: bool = False) -> bool:
     """Determine if a node is authorized for an API call via iam:SimulatePrincipalPolicy. DO NOT USE THIS FUNCTION,
@@ -15,22 +15,51 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import List
+from typing import Any, Callable, Container, Dict, Hashable, List, Tuple
 
 from principalmapper.common import Edge, Graph, Node
 
 
+def get_cached_result(graph: Graph, cache_name: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+    """Returns the result for key from one of the query caches kept with a Graph (see Graph.cache), calling compute and
+    storing its result on a miss. Hits and misses are counted, see get_cache_stats.
+    """
+    cache = graph.cache.setdefault(cache_name, {})
+    counts = graph.cache.setdefault('cache_stats', {}).setdefault(cache_name, [0, 0])
+    if key in cache:
+        counts[0] += 1
+        return cache[key]
+    counts[1] += 1
+    result = cache[key] = compute()
+    return result
+
+
+def get_cache_stats(graph: Graph) -> Dict[str, Tuple[int, int, int]]:
+    """Returns the hits, misses, and number of entries of each query cache kept with a Graph, by cache name."""
+    return {
+        cache_name: (counts[0], counts[1], len(graph.cache.get(cache_name, {})))
+        for cache_name, counts in graph.cache.get('cache_stats', {}).items()
+    }
+
+
 def get_search_list(graph: Graph, node: Node) -> List[List[Edge]]:
     """Returns a list of edge lists. Each edge list represents a path to a new unique node that's accessible from the
     initial node (passed as a param). This is a breadth-first search of nodes from a source node in a graph.
+
+    The result is cached with the Graph until its edges change, so treat it as read-only.
     """
+    return get_cached_result(graph, 'search_lists', node, lambda: _get_search_list(graph, node))
+
+
+def _get_search_list(graph: Graph, node: Node) -> List[List[Edge]]:
+    """Helper function that does the uncached work of get_search_list"""
     result = []
-    explored_nodes = []
+    explored_nodes = set()
 
     # run through initial edges
     for edge in get_edges_with_node_source(graph, node, explored_nodes):
         result.append([edge])
-    explored_nodes.append(node)
+    explored_nodes.add(node)
 
     # dig through result list
     index = 0
@@ -38,21 +67,22 @@ def get_search_list(graph: Graph, node: Node) -> List[List[Edge]]:
         current_node = result[index][-1].destination
         for edge in get_edges_with_node_source(graph, current_node, explored_nodes):
             result.append(result[index][:] + [edge])
-        explored_nodes.append(current_node)
+        explored_nodes.add(current_node)
         index += 1
 
     return result
 
 
-def get_edges_with_node_source(graph: Graph, node: Node, ignored_nodes: List[Node]) -> List[Edge]:
+def get_edges_with_node_source(graph: Graph, node: Node, ignored_nodes: Container[Node]) -> List[Edge]:
     """Returns a list of nodes that are the destination of edges from the given graph where source of the edge is the
     passed node.
     """
-    result = []
-    for edge in graph.edges:
-        if edge.source == node and edge.destination not in ignored_nodes:
-            result.append(edge)
-    return result
+    if 'edges_by_source' not in graph.cache:
+        edges_by_source = {}
+        for edge in graph.edges:
+            edges_by_source.setdefault(edge.source, []).append(edge)
+        graph.cache['edges_by_source'] = edges_by_source
+    return [edge for edge in graph.cache['edges_by_source'].get(node, []) if edge.destination not in ignored_nodes]
 
 
 def is_connected(graph: Graph, source: Node, destination: Node) -> bool:
@@ -18,27 +18,37 @@
 import argparse
 import shlex
 import sys
+import time
+from typing import Callable, Optional
 
 from principalmapper.common import Graph
-from principalmapper.querying import query_actions
+from principalmapper.querying import query_actions, query_interface, query_utils
 
 
 class PMapperREPL:
-    """The Principal Mapper REPL class, handles the state and interactions of the REPL."""
+    """The Principal Mapper REPL class, handles the state and interactions of the REPL.
 
-    def __init__(self, graph: Graph):
+    Query results are cached with the loaded Graph, so they carry over between commands until the graph is reloaded.
+    If graph_loader is passed, the reload command calls it to swap in a refreshed Graph.
+    """
+
+    def __init__(self, graph: Graph, graph_loader: Optional[Callable[[], Graph]] = None):
         self.cmd_history = []
         self.graph = graph
+        self.graph_loader = graph_loader
+        self.timing = False
 
         self.argparser = argparse.ArgumentParser()
         self.argparser.add_argument('-d', '--debug', help='Enable debugging for this command.')
         self.subparsers = self.argparser.add_subparsers(
             title='subcommand',
             dest='subcommand',
-            description='The command to run: query, argquery, help, exit'
+            description='The command to run: query, argquery, stats, reload, \\timing, help, exit'
         )
         self.helpparser = self.subparsers.add_parser('help')
         self.exitparser = self.subparsers.add_parser('exit')
+        self.statsparser = self.subparsers.add_parser('stats')
+        self.reloadparser = self.subparsers.add_parser('reload')
         # TODO: Add graphdata subcommand
 
         self.queryparser = self.subparsers.add_parser(
@@ -116,8 +126,15 @@ class PMapperREPL:
 
             # Eval/Print
             try:
+                if command.strip() == '\\timing':
+                    self.timing = not self.timing
+                    print('Timing is {}.'.format('on' if self.timing else 'off'))
+                    continue
+
                 args = shlex.split(command)
                 parsed_args = self.argparser.parse_args(args)
+                start = time.perf_counter()
+                start_evaluations = query_interface.get_evaluation_count()
                 if parsed_args.subcommand == 'query':
                     query_actions.query_response(self.graph, parsed_args.query, parsed_args.skip_admin, sys.stdout,
                                                  parsed_args.debug)
@@ -138,13 +155,26 @@ class PMapperREPL:
                                            conditions, parsed_args.preset, parsed_args.skip_admin, sys.stdout,
                                            parsed_args.debug)
 
+                elif parsed_args.subcommand == 'stats':
+                    self._print_stats()
+                    continue
+                elif parsed_args.subcommand == 'reload':
+                    self._reload()
                 elif parsed_args.subcommand == 'help':
                     self._print_help()
+                    continue
                 elif parsed_args.subcommand == 'exit':
                     print('Exiting.')
                     break
                 else:
                     self._print_help()
+                    continue
+
+                if self.timing:
+                    print('Time: {:.1f} ms, {} authorization checks'.format(
+                        (time.perf_counter() - start) * 1000,
+                        query_interface.get_evaluation_count() - start_evaluations
+                    ))
             except KeyboardInterrupt as ex:
                 print('Ctrl+C detected. Exiting.')
                 break
@@ -154,6 +184,23 @@ class PMapperREPL:
 
             # Loop
 
+    def _print_stats(self) -> None:
+        """Prints the hit rate of each query cache kept with the loaded graph."""
+        cache_stats = query_utils.get_cache_stats(self.graph)
+        if len(cache_stats) == 0:
+            print('No cached query results yet.')
+            return
+        for cache_name, (hits, misses, entries) in sorted(cache_stats.items()):
+            print('{}: {} hits, {} misses ({:.1%} hit rate), {} entries'.format(
+                cache_name, hits, misses, hits / (hits + misses) if hits + misses > 0 else 0.0, entries))
+
+    def _reload(self) -> None:
+        """Swaps in a refreshed graph from graph_loader. Cached query results of the old graph are dropped with it."""
+        if self.graph_loader is None:
+            raise ValueError('This REPL was started without a way to reload its graph')
+        self.graph = self.graph_loader()
+        print('Reloaded the graph: {} nodes, {} edges.'.format(len(self.graph.nodes), len(self.graph.edges)))
+
     @staticmethod
     def _print_help():
         """Prints a helppage for using the REPL."""
@@ -162,6 +209,9 @@ class PMapperREPL:
 Available Commands:
    * query
    * argquery
+   * stats
+   * reload
+   * \\timing
    * help
    * exit
    
@@ -169,6 +219,11 @@ The query/argquery commands behave the same as calling it from the regular
 command line. You must include quotation marks or apostrophes around the 
 query for query commands, as the input is parsed like you were on the command 
 line. 
+
+Query results are cached between commands. `stats` prints the hit rate of 
+each cache, `reload` loads the graph from disk again (such as after running 
+`pmapper graph --create`), and `\\timing` toggles printing the time and number 
+of authorization checks each query took.
    
 Simple English(-ish) Querying:
    repl> query 'who can do s3:GetObject with arn:aws:s3:::<some bucket>/<sensitive object>'
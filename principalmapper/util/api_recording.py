@@ -0,0 +1,196 @@
+"""Code for recording the AWS API responses used while gathering data about an account, and replaying them later
+without access to AWS.
+
+RecordingSession wraps a botocore Session: every API call made by its clients (including each page of a paginated
+call) is written to a gzip-compressed JSON Lines archive along with its response. ReplaySession reads such an archive
+and creates clients that answer calls from it instead of AWS, optionally waiting a set time per call to simulate
+latency. Both can be passed anywhere a botocore Session is expected by gathering and the edge checkers.
+"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import functools
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import botocore.session
+
+
+_ARCHIVE_FORMAT = 'pmapper-api-recording'
+_ARCHIVE_VERSION = 1
+_DEFAULT_REGION = 'us-east-1'
+
+
+class RecordingSession(object):
+    """Wraps a botocore Session, recording the API calls made by clients it creates to a compressed archive. Call
+    close() once done (the archive is written as calls are made, closing flushes it).
+    """
+
+    def __init__(self, session: 'botocore.session.Session', archive_path: str):
+        self._session = session
+        self._lock = threading.Lock()
+        self._archive = gzip.open(archive_path, 'wt', encoding='utf-8')
+        self._write({'type': 'header', 'format': _ARCHIVE_FORMAT, 'version': _ARCHIVE_VERSION})
+
+    def create_client(self, service_name: str, region_name: Optional[str] = None, **kwargs):
+        """Creates a client from the wrapped session that records each of its API calls."""
+        client = self._session.create_client(service_name, region_name=region_name, **kwargs)
+        client.meta.events.register('provide-client-params', _stash_api_params)
+        client.meta.events.register('after-call', functools.partial(self._record_call, region_name))
+        return client
+
+    def get_available_regions(self, service_name: str, *args, **kwargs) -> List[str]:
+        """Returns the regions of a service, according to the wrapped session, and records them."""
+        result = self._session.get_available_regions(service_name, *args, **kwargs)
+        self._write({'type': 'regions', 'service': service_name, 'regions': result})
+        return result
+
+    def close(self) -> None:
+        """Flushes and closes the archive. Further calls are no longer recorded."""
+        with self._lock:
+            if not self._archive.closed:
+                self._archive.close()
+
+    def __getattr__(self, item):
+        return getattr(self._session, item)
+
+    def _record_call(self, region_name, http_response, parsed, model, context, **kwargs):
+        self._write({
+            'type': 'call',
+            'service': model.service_model.service_name,
+            'region': region_name,
+            'operation': model.name,
+            'params': context.get('pmapper_api_params', {}),
+            'status_code': http_response.status_code,
+            'response': {key: value for key, value in parsed.items() if key != 'ResponseMetadata'}
+        })
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, default=_json_default)
+        with self._lock:
+            if not self._archive.closed:
+                self._archive.write(line + '\n')
+
+
+class ReplaySession(object):
+    """Stands in for a botocore Session, creating clients that answer API calls from an archive written by a
+    RecordingSession. Calls are matched by service, region, operation, and parameters. A call made more often than it
+    was recorded gets the last recorded response again, a call that was never recorded raises a ValueError.
+
+    If latency is set, every replayed call waits that many seconds first.
+    """
+
+    def __init__(self, archive_path: str, latency: float = 0.0):
+        import botocore.session  # imported here so that importing this module does not load botocore
+
+        self.latency = latency
+        self._session = botocore.session.Session()
+        self._lock = threading.Lock()
+        self._responses = {}  # type: Dict[Tuple[str, str, str, str], List[dict]]
+        self._positions = {}  # type: Dict[Tuple[str, str, str, str], int]
+        self._regions = {}  # type: Dict[str, List[str]]
+
+        with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != _ARCHIVE_FORMAT or header.get('version') != _ARCHIVE_VERSION:
+                raise ValueError('The file at {} is not a supported API recording'.format(archive_path))
+            for line in f:
+                record = json.loads(line)
+                if record['type'] == 'regions':
+                    self._regions[record['service']] = record['regions']
+                elif record['type'] == 'call':
+                    key = _get_call_key(record['service'], record['region'], record['operation'], record['params'])
+                    self._responses.setdefault(key, []).append(record)
+
+    def create_client(self, service_name: str, region_name: Optional[str] = None, **kwargs):
+        """Creates a client that answers API calls from the archive. Credentials are never looked up."""
+        client = self._session.create_client(service_name, region_name=region_name or _DEFAULT_REGION,
+                                             aws_access_key_id='replay', aws_secret_access_key='replay')
+        client.meta.events.register('provide-client-params', _stash_api_params)
+        client.meta.events.register('before-call', functools.partial(self._replay_call, region_name))
+        return client
+
+    def get_available_regions(self, service_name: str, *args, **kwargs) -> List[str]:
+        """Returns the recorded regions of a service, or no regions if none were recorded (there would be no responses
+        to replay for them).
+        """
+        return list(self._regions.get(service_name, []))
+
+    def close(self) -> None:
+        """Does nothing, for parity with RecordingSession."""
+
+    def _replay_call(self, region_name, model, params, context, **kwargs):
+        key = _get_call_key(model.service_model.service_name, region_name, model.name,
+                            context.get('pmapper_api_params', {}))
+        with self._lock:
+            records = self._responses.get(key)
+            if records is None:
+                raise ValueError('No recorded response for {}.{} in {} with parameters {}'.format(
+                    key[0], key[2], key[1], key[3]))
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            record = records[min(position, len(records) - 1)]
+        if self.latency > 0:
+            time.sleep(self.latency)
+        import botocore.awsrequest  # loaded by botocore itself by the time a call is made
+        http_response = botocore.awsrequest.AWSResponse(params.get('url'), record['status_code'], {}, None)
+        parsed = json.loads(json.dumps(record['response']))  # copy, callers may edit responses
+        if model.output_shape is not None:
+            _encode_policy_documents(parsed, model.output_shape)
+        return http_response, parsed
+
+
+def _encode_policy_documents(parsed, shape) -> None:
+    """Turns the policy documents in an IAM response back into the URL-encoded JSON strings sent by the API. Recorded
+    responses hold them as dictionaries, and botocore decodes them again after the replayed call.
+    """
+    if shape.type_name == 'structure' and isinstance(parsed, dict):
+        for member_name, member_shape in shape.members.items():
+            if member_name not in parsed:
+                continue
+            if member_shape.type_name == 'string' and member_shape.name == 'policyDocumentType':
+                if not isinstance(parsed[member_name], str):
+                    parsed[member_name] = urllib.parse.quote(json.dumps(parsed[member_name]))
+            else:
+                _encode_policy_documents(parsed[member_name], member_shape)
+    elif shape.type_name == 'list' and isinstance(parsed, list):
+        for item in parsed:
+            _encode_policy_documents(item, shape.member)
+
+
+def _stash_api_params(params, context, **kwargs):
+    """Event handler: keeps a copy of the parameters of an API call, as passed to the client, in its request context"""
+    context['pmapper_api_params'] = json.loads(json.dumps(params, default=_json_default))
+
+
+def _get_call_key(service: str, region: Optional[str], operation: str, params: dict) -> Tuple[str, str, str, str]:
+    """Returns the key used to match a replayed call with a recorded one. The region is the one requested when
+    creating the client, which is None for clients of global services such as IAM.
+    """
+    return service, str(region), operation, json.dumps(params, sort_keys=True)
+
+
+def _json_default(obj):
+    """Converts values the json module cannot handle (such as timestamps in responses) to strings"""
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    return str(obj)
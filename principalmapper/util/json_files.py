@@ -0,0 +1,169 @@
+"""Utility code for reading and writing the JSON files of stored graphs, optionally compressed with gzip or zstd.
+
+A file's compression is given by its suffix: `.json` is plain, `.json.gz` is gzip, and `.json.zst` is zstd. Plain files
+are indented for reading by hand, compressed files use compact separators. zstd needs the optional zstandard package
+(`pip install principalmapper[zstd]`).
+"""
+
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import io
+import json
+import os
+import os.path
+from typing import Iterator, Optional
+
+
+# The file suffix added after .json for each supported compression
+COMPRESSION_SUFFIXES = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+_READ_CHUNK_SIZE = 1 << 16
+
+
+def find_json_file(filepath: str) -> Optional[str]:
+    """Given the path of a plain JSON file (such as graph/nodes.json), returns the path of the file that exists with
+    that name and any compression suffix, or None if there is none.
+    """
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if os.path.exists(filepath + suffix):
+            return filepath + suffix
+    return None
+
+
+def get_compression(filepath: str) -> str:
+    """Returns the compression of a JSON file, going by its suffix."""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix != '' and filepath.endswith('.json' + suffix):
+            return compression
+    return 'none'
+
+
+def open_json_file(filepath: str) -> io.TextIOBase:
+    """Opens a JSON file for reading as text, decompressing it as it is read."""
+    compression = get_compression(filepath)
+    if compression == 'gzip':
+        return gzip.open(filepath, 'rt', encoding='utf-8')
+    elif compression == 'zstd':
+        zstandard = _import_zstandard('read the zstd-compressed file {}'.format(filepath))
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True),
+                                encoding='utf-8')
+    return open(filepath, encoding='utf-8')
+
+
+def load_json_file(filepath: str):
+    """Reads and parses a whole JSON file."""
+    with open_json_file(filepath) as f:
+        return json.load(f)
+
+
+def iter_json_array(stream: io.TextIOBase, chunk_size: int = _READ_CHUNK_SIZE) -> Iterator:
+    """Parses a JSON array from a text stream one element at a time, yielding each element as soon as it is parsed.
+    Only the element being parsed is held as text, so the memory used does not grow with the size of the array.
+
+    Raises a ValueError if the stream does not hold a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    at_end = False
+
+    def _skip(characters: str) -> bool:
+        """Advances past whitespace and the given characters, reading more as needed. Returns False at the end."""
+        nonlocal buffer, position, at_end
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] in characters):
+                position += 1
+            if position < len(buffer):
+                return True
+            if at_end:
+                return False
+            buffer, position = stream.read(chunk_size), 0
+            at_end = buffer == ''
+
+    if not _skip('') or buffer[position] != '[':
+        raise ValueError('Expected a JSON array')
+    position += 1
+    while True:
+        if not _skip(','):
+            raise ValueError('Unexpected end of a JSON array')
+        if buffer[position] == ']':
+            return
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                # in an array, an element ends before whitespace, a comma, or a closing bracket; a number that seems
+                # to end elsewhere (such as at the end of the buffer) may continue in the next chunk
+                if at_end or (end < len(buffer) and (buffer[end].isspace() or buffer[end] in ',]')):
+                    break
+            except json.JSONDecodeError:
+                if at_end:
+                    raise ValueError('Invalid JSON array element at offset {} of its chunk'.format(position))
+            more = stream.read(chunk_size)
+            at_end = more == ''
+            buffer, position = buffer[position:] + more, 0
+        yield element
+        position = end
+
+
+def write_json_if_changed(filepath: str, data, compression: str = 'none') -> bool:
+    """Writes data as JSON to the plain JSON file path filepath plus the suffix of the compression, unless that file
+    already holds the same contents. The same file with a different compression is removed. Returns True if the file
+    was written.
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError('Unsupported compression {}, expected one of: {}'.format(
+            compression, ', '.join(COMPRESSION_SUFFIXES.keys())))
+    if compression == 'none':
+        contents = json.dumps(data, indent=4).encode('utf-8')
+    else:
+        contents = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        if compression == 'gzip':
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:  # no timestamp, so equal data compares equal
+                f.write(contents)
+            contents = buffer.getvalue()
+        else:
+            contents = _import_zstandard('write zstd-compressed files').ZstdCompressor().compress(contents)
+
+    target = filepath + COMPRESSION_SUFFIXES[compression]
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if filepath + suffix != target and os.path.exists(filepath + suffix):
+            os.remove(filepath + suffix)
+    if os.path.exists(target):
+        with open(target, 'rb') as f:
+            if f.read() == contents:
+                return False
+    with open(target, 'wb') as f:
+        f.write(contents)
+    return True
+
+
+def _import_zstandard(purpose: str):
+    """Helper function: imports the optional zstandard package, raising a ValueError that says how to install it (and
+    what it was needed for) if it is not installed
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('The zstandard package is needed to {}, but it is not installed. Install it with: '
+                         'pip install principalmapper[zstd]'.format(purpose))
+    return zstandard
@@ -46,6 +46,5 @@ def get_storage_root():
         # MacOS: follow MacOS convention: ~/Library/Application Support/com.nccgroup.principalmapper/
         appdatadir = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support')
         result = os.path.join(appdatadir, 'com.nccgroup.principalmapper')
-    if not os.path.exists(result):
-        os.makedirs(result, 0o700)
+    os.makedirs(result, 0o700, exist_ok=True)  # may be called from several threads at once, see multi_account
     return result
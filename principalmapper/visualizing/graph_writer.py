@@ -16,14 +16,14 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
-import pydot
-
 from principalmapper.common import Graph
 from principalmapper.querying.presets.privesc import can_privesc
 
 
 def handle_request(graph: Graph, path: str, file_format: str) -> None:
     """Meat of the graph_writer.py module, writes graph data in a given file-format to the given path."""
+    import pydot  # imported here so that loading this module (such as for pmapper's other subcommands) is cheap
+
     # Load graph data into pydot
     pydg = pydot.Dot(
         graph_type='digraph',
@@ -35,10 +35,13 @@ setup(
     author_email='erik.steringer@nccgroup.com',
     scripts=[],
     include_package_data=True,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_data={},
     python_requires='>=3.5, <4',  # assume Python 4 will break
     install_requires=['botocore', 'packaging', 'python-dateutil', 'pydot'],
+    extras_require={
+        'zstd': ['zstandard']
+    },
     entry_points={
         'console_scripts': [
             'pmapper = principalmapper.__main__:main'
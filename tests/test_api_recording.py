@@ -0,0 +1,254 @@
+"""Test code for recording and replaying AWS API responses"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import os.path
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+from principalmapper.graphing.gathering import create_graph, update_graph
+from principalmapper.util.api_recording import RecordingSession, ReplaySession
+
+
+_PREFIX = 'arn:aws:iam::000000000000:'
+
+
+def _call(service: str, operation: str, params: dict, response: dict, region=None, status_code=200) -> dict:
+    return {'type': 'call', 'service': service, 'region': region, 'operation': operation, 'params': params,
+            'status_code': status_code, 'response': response}
+
+
+def _get_small_account_records() -> list:
+    """Returns the records of gathering a small account: one admin user, one user with sts:AssumeRole through a group,
+    and one role that trusts the account
+    """
+    admin_policy = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}
+    jump_policy = {'Version': '2012-10-17',
+                   'Statement': [{'Effect': 'Allow', 'Action': 'sts:AssumeRole', 'Resource': '*'}]}
+    trust_policy = {'Version': '2012-10-17', 'Statement': [
+        {'Effect': 'Allow', 'Principal': {'AWS': _PREFIX + 'root'}, 'Action': 'sts:AssumeRole'}
+    ]}
+    date = '2019-01-01T00:00:00Z'
+    records = [
+        {'type': 'header', 'format': 'pmapper-api-recording', 'version': 1},
+        _call('sts', 'GetCallerIdentity', {}, {'UserId': 'AIDA0', 'Account': '000000000000',
+                                               'Arn': _PREFIX + 'user/admin'}),
+        _call('iam', 'ListPolicies', {'OnlyAttached': True, 'MaxItems': 100}, {'Policies': [
+            {'Arn': _PREFIX + 'policy/Admin', 'PolicyName': 'Admin', 'DefaultVersionId': 'v1'}
+        ], 'IsTruncated': False}),
+        _call('iam', 'ListUsers', {'MaxItems': 25}, {'Users': [
+            {'Path': '/', 'UserName': 'admin', 'UserId': 'AIDA00000000000000000', 'Arn': _PREFIX + 'user/admin',
+             'CreateDate': date},
+            {'Path': '/', 'UserName': 'jump', 'UserId': 'AIDA00000000000000001', 'Arn': _PREFIX + 'user/jump',
+             'CreateDate': date}
+        ], 'IsTruncated': False}),
+        _call('iam', 'ListRoles', {'MaxItems': 25}, {'Roles': [
+            {'Path': '/', 'RoleName': 'target', 'RoleId': 'AROA00000000000000000', 'Arn': _PREFIX + 'role/target',
+             'CreateDate': date, 'AssumeRolePolicyDocument': trust_policy}
+        ], 'IsTruncated': False}),
+        _call('iam', 'ListInstanceProfiles', {'MaxItems': 25}, {'InstanceProfiles': [], 'IsTruncated': False}),
+        _call('iam', 'ListAccessKeys', {'UserName': 'admin'}, {'AccessKeyMetadata': []}),
+        _call('iam', 'ListAccessKeys', {'UserName': 'jump'}, {'AccessKeyMetadata': []}),
+        _call('iam', 'ListGroups', {'MaxItems': 25}, {'Groups': [
+            {'Path': '/', 'GroupName': 'jumpers', 'GroupId': 'AGPA00000000000000000',
+             'Arn': _PREFIX + 'group/jumpers', 'CreateDate': date}
+        ], 'IsTruncated': False}),
+        _call('iam', 'ListGroupsForUser', {'UserName': 'admin'}, {'Groups': []}),
+        _call('iam', 'ListGroupsForUser', {'UserName': 'jump'}, {'Groups': [
+            {'Path': '/', 'GroupName': 'jumpers', 'GroupId': 'AGPA00000000000000000',
+             'Arn': _PREFIX + 'group/jumpers', 'CreateDate': date}
+        ]}),
+        _call('iam', 'ListGroupPolicies', {'GroupName': 'jumpers'}, {'PolicyNames': ['jump']}),
+        _call('iam', 'GetGroupPolicy', {'GroupName': 'jumpers', 'PolicyName': 'jump'}, {
+            'GroupName': 'jumpers', 'PolicyName': 'jump', 'PolicyDocument': json.dumps(jump_policy)}),
+        _call('iam', 'ListAttachedGroupPolicies', {'GroupName': 'jumpers'}, {'AttachedPolicies': []}),
+        _call('iam', 'GetPolicy', {'PolicyArn': _PREFIX + 'policy/Admin'}, {'Policy': {
+            'PolicyName': 'Admin', 'Arn': _PREFIX + 'policy/Admin', 'DefaultVersionId': 'v1'}}),
+        _call('iam', 'GetPolicyVersion', {'PolicyArn': _PREFIX + 'policy/Admin', 'VersionId': 'v1'}, {
+            'PolicyVersion': {'Document': json.dumps(admin_policy), 'VersionId': 'v1', 'IsDefaultVersion': True}}),
+        _call('iam', 'ListRolePolicies', {'RoleName': 'target'}, {'PolicyNames': []}),
+        _call('iam', 'ListAttachedRolePolicies', {'RoleName': 'target'}, {'AttachedPolicies': []}),
+        _call('iam', 'ListRolePolicies', {'RoleName': 'forbidden'},
+              {'Error': {'Code': 'AccessDenied', 'Message': 'Access denied'}}, status_code=403),
+    ]
+    for user_name in ('admin', 'jump'):
+        records.append(_call('iam', 'ListUserPolicies', {'UserName': user_name}, {'PolicyNames': []}))
+        attached = [{'PolicyName': 'Admin', 'PolicyArn': _PREFIX + 'policy/Admin'}] if user_name == 'admin' else []
+        records.append(_call('iam', 'ListAttachedUserPolicies', {'UserName': user_name},
+                             {'AttachedPolicies': attached}))
+    return records
+
+
+def _get_update_records(keys_policy: dict, admin_access_keys: int) -> list:
+    """Returns the records of updating the graph of the small account after the jump user was given an inline policy
+    and the admin user created access keys
+    """
+    records = []
+    for record in _get_small_account_records():
+        if record.get('operation') == 'ListUserPolicies' and record['params']['UserName'] == 'jump':
+            record['response']['PolicyNames'] = ['keys']
+        elif record.get('operation') == 'ListAccessKeys' and record['params']['UserName'] == 'admin':
+            record['response']['AccessKeyMetadata'] = [{'UserName': 'admin', 'AccessKeyId': 'AKIA{}'.format(x),
+                                                         'Status': 'Active'} for x in range(admin_access_keys)]
+        records.append(record)
+    records.extend([
+        _call('iam', 'GetUserPolicy', {'UserName': 'jump', 'PolicyName': 'keys'}, {
+            'UserName': 'jump', 'PolicyName': 'keys', 'PolicyDocument': json.dumps(keys_policy)}),
+        _call('iam', 'GetGroup', {'GroupName': 'jumpers'}, {'Group': {}, 'Users': [
+            {'UserName': 'jump', 'UserId': 'AIDA00000000000000001', 'Arn': _PREFIX + 'user/jump'}
+        ], 'IsTruncated': False}),
+        _call('iam', 'GetAccountAuthorizationDetails', {'Filter': ['User', 'Role'], 'MaxItems': 100}, {
+            'UserDetailList': [
+                {'UserName': 'admin', 'Arn': _PREFIX + 'user/admin', 'UserPolicyList': [], 'AttachedManagedPolicies': [
+                    {'PolicyName': 'Admin', 'PolicyArn': _PREFIX + 'policy/Admin'}]},
+                {'UserName': 'jump', 'Arn': _PREFIX + 'user/jump', 'AttachedManagedPolicies': [], 'UserPolicyList': [
+                    {'PolicyName': 'keys', 'PolicyDocument': json.dumps(keys_policy)}]}
+            ],
+            'RoleDetailList': [
+                {'RoleName': 'target', 'Arn': _PREFIX + 'role/target', 'RolePolicyList': [],
+                 'AttachedManagedPolicies': []}
+            ],
+            'IsTruncated': False
+        })
+    ])
+    return records
+
+
+def _get_group_managed_policy_records(inline_policy: dict, managed_policy: dict, version_id: str) -> list:
+    """Returns the records of updating the graph of the small account after the jump user was given an inline policy
+    and the jumpers group was attached the managed policy Jumpers, at the given default version
+    """
+    records = []
+    for record in _get_update_records(inline_policy, 0):
+        if record.get('operation') == 'ListPolicies':
+            record['response']['Policies'].append({'Arn': _PREFIX + 'policy/Jumpers', 'PolicyName': 'Jumpers',
+                                                   'DefaultVersionId': version_id})
+        elif record.get('operation') == 'ListAttachedGroupPolicies':
+            record['response']['AttachedPolicies'] = [
+                {'PolicyName': 'Jumpers', 'PolicyArn': _PREFIX + 'policy/Jumpers'}
+            ]
+        records.append(record)
+    records.extend([
+        _call('iam', 'GetPolicy', {'PolicyArn': _PREFIX + 'policy/Jumpers'}, {'Policy': {
+            'PolicyName': 'Jumpers', 'Arn': _PREFIX + 'policy/Jumpers', 'DefaultVersionId': version_id}}),
+        _call('iam', 'GetPolicyVersion', {'PolicyArn': _PREFIX + 'policy/Jumpers', 'VersionId': version_id}, {
+            'PolicyVersion': {'Document': json.dumps(managed_policy), 'VersionId': version_id,
+                              'IsDefaultVersion': True}})
+    ])
+    return records
+
+
+def _write_archive(filepath: str, records: list) -> None:
+    """Writes records to a gzip-compressed JSON Lines archive, as a RecordingSession does"""
+    with gzip.open(filepath, 'wt') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def _write_small_account_archive(filepath: str) -> None:
+    """Writes a recording of gathering the small account, see _get_small_account_records"""
+    _write_archive(filepath, _get_small_account_records())
+
+
+class ApiRecordingTest(unittest.TestCase):
+    def test_replay_and_record(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_path = os.path.join(tmpdir, 'recording.json.gz')
+            _write_small_account_archive(archive_path)
+
+            # recorded error responses are raised as errors again
+            session = ReplaySession(archive_path)
+            with self.assertRaises(ClientError) as context:
+                session.create_client('iam').list_role_policies(RoleName='forbidden')
+            self.assertEqual(context.exception.response['Error']['Code'], 'AccessDenied')
+            with self.assertRaises(ValueError):
+                session.create_client('iam').list_role_policies(RoleName='unknown')
+
+            graph = create_graph(ReplaySession(archive_path), ['iam', 'sts'])
+            self.assertEqual(graph.metadata['account_id'], '000000000000')
+            self.assertEqual(graph.metadata['policy_versions'], {_PREFIX + 'policy/Admin': 'v1'})
+            self.assertEqual([node.is_admin for node in graph.nodes], [True, False, False])
+            self.assertEqual([(edge.source.arn, edge.destination.arn) for edge in graph.edges],
+                             [(_PREFIX + 'user/jump', _PREFIX + 'role/target')])
+
+            # recording a replayed run gives an archive that replays to the same graph
+            rerecorded_path = os.path.join(tmpdir, 'rerecorded.json.gz')
+            recording_session = RecordingSession(ReplaySession(archive_path), rerecorded_path)
+            create_graph(recording_session, ['iam', 'sts'])
+            recording_session.close()
+            regraph = create_graph(ReplaySession(rerecorded_path, latency=0.001), ['iam', 'sts'])
+            self.assertEqual([node.to_dictionary() for node in regraph.nodes],
+                             [node.to_dictionary() for node in graph.nodes])
+            self.assertEqual(len(regraph.edges), len(graph.edges))
+
+    def test_update_graph(self):
+        keys_policy = {'Version': '2012-10-17',
+                       'Statement': [{'Effect': 'Allow', 'Action': 'iam:CreateAccessKey', 'Resource': '*'}]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_path = os.path.join(tmpdir, 'recording.json.gz')
+            _write_small_account_archive(archive_path)
+            graph = create_graph(ReplaySession(archive_path), ['iam', 'sts'])
+
+            # a new inline policy of a user that otherwise stays the same is picked up
+            _write_archive(archive_path, _get_update_records(keys_policy, 0))
+            update_graph(ReplaySession(archive_path), graph, ['iam', 'sts'])
+            jump_user = graph.get_node_by_searchable_name('user/jump')
+            self.assertEqual([policy.name for policy in jump_user.attached_policies], ['keys'])
+            self.assertEqual(sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in graph.edges), [
+                (_PREFIX + 'user/jump', _PREFIX + 'role/target', 'can access via sts:AssumeRole'),
+                (_PREFIX + 'user/jump', _PREFIX + 'user/admin', 'can create access keys to authenticate as')
+            ])
+
+            # the admin having two access keys stops the jump user from creating one
+            _write_archive(archive_path, _get_update_records(keys_policy, 2))
+            update_graph(ReplaySession(archive_path), graph, ['iam', 'sts'])
+            self.assertEqual(graph.get_node_by_searchable_name('user/admin').access_keys, 2)
+            self.assertEqual([(edge.source.arn, edge.destination.arn) for edge in graph.edges],
+                             [(_PREFIX + 'user/jump', _PREFIX + 'role/target')])
+
+    def test_update_graph_group_managed_policy(self):
+        inline_policy = {'Version': '2012-10-17',
+                         'Statement': [{'Effect': 'Allow', 'Action': 's3:ListBucket', 'Resource': '*'}]}
+        keys_policy = {'Version': '2012-10-17',
+                       'Statement': [{'Effect': 'Allow', 'Action': 'iam:CreateAccessKey', 'Resource': '*'}]}
+        own_keys_policy = {'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': 'iam:CreateAccessKey', 'Resource': _PREFIX + 'user/jump'}
+        ]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_path = os.path.join(tmpdir, 'recording.json.gz')
+            _write_small_account_archive(archive_path)
+            graph = create_graph(ReplaySession(archive_path), ['iam', 'sts'])
+
+            # a managed policy attached to the jump user's group lets it create access keys
+            _write_archive(archive_path, _get_group_managed_policy_records(inline_policy, keys_policy, 'v1'))
+            update_graph(ReplaySession(archive_path), graph, ['iam', 'sts'])
+            self.assertEqual(sorted((edge.source.arn, edge.destination.arn) for edge in graph.edges), [
+                (_PREFIX + 'user/jump', _PREFIX + 'role/target'),
+                (_PREFIX + 'user/jump', _PREFIX + 'user/admin')
+            ])
+
+            # a new default version of that policy limits it to the user's own keys, even though the group still has
+            # the same policies
+            _write_archive(archive_path, _get_group_managed_policy_records(inline_policy, own_keys_policy, 'v2'))
+            update_graph(ReplaySession(archive_path), graph, ['iam', 'sts'])
+            jumpers_policy = [policy for policy in graph.policies if policy.arn == _PREFIX + 'policy/Jumpers'][0]
+            self.assertEqual(jumpers_policy.policy_doc, own_keys_policy)
+            self.assertEqual([(edge.source.arn, edge.destination.arn) for edge in graph.edges],
+                             [(_PREFIX + 'user/jump', _PREFIX + 'role/target')])
@@ -0,0 +1,65 @@
+"""Test code for the synthetic account generator and the benchmark scenarios"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import json
+import os.path
+import tempfile
+import unittest
+
+from benchmarks.__main__ import main
+from benchmarks.scenarios import registered_scenarios, run_scenarios
+from benchmarks.synthetic import build_synthetic_graph
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_synthetic_graph_is_seeded(self):
+        graph = build_synthetic_graph(users=20, roles=20, groups=5, managed_policies=10, seed=3)
+        again = build_synthetic_graph(users=20, roles=20, groups=5, managed_policies=10, seed=3)
+        other = build_synthetic_graph(users=20, roles=20, groups=5, managed_policies=10, seed=4)
+        self.assertEqual(len(graph.nodes), 40)
+        self.assertEqual([node.to_dictionary() for node in graph.nodes], [node.to_dictionary() for node in again.nodes])
+        self.assertEqual([edge.to_dictionary() for edge in graph.edges],
+                         [edge.to_dictionary() for edge in again.edges])
+        self.assertNotEqual([node.to_dictionary() for node in graph.nodes],
+                            [node.to_dictionary() for node in other.nodes])
+        trust_policies = [node.trust_policy for node in graph.nodes if node.trust_policy is not None]
+        self.assertTrue(any('Service' in trust_policy['Statement'][0]['Principal'] for trust_policy in trust_policies))
+        with self.assertRaises(ValueError):
+            build_synthetic_graph(users=0)
+
+    def test_scenarios_and_results(self):
+        self.assertIn('obtain_edges:sts', registered_scenarios)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            build_synthetic_graph(users=10, roles=10, groups=3, managed_policies=8).store_graph_as_json(tmpdir)
+            results = run_scenarios(tmpdir, ['graph_load', 'obtain_edges:sts'], repeat=2)
+            self.assertEqual([result['name'] for result in results], ['graph_load', 'obtain_edges:sts'])
+            self.assertEqual(len(results[0]['seconds']), 2)
+            self.assertGreater(results[1]['evaluations'], 0)
+            with self.assertRaises(ValueError):
+                run_scenarios(tmpdir, ['unknown'])
+
+            output_path = os.path.join(tmpdir, 'results.json')
+            with contextlib.redirect_stderr(io.StringIO()):
+                main(['--users', '5', '--roles', '5', '--groups', '2', '--policies', '4', '--repeat', '1',
+                      '--scenario', 'privesc_all', '--scenario', 'gen_report', '--output', output_path])
+            with open(output_path) as f:
+                results = json.load(f)
+            self.assertEqual(results['format'], 'pmapper-benchmarks')
+            self.assertEqual(results['graph']['nodes'], 10)
+            self.assertEqual([result['name'] for result in results['scenarios']], ['privesc_all', 'gen_report'])
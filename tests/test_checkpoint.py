@@ -0,0 +1,123 @@
+"""Test code for checkpointing and resuming graph creation"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import os.path
+import tempfile
+import unittest
+import unittest.mock
+
+from principalmapper.graphing import edge_identification
+from principalmapper.graphing.checkpoint import GraphCheckpoint
+from principalmapper.graphing.edge_identification import checker_map
+from principalmapper.graphing.edge_stream import EdgeStreamWriter, load_edge_stream
+from principalmapper.graphing.gathering import create_graph
+from principalmapper.graphing.regional_inventory import RegionalInventory
+from principalmapper.util.api_recording import ReplaySession
+from tests.build_test_graphs import build_playground_graph
+from tests.test_api_recording import _write_small_account_archive
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_stages_and_records(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            checkpoint = GraphCheckpoint(os.path.join(tmpdir, 'checkpoint'))
+            self.assertFalse(checkpoint.has_stage('nodes'))
+            with self.assertRaises(ValueError):
+                checkpoint.load_stage('nodes')
+            checkpoint.save_stage('nodes', [{'arn': 'a'}])
+            checkpoint.append_record('principal_policies', {'arn': 'a', 'policies': []})
+            checkpoint.append_record('principal_policies', {'arn': 'b', 'policies': []})
+            with open(os.path.join(checkpoint.directory, 'principal_policies.jsonl'), 'a') as f:
+                f.write('{"arn": "c", "poli')  # interrupted mid-write
+
+            reloaded = GraphCheckpoint(checkpoint.directory)
+            self.assertTrue(reloaded.has_stage('nodes'))
+            self.assertEqual(reloaded.load_stage('nodes'), [{'arn': 'a'}])
+            self.assertEqual(sorted(reloaded.load_records_by_key('principal_policies', 'arn')), ['a', 'b'])
+
+            reloaded.clear()
+            self.assertFalse(os.path.exists(checkpoint.directory))
+            self.assertFalse(GraphCheckpoint(checkpoint.directory).has_stage('nodes'))
+
+    def test_resume_edge_phase_offline(self):
+        graph = build_playground_graph()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # the gathering stages, as saved by a create_graph run that stopped before edge identification
+            checkpoint = GraphCheckpoint(tmpdir)
+            checkpoint.save_stage('metadata', graph.metadata)
+            checkpoint.save_stage('nodes', [node.to_dictionary() for node in graph.nodes])
+            checkpoint.save_stage('groups', {'groups': [], 'memberships': {}})
+            for node in graph.nodes:
+                checkpoint.append_record('principal_policies', {
+                    'arn': node.arn,
+                    'policies': [policy.to_dictionary() for policy in node.attached_policies]
+                })
+            checkpoint.save_stage('policies', {'count': len(graph.policies)})
+            checkpoint.save_stage('admins', [node.arn for node in graph.nodes if node.is_admin])
+
+            with self.assertRaises(ValueError):
+                create_graph(None, ['sts'], checkpoint=GraphCheckpoint(os.path.join(tmpdir, 'empty')))
+
+            resumed = create_graph(None, checker_map.keys(), checkpoint=GraphCheckpoint(tmpdir))
+            self.assertEqual([node.arn for node in resumed.nodes], [node.arn for node in graph.nodes])
+            self.assertEqual(sorted(policy.arn for policy in resumed.policies),
+                             sorted(policy.arn for policy in graph.policies))
+            self.assertEqual(
+                sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in resumed.edges),
+                sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in graph.edges)
+            )
+
+            # edges of each checker are checkpointed too
+            self.assertTrue(GraphCheckpoint(tmpdir).has_stage('edges_sts'))
+
+            # an interrupted check leaves its partial edge stream behind, which is redone rather than duplicated
+            reloaded = GraphCheckpoint(tmpdir)
+            reloaded.state['completed_stages'].remove('edges_sts')
+            with open(reloaded.get_records_path('edges_sts'), 'a') as f:
+                f.write('{"source": "arn:aws:iam::000000000000:user/jum')  # interrupted mid-write
+            resumed_again = create_graph(None, checker_map.keys(), checkpoint=reloaded)
+            self.assertEqual(len(resumed_again.edges), len(graph.edges))
+
+    def test_checkers_share_inventory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_path = os.path.join(tmpdir, 'recording.json.gz')
+            _write_small_account_archive(archive_path)
+            checkpoint = GraphCheckpoint(os.path.join(tmpdir, 'checkpoint'))
+            service_list = ['iam', 'lambda', 'sts', 'cloudformation']
+            with unittest.mock.patch.object(edge_identification, 'RegionalInventory',
+                                            wraps=RegionalInventory) as inventory_class:
+                graph = create_graph(ReplaySession(archive_path), service_list, checkpoint=checkpoint)
+            self.assertEqual(inventory_class.call_count, 1)
+            self.assertEqual(len(graph.edges), 1)
+            for check in service_list:
+                self.assertTrue(checkpoint.has_stage('edges_{}'.format(check)))
+            self.assertEqual(checkpoint.load_stage('edges_sts'), {'edges': 1})
+
+    def test_edge_stream(self):
+        graph = build_playground_graph()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'edges.jsonl')
+            with EdgeStreamWriter(filepath) as writer:
+                for edge in graph.edges:
+                    writer.write(edge)
+            self.assertEqual(writer.count, len(graph.edges))
+            with open(filepath, 'a') as f:
+                f.write('{"source": "arn:aws:iam::000000000000:user/jum')  # interrupted mid-write
+
+            self.assertEqual(list(load_edge_stream(filepath, graph.nodes)), list(graph.edges))
+            with self.assertRaises(ValueError):
+                list(load_edge_stream(filepath, graph.nodes[:1]))
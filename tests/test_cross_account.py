@@ -0,0 +1,128 @@
+"""Test code for identifying edges between the principals of different accounts"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock
+
+import principalmapper
+from principalmapper.common import Graph, Node, Policy
+from principalmapper.graphing.cross_account import MultiAccountGraph, TrustPolicyIndex, load_multi_account_graph
+from principalmapper.graphing.sts_edges import STSEdgeChecker
+from tests.build_test_graphs import build_playground_graph, _get_jump_policy, _make_trust_document
+
+
+def _build_other_account_graph() -> Graph:
+    """Builds the graph of account 999999999999: a user that can call sts:AssumeRole, a role trusting the jump user of
+    the playground graph's account by ARN, a role trusting any principal, and a role trusting only its own account
+    """
+    prefix = 'arn:aws:iam::999999999999:'
+    jump_policy = Policy(prefix + 'policy/JumpPolicy', 'JumpPolicy', _get_jump_policy())
+    nodes = [
+        Node(prefix + 'user/auditor', 'AIDA99999999999999990', [jump_policy], [], None, None, 1, True, False),
+        Node(prefix + 'role/trusts_jumpuser', 'AROA99999999999999991', [], [],
+             _make_trust_document({'AWS': 'arn:aws:iam::000000000000:user/jumpuser'}), None, 0, False, False),
+        Node(prefix + 'role/trusts_anyone', 'AROA99999999999999992', [], [], _make_trust_document({'AWS': '*'}),
+             None, 0, False, False),
+        Node(prefix + 'role/trusts_own_account', 'AROA99999999999999993', [], [],
+             _make_trust_document({'AWS': '999999999999'}), None, 0, False, False)
+    ]
+    return Graph(nodes, [], [jump_policy], [], {'account_id': '999999999999',
+                                                'pmapper_version': principalmapper.__version__})
+
+
+def _make_conditional_trust_document(principal_element, condition: dict) -> dict:
+    """Constructs and returns a trust document like _make_trust_document, with a Condition on its statement"""
+    result = _make_trust_document(principal_element)
+    result['Statement'][0]['Condition'] = condition
+    return result
+
+
+class CrossAccountTest(unittest.TestCase):
+    def test_trust_policy_index(self):
+        playground = build_playground_graph()
+        other = _build_other_account_graph()
+        index = TrustPolicyIndex(playground.nodes + other.nodes)
+        self.assertEqual([node.arn for node in index.get_candidates('999999999999')],
+                         ['arn:aws:iam::000000000000:role/external_s3_access_role'])
+        self.assertEqual(sorted(node.arn for node in index.get_candidates('000000000000')),
+                         ['arn:aws:iam::999999999999:role/trusts_anyone',
+                          'arn:aws:iam::999999999999:role/trusts_jumpuser'])
+        self.assertEqual([node.arn for node in index.get_candidates('111111111111')],
+                         ['arn:aws:iam::999999999999:role/trusts_anyone'])
+
+    def test_cross_account_edges(self):
+        playground = build_playground_graph()
+        multi_account_graph = MultiAccountGraph([playground, _build_other_account_graph()])
+        edges = multi_account_graph.identify_cross_account_edges()
+        edge_names = sorted((edge.source.searchable_name(), edge.destination.searchable_name()) for edge in edges)
+        self.assertEqual(edge_names, [
+            ('user/admin', 'role/trusts_anyone'),
+            ('user/auditor', 'role/external_s3_access_role'),
+            ('user/jumpuser', 'role/trusts_anyone'),
+            ('user/jumpuser', 'role/trusts_jumpuser'),
+            ('user/some_other_jumpuser', 'role/trusts_anyone')
+        ])
+        self.assertEqual(len(multi_account_graph.edges), len(playground.edges) + len(edges))
+        self.assertIs(multi_account_graph.get_node_by_arn('arn:aws:iam::999999999999:user/auditor'),
+                      multi_account_graph.graphs_by_account['999999999999'].nodes[0])
+        with self.assertRaises(ValueError):
+            MultiAccountGraph([playground, playground])
+
+    def test_load_stored_graphs(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                unittest.mock.patch.dict(os.environ, {'XDG_DATA_HOME': tmpdir}):
+            storage_root = os.path.join(tmpdir, 'principalmapper')
+            build_playground_graph().store_graph_as_json(os.path.join(storage_root, '000000000000'))
+            _build_other_account_graph().store_graph_as_json(os.path.join(storage_root, '999999999999'))
+            os.makedirs(os.path.join(storage_root, '111111111111', 'checkpoint'))  # unfinished run, no graph
+
+            multi_account_graph = load_multi_account_graph()
+            self.assertEqual(sorted(multi_account_graph.graphs_by_account), ['000000000000', '999999999999'])
+            self.assertEqual(len(multi_account_graph.identify_cross_account_edges()), 5)
+
+    def test_wildcard_trust_with_condition(self):
+        # in the same account, a role trusting '*' is not matched, with or without a condition
+        playground = build_playground_graph()
+        same_account_role = Node('arn:aws:iam::000000000000:role/trusts_anyone', 'AROA00000000000000099', [], [],
+                                 _make_trust_document('*'), None, 0, False, False)
+        playground.nodes.append(same_account_role)
+        for trust_policy in (_make_trust_document('*'),
+                             _make_conditional_trust_document({'AWS': '*'}, {
+                                 'StringEquals': {'aws:PrincipalAccount': '000000000000'}})):
+            same_account_role.trust_policy = trust_policy
+            edges = STSEdgeChecker(None).return_edges(playground.nodes, destination_nodes=[same_account_role])
+            self.assertEqual(edges, [])
+
+        # across accounts, the condition is evaluated with the principal's account and ARN filled in
+        def _get_wildcard_edges(condition: dict) -> list:
+            other = _build_other_account_graph()
+            other.nodes[2].trust_policy = _make_conditional_trust_document({'AWS': '*'}, condition)
+            edges = MultiAccountGraph([build_playground_graph(), other]).identify_cross_account_edges()
+            return sorted(edge.source.searchable_name() for edge in edges
+                          if edge.destination.searchable_name() == 'role/trusts_anyone')
+
+        self.assertEqual(_get_wildcard_edges({'StringEquals': {'aws:PrincipalOrgID': 'o-abcdefghij'}}), [])
+        self.assertEqual(_get_wildcard_edges({'StringEquals': {'aws:PrincipalAccount': '111111111111'}}), [])
+        self.assertIn('user/jumpuser',
+                      _get_wildcard_edges({'StringEquals': {'aws:PrincipalAccount': '000000000000'}}))
+        self.assertEqual(_get_wildcard_edges({'StringLike': {'aws:PrincipalArn': '*:user/jumpuser'}}),
+                         ['user/jumpuser'])
+        self.assertEqual(_get_wildcard_edges({'Null': {'aws:SourceIp': 'true'}}),
+                         _get_wildcard_edges({'StringEquals': {'aws:PrincipalAccount': '000000000000'}}))
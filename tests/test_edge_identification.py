@@ -15,13 +15,22 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import unittest
+import unittest.mock
 
+from principalmapper.common.edges import Edge
 from principalmapper.common.graphs import Graph
 from principalmapper.common.nodes import Node
-from principalmapper.graphing.edge_identification import obtain_edges
+from principalmapper.common.policies import Policy
+from principalmapper.graphing.cloudformation_edges import CloudFormationEdgeChecker
+from principalmapper.graphing.edge_checker import EdgeChecker, register_edge_checker
+from principalmapper.graphing import edge_identification
+from principalmapper.graphing.edge_identification import checker_map, obtain_edges
+from principalmapper.graphing.lambda_edges import LambdaEdgeChecker
 from principalmapper.querying.query_utils import get_search_list, is_connected
-from tests.build_test_graphs import build_playground_graph
+from tests.build_test_graphs import build_playground_graph, _build_user_with_policy, _get_s3_full_access_policy, \
+    _make_trust_document
 
 
 class TestEdgeIdentification(unittest.TestCase):
@@ -45,3 +54,216 @@ class TestEdgeIdentification(unittest.TestCase):
         self.assertTrue(is_connected(graph, admin_user_node, jump_user))
         self.assertTrue(is_connected(graph, admin_user_node, nonassumable_role_node))
         self.assertTrue(is_connected(graph, other_jump_user, other_assumable_role))
+
+    def test_changed_node_edges(self):
+        graph = build_playground_graph()
+        jump_user = graph.get_node_by_searchable_name('user/jumpuser')
+        s3_role = graph.get_node_by_searchable_name('role/s3_access_role')
+        external_role = graph.get_node_by_searchable_name('role/external_s3_access_role')
+
+        # jump user loses sts:AssumeRole, one role stops trusting the account and another starts trusting it
+        jump_user.attached_policies = [
+            Policy(jump_user.arn, 'inline_s3', _get_s3_full_access_policy())
+        ]
+        s3_role.trust_policy = _make_trust_document({'AWS': '999999999999'})
+        external_role.trust_policy = _make_trust_document({'AWS': 'arn:aws:iam::000000000000:root'})
+        jump_user.cache.clear()
+
+        updated = obtain_edges(None, checker_map.keys(), graph.nodes, existing_edges=graph.edges,
+                               changed_sources=[jump_user], changed_destinations=[s3_role, external_role])
+        expected = obtain_edges(None, checker_map.keys(), graph.nodes)
+        self.assertEqual(
+            sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in updated),
+            sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in expected)
+        )
+
+        # edges to or from removed nodes are dropped without any checks
+        remaining_nodes = [node for node in graph.nodes if node is not s3_role]
+        updated = obtain_edges(None, checker_map.keys(), remaining_nodes, existing_edges=expected)
+        self.assertTrue(all(edge.destination is not s3_role and edge.source is not s3_role for edge in updated))
+        self.assertEqual(len(updated), len([edge for edge in expected if s3_role not in (edge.source, edge.destination)]))
+
+    def test_registered_checker_stats(self):
+        class RoleToUserChecker(EdgeChecker):
+            source_types = ('role',)
+            destination_types = ('user',)
+
+            def return_edges(self, nodes, output=None, debug=False, source_nodes=None, destination_nodes=None):
+                return []
+
+        class NetworkOnlyChecker(EdgeChecker):
+            requires_network = True
+
+        graph = build_playground_graph()
+        register_edge_checker('test_role_to_user')(RoleToUserChecker)
+        register_edge_checker('test_network_only')(NetworkOnlyChecker)
+        try:
+            with self.assertRaises(ValueError):
+                register_edge_checker('test_role_to_user')(NetworkOnlyChecker)
+
+            stats = []
+            obtain_edges(None, ['test_role_to_user', 'test_network_only', 'sts'], graph.nodes, stats=stats)
+        finally:
+            del checker_map['test_role_to_user']
+            del checker_map['test_network_only']
+
+        stats_by_name = {checker_stats.name: checker_stats for checker_stats in stats}
+        roles = len([node for node in graph.nodes if ':role/' in node.arn])
+        users = len(graph.nodes) - roles
+        self.assertEqual(stats_by_name['test_role_to_user'].pairs, roles * users)
+        self.assertEqual(stats_by_name['test_role_to_user'].edges, 0)
+        self.assertIsNotNone(stats_by_name['test_network_only'].skipped)
+        self.assertEqual(stats_by_name['sts'].pairs, len(graph.nodes) * roles)
+        self.assertGreater(stats_by_name['sts'].edges, 0)
+
+    def test_baseline_return_edges_checker(self):
+        class BaselineChecker(EdgeChecker):
+            def return_edges(self, nodes, output, debug):
+                return [Edge(source, destination, 'can reach') for source in nodes for destination in nodes
+                        if source is not destination]
+
+        graph = build_playground_graph()
+        source, destination = graph.nodes[0], graph.nodes[1]
+        checker = BaselineChecker(None)
+        self.assertEqual(len(checker.return_edges(graph.nodes, None, False)),
+                         len(graph.nodes) * (len(graph.nodes) - 1))
+        edges = list(checker.iter_edges(graph.nodes, source_nodes=[source]))
+        self.assertEqual(len(edges), len(graph.nodes) - 1)
+        self.assertTrue(all(edge.source is source for edge in edges))
+        edges = list(checker.iter_edges(graph.nodes, source_nodes=[source], destination_nodes=[destination]))
+        self.assertEqual([(edge.source, edge.destination) for edge in edges], [(source, destination)])
+
+        register_edge_checker('test_baseline')(BaselineChecker)
+        try:
+            edges = obtain_edges(None, ['test_baseline'], graph.nodes)
+        finally:
+            del checker_map['test_baseline']
+        self.assertEqual(len(edges), len(graph.nodes) * (len(graph.nodes) - 1))
+
+    def test_lazy_plugin_checkers(self):
+        class PluginChecker(EdgeChecker):
+            def return_edges(self, nodes, output=None, debug=False, source_nodes=None, destination_nodes=None):
+                return []
+
+        def _fail():
+            raise ImportError('missing dependency')
+
+        good_plugin = unittest.mock.Mock(load=lambda: PluginChecker)
+        good_plugin.name = 'test_plugin'
+        broken_plugin = unittest.mock.Mock(load=_fail)
+        broken_plugin.name = 'test_broken_plugin'
+        entry_points = unittest.mock.Mock(return_value=[broken_plugin, good_plugin])
+        graph = build_playground_graph()
+        stderr = io.StringIO()
+        try:
+            with unittest.mock.patch.object(edge_identification, '_plugins_loaded', False), \
+                    unittest.mock.patch.object(edge_identification, '_get_entry_points', entry_points), \
+                    unittest.mock.patch('sys.stderr', stderr):
+                self.assertEqual(entry_points.call_count, 0)
+                obtain_edges(None, ['test_plugin'], graph.nodes)
+                obtain_edges(None, ['test_plugin'], graph.nodes)
+            self.assertEqual(entry_points.call_count, 1)
+            self.assertIs(checker_map['test_plugin'], PluginChecker)
+            self.assertNotIn('test_broken_plugin', checker_map)
+            self.assertIn('test_broken_plugin: missing dependency', stderr.getvalue())
+        finally:
+            checker_map.pop('test_plugin', None)
+
+    def test_lambda_existing_functions(self):
+        def _policy(actions, resource='*'):
+            return {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': actions, 'Resource': resource}]}
+
+        function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:{}'
+        lambda_trust = _make_trust_document({'Service': 'lambda.amazonaws.com'})
+        function_role = Node('arn:aws:iam::000000000000:role/function_role', 'AROA00000000000000000', [], [],
+                             lambda_trust, None, 0, False, False)
+        other_role = Node('arn:aws:iam::000000000000:role/other_role', 'AROA00000000000000001', [], [],
+                          lambda_trust, None, 0, False, False)
+        code_editor = _build_user_with_policy(_policy('lambda:UpdateFunctionCode', function_arn.format('func')),
+                                              'code_policy', 'code_editor', '0')
+        function_editor = _build_user_with_policy(
+            _policy(['lambda:UpdateFunctionCode', 'lambda:UpdateFunctionConfiguration', 'iam:PassRole']),
+            'edit_policy', 'function_editor', '1'
+        )
+        nodes = [function_role, other_role, code_editor, function_editor]
+
+        checker = LambdaEdgeChecker(None)
+        checker._function_list = [
+            {'FunctionArn': function_arn.format('func'), 'Role': function_role.arn},
+            {'FunctionArn': function_arn.format('other_func'), 'Role': function_role.arn}
+        ]
+        edges = checker.return_edges(nodes)
+        self.assertEqual(
+            sorted((edge.source.arn, edge.destination.arn) for edge in edges),
+            sorted([
+                (code_editor.arn, function_role.arn),  # edit code, keep the role
+                (function_editor.arn, function_role.arn),  # edit code, keep the role
+                (function_editor.arn, other_role.arn)  # edit code and configuration, pass a role
+            ])
+        )
+        self.assertTrue(all(function_arn.format('func') in edge.reason for edge in edges))
+
+    def test_cloudformation_existing_stacks(self):
+        def _policy(actions, resource='*'):
+            return {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': actions, 'Resource': resource}]}
+
+        stack_id = 'arn:aws:cloudformation:us-east-1:000000000000:stack/{}/00000000-0000-0000-0000-000000000000'
+        cloudformation_trust = _make_trust_document({'Service': 'cloudformation.amazonaws.com'})
+        stack_role = Node('arn:aws:iam::000000000000:role/stack_role', 'AROA00000000000000000', [], [],
+                          cloudformation_trust, None, 0, False, False)
+        other_role = Node('arn:aws:iam::000000000000:role/other_role', 'AROA00000000000000001', [], [],
+                          cloudformation_trust, None, 0, False, False)
+        stack_updater = _build_user_with_policy(_policy('cloudformation:UpdateStack', stack_id.format('stack')),
+                                                'update_policy', 'stack_updater', '0')
+        change_set_user = _build_user_with_policy(
+            _policy(['cloudformation:CreateChangeSet', 'cloudformation:ExecuteChangeSet'], stack_id.format('stack')),
+            'change_set_policy', 'change_set_user', '1'
+        )
+        nodes = [stack_role, other_role, stack_updater, change_set_user]
+
+        checker = CloudFormationEdgeChecker(None)
+        checker._stack_list = [
+            {'StackId': stack_id.format('stack'), 'RoleARN': stack_role.arn},
+            {'StackId': stack_id.format('no_role_stack')}
+        ]
+        edges = checker.return_edges(nodes)
+        self.assertEqual(
+            sorted((edge.source.arn, edge.destination.arn) for edge in edges),
+            sorted([
+                (stack_updater.arn, stack_role.arn),  # update the stack, keep the role
+                (change_set_user.arn, stack_role.arn)  # create and execute a change set, keep the role
+            ])
+        )
+        self.assertTrue(all(stack_id.format('stack') in edge.reason for edge in edges))
+
+    def test_cloudformation_pass_role_update(self):
+        stack_id = 'arn:aws:cloudformation:us-east-1:000000000000:stack/stack/00000000-0000-0000-0000-000000000000'
+        cloudformation_trust = _make_trust_document({'Service': 'cloudformation.amazonaws.com'})
+        stack_role = Node('arn:aws:iam::000000000000:role/stack_role', 'AROA00000000000000000', [], [],
+                          cloudformation_trust, None, 0, False, False)
+        other_role = Node('arn:aws:iam::000000000000:role/other_role', 'AROA00000000000000001', [], [],
+                          cloudformation_trust, None, 0, False, False)
+        any_role_user = _build_user_with_policy({'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': ['cloudformation:UpdateStack', 'iam:PassRole'], 'Resource': '*'}
+        ]}, 'update_policy', 'any_role_user', '0')
+        # the RoleArn condition makes UpdateStack depend on the role passed, so it is checked per destination
+        one_role_user = _build_user_with_policy({'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': 'iam:PassRole', 'Resource': '*'},
+            {'Effect': 'Allow', 'Action': 'cloudformation:UpdateStack', 'Resource': stack_id,
+             'Condition': {'StringEquals': {'cloudformation:RoleArn': other_role.arn}}}
+        ]}, 'update_policy', 'one_role_user', '1')
+
+        checker = CloudFormationEdgeChecker(None)
+        checker._stack_list = [{'StackId': stack_id, 'RoleARN': stack_role.arn}]
+        edges = checker.return_edges([stack_role, other_role, any_role_user, one_role_user])
+        self.assertEqual(sorted((edge.source.searchable_name(), edge.destination.searchable_name(), edge.reason)
+                                for edge in edges), [
+            ('user/any_role_user', 'role/other_role',
+             'can update the CloudFormation stack {} and pass the role to access'.format(stack_id)),
+            ('user/any_role_user', 'role/stack_role',
+             'can update the CloudFormation stack {} and pass the role to access'.format(stack_id)),
+            ('user/any_role_user', 'role/stack_role', 'can update the CloudFormation stack {} to access'.format(
+                stack_id)),
+            ('user/one_role_user', 'role/other_role',
+             'can update the CloudFormation stack {} and pass the role to access'.format(stack_id))
+        ])
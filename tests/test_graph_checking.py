@@ -15,8 +15,56 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import os.path
+import tempfile
 import unittest
 
+from principalmapper.common import Edge, EdgeList, Graph
+from tests.build_test_graphs import build_playground_graph
+
 
 class GraphCheckingTest(unittest.TestCase):
-    pass
+    def test_edge_list(self):
+        graph = build_playground_graph()
+        self.assertIsInstance(graph.edges, EdgeList)
+        edges = list(graph.edges)
+        self.assertGreater(len(edges), 0)
+        self.assertEqual(len(graph.edges), len(edges))
+        self.assertEqual(graph.edges[0], edges[0])
+        self.assertEqual(graph.edges[-1], edges[-1])
+        self.assertEqual(graph.edges[1:3], edges[1:3])
+
+        new_edge = Edge(graph.nodes[0], graph.nodes[1], 'can test')
+        graph.edges.append(new_edge)
+        self.assertIn(new_edge, graph.edges)
+        self.assertIs(graph.edges[-1].source, graph.nodes[0])
+        del graph.edges[-1]
+        self.assertEqual(list(graph.edges), edges)
+
+        graph.edges = edges + [new_edge]
+        self.assertIsInstance(graph.edges, EdgeList)
+        self.assertEqual(len(graph.edges), len(edges) + 1)
+
+    def test_slotted_objects(self):
+        graph = build_playground_graph()
+        for obj in [graph.nodes[0], graph.policies[0], graph.edges[0]]:
+            with self.assertRaises(AttributeError):
+                obj.not_an_attribute = True
+
+    def test_store_only_changed_files(self):
+        graph = build_playground_graph()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph.store_graph_as_json(tmpdir)
+            nodes_path = os.path.join(tmpdir, 'graph', 'nodes.json')
+            edges_path = os.path.join(tmpdir, 'graph', 'edges.json')
+            os.utime(nodes_path, (0, 0))
+            os.utime(edges_path, (0, 0))
+
+            del graph.edges[0]
+            graph.store_graph_as_json(tmpdir)
+            self.assertEqual(os.path.getmtime(nodes_path), 0)
+            self.assertNotEqual(os.path.getmtime(edges_path), 0)
+
+            loaded_graph = Graph.create_graph_from_local_disk(tmpdir)
+            self.assertEqual(len(loaded_graph.edges), len(graph.edges))
@@ -0,0 +1,90 @@
+"""Test code for diffing graphs"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import os.path
+import tempfile
+import unittest
+
+from principalmapper.common import Group
+from principalmapper.graphing import graph_diff
+from principalmapper.querying.presets import privesc
+from tests.build_test_graphs import build_playground_graph
+
+
+def _get_privesc_arns(graph) -> set:
+    return {node.arn for node in graph.nodes if not node.is_admin and privesc.can_privesc(graph, node)[0]}
+
+
+class GraphDiffTest(unittest.TestCase):
+    def test_diff_graphs(self):
+        old = build_playground_graph()
+        self.assertEqual(list(graph_diff.diff_graphs(old, build_playground_graph())), [])
+
+        new = build_playground_graph()
+        prefix = 'arn:aws:iam::000000000000:'
+        jumpuser = new.get_node_by_searchable_name('user/jumpuser')
+        s3_access_role = new.get_node_by_searchable_name('role/s3_access_role')
+        s3_access_role.is_admin = True
+        group = Group(prefix + 'group/admins', [new.policies[0]])
+        new.groups.append(group)
+        jumpuser.group_memberships = [group]
+        jump_policy = [policy for policy in new.policies if policy.name == 'JumpPolicy'][0]
+        old_digest = jump_policy.digest
+        jump_policy.policy_doc = {'Version': '2012-10-17', 'Statement': []}
+        new.nodes = [node for node in new.nodes if node.arn != prefix + 'role/somepath/somerole']
+        new.edges = [edge for edge in new.edges if edge.destination.arn != prefix + 'role/somepath/somerole' and
+                     edge.source.arn != prefix + 'role/somepath/somerole' and
+                     edge.destination.arn != prefix + 'role/ec2_admin_role']
+
+        differences = list(graph_diff.diff_graphs(old, new))
+        self.assertIn({'type': 'node', 'change': 'changed', 'arn': s3_access_role.arn,
+                       'fields': {'is_admin': {'before': False, 'after': True}}}, differences)
+        self.assertIn({'type': 'node', 'change': 'removed', 'arn': prefix + 'role/somepath/somerole'}, differences)
+        self.assertIn({'type': 'group_membership', 'change': 'added', 'node': jumpuser.arn, 'group': group.arn},
+                      differences)
+        self.assertIn({'type': 'group', 'change': 'added', 'arn': group.arn}, differences)
+        self.assertIn({'type': 'policy', 'change': 'changed', 'arn': jump_policy.arn, 'name': 'JumpPolicy',
+                       'before_digest': old_digest, 'after_digest': jump_policy.digest}, differences)
+        removed_edges = {(edge.source.arn, edge.destination.arn, edge.reason) for edge in old.edges} - \
+            {(edge.source.arn, edge.destination.arn, edge.reason) for edge in new.edges}
+        self.assertEqual({(x['source'], x['destination'], x['reason']) for x in differences
+                          if x['type'] == 'edge' and x['change'] == 'removed'}, removed_edges)
+        self.assertFalse(any(x['type'] == 'edge' and x['change'] == 'added' for x in differences))
+
+        old_privesc = _get_privesc_arns(old)
+        new_privesc = _get_privesc_arns(new)
+        self.assertNotEqual(old_privesc, new_privesc)
+        self.assertEqual({x['arn'] for x in differences if x['type'] == 'privesc' and x['change'] == 'added'},
+                         new_privesc - old_privesc)
+        self.assertEqual({x['arn'] for x in differences if x['type'] == 'privesc' and x['change'] == 'removed'},
+                         old_privesc - new_privesc)
+
+        # the stored files give the same differences, written as JSON Lines
+        with tempfile.TemporaryDirectory() as tmpdir:
+            old.store_graph_as_json(os.path.join(tmpdir, 'old'))
+            new.store_graph_as_json(os.path.join(tmpdir, 'new'), 'gzip')
+            output = io.StringIO()
+            count = graph_diff.write_diff_as_json_lines(
+                graph_diff.diff_stored_graphs(os.path.join(tmpdir, 'old'), os.path.join(tmpdir, 'new')), output)
+            self.assertEqual(count, len(differences))
+            self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], differences)
+
+            with self.assertRaises(ValueError):
+                graph_diff.get_graph_directory(os.path.join(tmpdir, 'missing'))
+            self.assertEqual(graph_diff.get_graph_directory(os.path.join(tmpdir, 'old')), os.path.join(tmpdir, 'old'))
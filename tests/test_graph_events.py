@@ -0,0 +1,91 @@
+"""Test code for applying IAM change events to a Graph"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os.path
+import tempfile
+import unittest
+
+from principalmapper.graphing.edge_identification import checker_map, obtain_edges
+from principalmapper.graphing.graph_events import apply_events, load_events_from_file
+from principalmapper.querying.query_utils import is_connected
+from tests.build_test_graphs import build_playground_graph, _make_trust_document
+
+
+def _event(event_name: str, request_parameters: dict, **kwargs) -> dict:
+    """Returns a minimal CloudTrail record for an IAM API call"""
+    result = {
+        'eventSource': 'iam.amazonaws.com',
+        'eventName': event_name,
+        'requestParameters': request_parameters
+    }
+    result.update(kwargs)
+    return result
+
+
+class GraphEventsTest(unittest.TestCase):
+    def test_replay_events_from_file(self):
+        graph = build_playground_graph()
+        jump_user = graph.get_node_by_searchable_name('user/jumpuser')
+        other_jump_user = graph.get_node_by_searchable_name('user/some_other_jumpuser')
+        s3_role = graph.get_node_by_searchable_name('role/s3_access_role')
+        external_role = graph.get_node_by_searchable_name('role/external_s3_access_role')
+        self.assertFalse(is_connected(graph, jump_user, external_role))
+
+        events = [
+            _event('UpdateAssumeRolePolicy', {
+                'roleName': 'external_s3_access_role',
+                'policyDocument': json.dumps(_make_trust_document({'AWS': 'arn:aws:iam::000000000000:root'}))
+            }),
+            _event('DetachUserPolicy', {
+                'userName': 'some_other_jumpuser',
+                'policyArn': 'arn:aws:iam::000000000000:policy/JumpPolicy'
+            }),
+            _event('AttachUserPolicy', {
+                'userName': 'some_other_jumpuser',
+                'policyArn': 'arn:aws:iam::aws:policy/AdministratorAccess'
+            }),
+            _event('PutRolePolicy', {
+                'roleName': 's3_access_role',
+                'policyName': 'assume_anything',
+                'policyDocument': json.dumps({'Version': '2012-10-17', 'Statement': [
+                    {'Effect': 'Allow', 'Action': 'sts:AssumeRole', 'Resource': '*'}
+                ]})
+            }),
+            # failed calls are ignored, events referencing unknown data are skipped
+            _event('AttachUserPolicy', {'userName': 'jumpuser', 'policyArn': 'arn:aws:iam::aws:policy/ReadOnly'},
+                   errorCode='AccessDenied'),
+            _event('AttachUserPolicy', {'userName': 'jumpuser', 'policyArn': 'arn:aws:iam::aws:policy/ReadOnly'}),
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            events_path = os.path.join(tmpdir, 'events.jsonl')
+            with open(events_path, 'w') as f:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+            applied = apply_events(graph, load_events_from_file(events_path), checker_map.keys())
+        self.assertEqual(applied, 5)
+
+        self.assertTrue(is_connected(graph, jump_user, external_role))
+        self.assertTrue(other_jump_user.is_admin)
+        self.assertTrue(is_connected(graph, s3_role, external_role))
+
+        # the targeted recomputation matches recomputing every edge
+        expected = obtain_edges(None, checker_map.keys(), graph.nodes)
+        self.assertEqual(
+            sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in graph.edges),
+            sorted((edge.source.arn, edge.destination.arn, edge.reason) for edge in expected)
+        )
@@ -0,0 +1,75 @@
+"""Test code for the de-duplicated history of graph snapshots"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime as dt
+import os.path
+import tempfile
+import unittest
+
+from principalmapper.common import Group
+from principalmapper.graphing import graph_diff
+from principalmapper.graphing.graph_history import GraphHistory, SnapshotRecords, parse_timestamp
+from tests.build_test_graphs import build_playground_graph
+
+
+def _describe_graph(graph) -> tuple:
+    return ([node.to_dictionary() for node in graph.nodes], sorted(edge.describe_edge() for edge in graph.edges),
+            [(policy.arn, policy.name, policy.policy_doc) for policy in graph.policies],
+            [group.to_dictionary() for group in graph.groups], graph.metadata)
+
+
+class GraphHistoryTest(unittest.TestCase):
+    def test_snapshots(self):
+        days = [dt.datetime(2026, 10, day, 6, 0, tzinfo=dt.timezone.utc) for day in (1, 2, 3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            history = GraphHistory(os.path.join(tmpdir, 'history'))
+            with self.assertRaises(ValueError):
+                history.load_graph_as_of(days[2])
+
+            first = build_playground_graph()
+            first_id, first_written = history.save_snapshot(first, days[0])
+            with self.assertRaises(ValueError):
+                history.save_snapshot(first, days[0])
+
+            second = build_playground_graph()
+            group = Group('arn:aws:iam::000000000000:group/admins', [second.policies[0]])
+            second.groups.append(group)
+            second.get_node_by_searchable_name('user/jumpuser').group_memberships = [group]
+            second.get_node_by_searchable_name('user/jumpuser').is_admin = True
+            second_id, second_written = history.save_snapshot(second, days[1])
+            self.assertEqual(second_written, 2)  # the new group and the changed user
+            self.assertEqual(history.save_snapshot(second, days[2])[1], 0)
+
+            self.assertEqual([x[1] for x in history.list_snapshots()], days)
+            self.assertEqual(history.get_snapshot_as_of(parse_timestamp('2026-10-01')), first_id)
+            self.assertEqual(history.get_snapshot_as_of(parse_timestamp('2026-10-02T05:59:59Z')), first_id)
+            self.assertEqual(_describe_graph(history.load_graph_as_of(days[0])), _describe_graph(first))
+            self.assertEqual(_describe_graph(history.load_graph(second_id)), _describe_graph(second))
+
+            differences = list(graph_diff.iter_graph_diff(SnapshotRecords(history, history.load_manifest(first_id)),
+                                                          SnapshotRecords(history, history.load_manifest(second_id))))
+            self.assertEqual(differences, list(graph_diff.diff_graphs(first, second)))
+            self.assertIn({'type': 'group', 'change': 'added', 'arn': group.arn}, differences)
+
+            self.assertEqual(history.remove_snapshots_before(days[1]), (1, 1))  # only the old user was unique to it
+            self.assertEqual(len(history.list_snapshots()), 2)
+            self.assertEqual(_describe_graph(history.load_graph_as_of(days[2])), _describe_graph(second))
+
+        with self.assertRaises(ValueError):
+            parse_timestamp('yesterday')
+        self.assertEqual(parse_timestamp('2026-10-01T12:30'), dt.datetime(2026, 10, 1, 12, 30,
+                                                                          tzinfo=dt.timezone.utc))
@@ -0,0 +1,59 @@
+"""Test code for keeping the offline subcommands of pmapper from importing botocore and other heavy dependencies"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tests.build_test_graphs import build_playground_graph
+
+
+# Runs pmapper with the given arguments, then prints the heavy dependencies that were imported
+_RUN_PMAPPER = '''
+import contextlib, io, json, sys
+from principalmapper.__main__ import main
+sys.argv = ['pmapper'] + json.loads(sys.argv[1])
+with contextlib.redirect_stdout(io.StringIO()):
+    main()
+heavy = sorted(name for name in ('boto3', 'botocore', 'dateutil', 'pydot') if name in sys.modules)
+print(json.dumps(heavy))
+'''
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_offline_subcommands_skip_heavy_imports(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph = build_playground_graph()
+            graph.store_graph_as_json(os.path.join(tmpdir, 'principalmapper', graph.metadata['account_id']))
+            env = dict(os.environ, XDG_DATA_HOME=tmpdir)
+            repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env['PYTHONPATH'] = os.pathsep.join(filter(None, [repo_root, env.get('PYTHONPATH')]))
+
+            for args in (['query', 'who can do iam:CreateUser with *'],
+                         ['argquery', '--action', 's3:GetObject'],
+                         ['query', 'preset privesc *'],
+                         ['analysis']):
+                pmapper_args = ['--account', graph.metadata['account_id']] + args
+                process = subprocess.run([sys.executable, '-c', _RUN_PMAPPER, json.dumps(pmapper_args)], env=env,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                self.assertEqual(process.returncode, 0, process.stderr)
+                heavy = json.loads(process.stdout.splitlines()[-1])
+                self.assertEqual(heavy, [], 'pmapper {} imported {}'.format(' '.join(args), heavy))
@@ -0,0 +1,103 @@
+"""Test code for reading and writing the (optionally compressed) JSON files of stored graphs"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import io
+import json
+import os.path
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import principalmapper
+from principalmapper.common import Graph, Group, Policy
+from principalmapper.util import json_files
+from tests.build_test_graphs import build_playground_graph
+
+
+class JsonFilesTest(unittest.TestCase):
+    def test_iter_json_array(self):
+        data = [{'a': '[not] the end, "quoted"', 'b': [1, 2, {'c': None}]}, 12345678, 'text', [], {}, 1.5e10, True]
+        for chunk_size in (1, 2, 3, 7, 1024):
+            for text in (json.dumps(data), json.dumps(data, indent=4), '  ' + json.dumps(data) + '\n'):
+                self.assertEqual(list(json_files.iter_json_array(io.StringIO(text), chunk_size)), data)
+        self.assertEqual(list(json_files.iter_json_array(io.StringIO(' [ ] '), 1)), [])
+        for text in ('', '{"a": 1}', '[1, 2', '[1, {"a": ]'):
+            with self.assertRaises(ValueError):
+                list(json_files.iter_json_array(io.StringIO(text), 2))
+
+    def test_store_compressed_graph(self):
+        graph = build_playground_graph()
+        # a user in two groups, to check that every membership is loaded
+        statement = {'Effect': 'Allow', 'Action': 's3:*', 'Resource': '*'}
+        policy = Policy('arn:aws:iam::000000000000:group/second', 'inline',
+                        {'Version': '2012-10-17', 'Statement': [statement]})
+        groups = [Group('arn:aws:iam::000000000000:group/first', []),
+                  Group('arn:aws:iam::000000000000:group/second', [policy])]
+        graph.groups.extend(groups)
+        graph.policies.append(policy)
+        user = [node for node in graph.nodes if ':user/' in node.arn][0]
+        user.group_memberships = groups
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph.store_graph_as_json(tmpdir)
+            plain_size = os.path.getsize(os.path.join(tmpdir, 'graph', 'edges.json'))
+
+            graph.store_graph_as_json(tmpdir, 'gzip')
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'graph', 'edges.json')))
+            self.assertLess(os.path.getsize(os.path.join(tmpdir, 'graph', 'edges.json.gz')), plain_size)
+            graph.store_graph_as_json(tmpdir)  # keeps the compression
+            self.assertEqual(json_files.find_json_file(os.path.join(tmpdir, 'graph', 'nodes.json')),
+                             os.path.join(tmpdir, 'graph', 'nodes.json.gz'))
+
+            loaded = Graph.create_graph_from_local_disk(tmpdir)
+            self.assertEqual([node.to_dictionary() for node in loaded.nodes],
+                             [node.to_dictionary() for node in graph.nodes])
+            self.assertEqual(sorted(edge.describe_edge() for edge in loaded.edges),
+                             sorted(edge.describe_edge() for edge in graph.edges))
+            self.assertEqual([group.arn for group in loaded.get_node_by_searchable_name(
+                user.searchable_name()).group_memberships], [group.arn for group in groups])
+
+            with self.assertRaises(ValueError):
+                graph.store_graph_as_json(tmpdir, 'bzip2')
+
+            # versions from before compressed files reject the graph by its metadata, which is never compressed
+            with open(os.path.join(tmpdir, 'metadata.json')) as f:
+                self.assertEqual(json.load(f)['pmapper_version'], principalmapper.__version__)
+            with unittest.mock.patch.object(principalmapper, '__version__', '1.0.1'):
+                with self.assertRaisesRegex(ValueError, 'different version of Principal Mapper'):
+                    Graph.create_graph_from_local_disk(tmpdir)
+
+    def test_missing_zstandard(self):
+        with tempfile.TemporaryDirectory() as tmpdir, unittest.mock.patch.dict(sys.modules, {'zstandard': None}):
+            filepath = os.path.join(tmpdir, 'nodes.json.zst')
+            with open(filepath, 'wb') as f:
+                f.write(b'\x28\xb5\x2f\xfd')
+            with self.assertRaisesRegex(ValueError, r'nodes\.json\.zst.*pip install principalmapper\[zstd\]'):
+                json_files.open_json_file(filepath)
+            with self.assertRaisesRegex(ValueError, r'pip install principalmapper\[zstd\]'):
+                json_files.write_json_if_changed(os.path.join(tmpdir, 'edges.json'), [], 'zstd')
+
+    @unittest.skipIf(importlib.util.find_spec('zstandard') is None, 'zstandard is not installed')
+    def test_store_zstd_graph(self):
+        graph = build_playground_graph()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph.store_graph_as_json(tmpdir, 'zstd')
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'graph', 'nodes.json.zst')))
+            loaded = Graph.create_graph_from_local_disk(tmpdir)
+            self.assertEqual(len(loaded.edges), len(graph.edges))
@@ -19,9 +19,11 @@ import unittest
 
 from tests.build_test_graphs import *
 from tests.build_test_graphs import _build_user_with_policy
+from principalmapper.common.groups import Group
 from principalmapper.common.nodes import Node
 from principalmapper.common.policies import Policy
 from principalmapper.querying.query_interface import local_check_authorization, local_check_authorization_handling_mfa, has_matching_statement, _infer_condition_keys
+from principalmapper.querying.local_policy_simulation import get_permission_summary, get_referenced_condition_keys
 
 
 class LocalQueryingTests(unittest.TestCase):
@@ -63,6 +65,138 @@ class LocalQueryingTests(unittest.TestCase):
         self.assertTrue('aws:username' in inferred_keys)
         self.assertTrue(inferred_keys['aws:username'] == 'infer')
 
+        inferred_keys = _infer_condition_keys(test_node, {}, {'aws:username'})
+        self.assertEqual(inferred_keys, {'aws:username': 'infer'})
+
+    def test_inferred_keys_limited_to_referenced_keys(self):
+        test_node = _build_user_with_policy(
+            {
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Action': 'iam:CreateAccessKey',
+                    'Resource': 'arn:aws:iam::000000000000:user/${aws:username}',
+                    'Condition': {
+                        'Bool': {
+                            'aws:SecureTransport': 'true'
+                        }
+                    }
+                }]
+            },
+            user_name='infer'
+        )
+        self.assertEqual(get_referenced_condition_keys(test_node.attached_policies[0]),
+                         {'aws:username', 'aws:SecureTransport'})
+
+        context = {'aws:SecureTransport': 'true'}
+        self.assertTrue(local_check_authorization(test_node, 'iam:CreateAccessKey', test_node.arn, context, True))
+        self.assertEqual(context, {'aws:SecureTransport': 'true'})  # shared context is not modified
+        self.assertTrue(local_check_authorization_handling_mfa(test_node, 'iam:CreateAccessKey', test_node.arn, context,
+                                                               True)[0])
+        self.assertEqual(context, {'aws:SecureTransport': 'true'})
+
+    def test_policy_interning(self):
+        policy_doc = {
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Effect': 'Allow',
+                'Action': 's3:GetObject',
+                'Resource': '*'
+            }]
+        }
+        node_a = _build_user_with_policy(policy_doc, policy_name='inline', user_name='a', number='1')
+        node_b = _build_user_with_policy(dict(policy_doc), policy_name='inline', user_name='b', number='2')
+        policy_a, policy_b = node_a.attached_policies[0], node_b.attached_policies[0]
+        self.assertIsNot(policy_a, policy_b)
+        self.assertIs(policy_a.policy_doc, policy_b.policy_doc)
+        self.assertIs(policy_a.cache, policy_b.cache)
+        self.assertEqual(policy_a.digest, policy_b.digest)
+
+        # node_b's evaluation reuses the result cached for node_a
+        self.assertTrue(local_check_authorization(node_a, 's3:GetObject', '*', {}))
+        cached_results = dict(policy_a.cache['evaluation_results'])
+        self.assertTrue(local_check_authorization(node_b, 's3:GetObject', '*', {}))
+        self.assertEqual(cached_results, policy_b.cache['evaluation_results'])
+
+    def test_group_result_sharing(self):
+        developers = Group('arn:aws:iam::000000000000:group/Developers', [
+            Policy('arn:aws:iam::000000000000:group/Developers', 'DeveloperAccess', {
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Action': 'lambda:*',
+                    'Resource': '*'
+                }]
+            })
+        ])
+        self_service = Group('arn:aws:iam::000000000000:group/SelfService', [
+            Policy('arn:aws:iam::000000000000:group/SelfService', 'SelfServiceKeys', {
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Action': 'iam:CreateAccessKey',
+                    'Resource': 'arn:aws:iam::000000000000:user/${aws:username}'
+                }]
+            })
+        ])
+        members = []
+        for number, user_name in enumerate(['dev1', 'dev2']):
+            member = _build_user_with_policy({'Version': '2012-10-17', 'Statement': []}, user_name=user_name,
+                                             number=str(number))
+            member.group_memberships.extend([developers, self_service])
+            members.append(member)
+
+        for member in members:
+            self.assertTrue(local_check_authorization(member, 'lambda:CreateFunction', '*', {}))
+        self.assertEqual(len(developers.cache['evaluation_results']), 2)  # one Allow and one Deny lookup, shared
+
+        # results depending on aws:username are evaluated per member
+        self.assertTrue(local_check_authorization(members[0], 'iam:CreateAccessKey', members[0].arn, {}))
+        self.assertFalse(local_check_authorization(members[1], 'iam:CreateAccessKey', members[0].arn, {}))
+        self.assertNotIn('evaluation_results', self_service.cache)
+
+    def test_permission_summary(self):
+        group_policy = Policy('arn:aws:iam::000000000000:policy/GroupPolicy', 'GroupPolicy', {
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Effect': 'Allow',
+                'Action': 'ssm:*',
+                'Resource': '*'
+            }]
+        })
+        group = Group('arn:aws:iam::000000000000:group/ssm_users', [group_policy])
+        test_node = _build_user_with_policy({
+            'Version': '2012-10-17',
+            'Statement': [
+                {
+                    'Effect': 'Allow',
+                    'NotAction': 's3:*',
+                    'Resource': '*'
+                },
+                {
+                    'Effect': 'Deny',
+                    'Action': 'iam:*',
+                    'Resource': '*'
+                },
+                {
+                    'Effect': 'Deny',
+                    'Action': 'ec2:RunInstances',
+                    'Resource': '*',
+                    'Condition': {'Bool': {'aws:MultiFactorAuthPresent': 'false'}}
+                }
+            ]
+        })
+        test_node.group_memberships.append(group)
+
+        summary = get_permission_summary(test_node)
+        self.assertIs(summary, get_permission_summary(test_node))
+        self.assertFalse(summary.could_allow_service('iam'))
+        self.assertFalse(summary.could_allow_action('iam:CreateAccessKey'))
+        self.assertTrue(summary.could_allow_service('ssm'))
+        self.assertTrue(summary.could_allow_action('ec2:RunInstances'))  # the Deny is conditional
+        self.assertFalse(summary.could_allow_action('s3:GetObject'))
+        self.assertFalse(summary.could_allow_service('s3'))
+
     def test_arn_condition(self):
         """ Validate the following conditions are correctly handled:
             ArnEquals, ArnLike, ArnNotEquals, ArnNotLike.
@@ -0,0 +1,115 @@
+"""Test code for creating the graphs of many accounts at once"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import datetime
+import gzip
+import io
+import os
+import os.path
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from principalmapper.common import Graph
+from principalmapper.graphing.edge_identification import checker_map
+from principalmapper.graphing.multi_account import ApiRateLimiter, SpawnPoolExecutor, TargetSessionFactory, \
+    create_graphs, is_role_arn, load_targets
+from principalmapper.util.api_recording import ReplaySession
+from tests.test_api_recording import _write_small_account_archive
+
+
+class MultiAccountTest(unittest.TestCase):
+    def test_create_graphs(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                unittest.mock.patch.dict(os.environ, {'XDG_DATA_HOME': tmpdir}):
+            # one recorded account, then a copy of it as a second account
+            archives = {
+                'first': os.path.join(tmpdir, 'first.json.gz'),
+                'second': os.path.join(tmpdir, 'second.json.gz'),
+                'duplicate': os.path.join(tmpdir, 'first.json.gz')
+            }
+            _write_small_account_archive(archives['first'])
+            with gzip.open(archives['first'], 'rt') as f:
+                recording = f.read()
+            with gzip.open(archives['second'], 'wt') as f:
+                f.write(recording.replace('000000000000', '111111111111'))
+
+            output = io.StringIO()
+            results = create_graphs(['first', 'second', 'duplicate', 'missing'], checker_map.keys(), output,
+                                    calls_per_second=1000.0, gather_workers=4, edge_processes=2,
+                                    session_factory=lambda target: ReplaySession(archives[target]))
+
+            # whichever of the two targets for the first account is gathered second is turned away
+            stored = [result for result in results if result.error is None]
+            self.assertEqual(sorted(result.account_id for result in stored), ['000000000000', '111111111111'])
+            self.assertNotEqual(results[0].error is None, results[2].error is None)
+            self.assertIsNotNone(results[3].error)
+            for result in stored:
+                self.assertEqual((result.nodes, result.edges), (3, 1))
+                self.assertGreater(result.api_calls, 0)
+                graph_dir = os.path.join(tmpdir, 'principalmapper', result.account_id)
+                graph = Graph.create_graph_from_local_disk(graph_dir)
+                self.assertEqual(graph.metadata['account_id'], result.account_id)
+                self.assertEqual(len(graph.edges), 1)
+                self.assertFalse(os.path.exists(os.path.join(graph_dir, 'checkpoint')))
+            self.assertIn('Created 2 of 4 graphs', output.getvalue())
+
+    def test_rate_limiter_and_targets(self):
+        limiter = ApiRateLimiter(200.0)
+        start = time.perf_counter()
+        for _ in range(21):
+            limiter.acquire()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+        self.assertEqual(limiter.calls, 21)
+        with self.assertRaises(ValueError):
+            ApiRateLimiter(0)
+
+        self.assertTrue(is_role_arn('arn:aws:iam::000000000000:role/OrganizationAccountAccessRole'))
+        self.assertFalse(is_role_arn('arn:aws:iam::000000000000:user/someone'))
+        self.assertFalse(is_role_arn('audit-profile'))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'targets.txt')
+            with open(filepath, 'w') as f:
+                f.write('# member accounts\narn:aws:iam::000000000000:role/Audit\n\n  audit-profile  \n')
+            self.assertEqual(load_targets(filepath), ['arn:aws:iam::000000000000:role/Audit', 'audit-profile'])
+
+    def test_spawn_pool_executor(self):
+        pool = SpawnPoolExecutor(1)
+        try:
+            futures = [pool.submit(pow, 2, 10), pool.submit(int, 'not a number')]
+            self.assertEqual(len(list(concurrent.futures.as_completed(futures, timeout=60))), 2)
+            self.assertEqual(futures[0].result(), 1024)
+            self.assertIsInstance(futures[1].exception(), ValueError)
+        finally:
+            pool.shutdown(wait=True)
+
+    def test_target_session_factory(self):
+        role_arn = 'arn:aws:iam::000000000000:role/audit'
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        stsclient = unittest.mock.Mock()
+        stsclient.assume_role.return_value = {'Credentials': {
+            'AccessKeyId': 'ASIA0000', 'SecretAccessKey': 'secret', 'SessionToken': 'token', 'Expiration': expiration
+        }}
+        factory = TargetSessionFactory()
+        factory._stsclient = stsclient
+        with unittest.mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'AKIA0000', 'AWS_SECRET_ACCESS_KEY': 'x'}):
+            credentials = factory(role_arn).get_credentials()
+        self.assertEqual(credentials.get_frozen_credentials().access_key, 'ASIA0000')
+        self.assertEqual(credentials.method, 'pmapper-assume-role')
+        stsclient.assume_role.assert_called_with(RoleArn=role_arn, RoleSessionName='pmapper')
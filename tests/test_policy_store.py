@@ -0,0 +1,89 @@
+"""Test code for the memory-mapped policy document store"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import gc
+import json
+import os.path
+import tempfile
+import unittest
+
+from principalmapper.common import Graph, Policy
+from principalmapper.common.policy_store import PolicyStore, write_policy_store
+from tests.build_test_graphs import build_playground_graph
+
+
+class PolicyStoreTest(unittest.TestCase):
+    def test_write_and_read(self):
+        first = Policy('arn:aws:iam::000000000000:policy/first', 'first',
+                       {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 's3:*', 'Resource': '*'}]})
+        second = Policy('arn:aws:iam::000000000000:user/someuser', 'inline',
+                        {'Version': '2012-10-17', 'Statement': [{'Effect': 'Deny', 'Action': '*', 'Resource': '*'}]})
+        duplicate = Policy('arn:aws:iam::000000000000:role/somerole', 'inline', first.policy_doc)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'policy_documents.bin')
+            self.assertTrue(write_policy_store(filepath, [first, second, duplicate]))
+            self.assertFalse(write_policy_store(filepath, [second, first]))
+
+            store = PolicyStore(filepath)
+            self.assertEqual(len(store), 2)
+            self.assertIn(first.digest, store)
+            self.assertNotIn('00' * 32, store)
+            self.assertNotIn('not a digest', store)
+            self.assertEqual(store.load_document(second.digest), second.policy_doc)
+            self.assertEqual(store.get_encoded_document(first.digest),
+                             json.dumps(first.policy_doc, separators=(',', ':')).encode('utf-8'))
+            with self.assertRaises(KeyError):
+                store.load_policy('arn:aws:iam::000000000000:policy/missing', 'missing', '00' * 32)
+
+            # an open store keeps its documents when the file is replaced
+            self.assertTrue(write_policy_store(filepath, [second]))
+            self.assertEqual(store.load_document(first.digest), first.policy_doc)
+            self.assertEqual(len(PolicyStore(filepath)), 1)
+            store.close()
+
+            with open(filepath, 'wb') as f:
+                f.write(b'not a policy document store')
+            with self.assertRaises(ValueError):
+                PolicyStore(filepath)
+
+    def test_graph_policies_decode_lazily(self):
+        graph = build_playground_graph()
+        expected = {policy.arn: policy.policy_doc for policy in graph.policies}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph.store_graph_as_json(tmpdir)
+            with open(os.path.join(tmpdir, 'graph', 'policies.json')) as f:
+                self.assertNotIn('policy_doc', f.read())
+            del graph
+            gc.collect()
+
+            loaded = Graph.create_graph_from_local_disk(tmpdir)
+            self.assertTrue(all(policy._document._policy_doc is None for policy in loaded.policies))
+            self.assertEqual({policy.arn: policy.policy_doc for policy in loaded.policies}, expected)
+            self.assertEqual(loaded.nodes[0].attached_policies[0].policy_doc, expected[
+                loaded.nodes[0].attached_policies[0].arn])
+
+            # a graph whose policies refer to a missing store does not load
+            documents = [policy.to_dictionary() for policy in loaded.policies]
+            os.remove(os.path.join(tmpdir, 'graph', 'policy_documents.bin'))
+            with self.assertRaisesRegex(ValueError, 'no policy document store'):
+                Graph.create_graph_from_local_disk(tmpdir)
+
+            # graphs with the documents inline in policies.json still load
+            with open(os.path.join(tmpdir, 'graph', 'policies.json'), 'w') as f:
+                json.dump(documents, f)
+            inline = Graph.create_graph_from_local_disk(tmpdir)
+            self.assertEqual({policy.arn: policy.policy_doc for policy in inline.policies}, expected)
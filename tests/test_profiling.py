@@ -0,0 +1,57 @@
+"""Test code for profiling local policy evaluation"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import unittest
+
+from principalmapper.graphing.edge_identification import checker_map, obtain_edges
+from principalmapper.querying import profiling, query_interface
+from tests.build_test_graphs import build_playground_graph
+
+
+class ProfilingTest(unittest.TestCase):
+    def test_profile_evaluations(self):
+        graph = build_playground_graph()
+        self.assertIsNone(profiling.active_profile)
+
+        start_evaluations = query_interface.get_evaluation_count()
+        with profiling.profile_evaluations() as profile:
+            obtain_edges(None, checker_map.keys(), graph.nodes)
+            for node in graph.nodes:
+                query_interface.local_check_authorization(node, 's3:GetObject', '*', {})
+            with profiling.profile_evaluations() as nested_profile:
+                query_interface.local_check_authorization(graph.nodes[0], 's3:GetObject', '*', {})
+            self.assertIs(profiling.active_profile, profile)
+        self.assertIsNone(profiling.active_profile)
+
+        self.assertEqual(profile.checks, query_interface.get_evaluation_count() - start_evaluations - 1)
+        self.assertEqual(sorted(profile.checker_seconds), sorted(checker_map))
+        self.assertEqual(sum(profile.checker_checks.values()), profile.checks - len(graph.nodes))
+        self.assertEqual(profile.checks_by_action['s3:GetObject'], len(graph.nodes))
+        self.assertEqual(sorted(x[0] for x in profile.get_costliest_actions(2)), ['s3:GetObject', 'sts:AssumeRole'])
+        self.assertGreater(profile.statements_scanned, 0)
+        self.assertGreater(profile.pattern_matches, 0)
+        self.assertGreater(profile.policy_cache_hits, 0)
+        self.assertGreater(profile.policy_cache_misses, 0)
+        self.assertEqual(len(profile.get_costliest_principals(2)), 2)
+        self.assertEqual(nested_profile.checks_by_action, {'s3:GetObject': 1})
+
+        output = io.StringIO()
+        profile.write_report(output, 2)
+        lines = output.getvalue().splitlines()
+        self.assertIn('Costliest principals:', lines)
+        self.assertEqual(len(lines[lines.index('Costliest principals:') + 1:]), 2)
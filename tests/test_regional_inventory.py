@@ -0,0 +1,73 @@
+"""Test code for listing resources across regions concurrently"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import io
+import json
+import os.path
+import tempfile
+import unittest
+
+from principalmapper.graphing.lambda_edges import LambdaEdgeChecker
+from principalmapper.graphing.regional_inventory import RegionalInventory
+from principalmapper.util.api_recording import ReplaySession
+
+
+def _write_lambda_archive(filepath: str) -> None:
+    """Writes a recording of listing Lambda functions in three regions, one of which denies access"""
+    records = [
+        {'type': 'header', 'format': 'pmapper-api-recording', 'version': 1},
+        {'type': 'regions', 'service': 'lambda', 'regions': ['us-east-1', 'us-west-2', 'eu-west-1']},
+    ]
+    for region, functions, status_code in (('us-east-1', ['a', 'b'], 200), ('us-west-2', [], 200),
+                                           ('eu-west-1', [], 403)):
+        response = {'Functions': [{'FunctionName': name, 'Role': 'arn:aws:iam::000000000000:role/' + name}
+                                  for name in functions]}
+        if status_code != 200:
+            response = {'Error': {'Code': 'AccessDeniedException', 'Message': 'Access denied'}}
+        records.append({'type': 'call', 'service': 'lambda', 'region': region, 'operation': 'ListFunctions',
+                        'params': {'MaxItems': 25}, 'status_code': status_code, 'response': response})
+    with gzip.open(filepath, 'wt') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+class RegionalInventoryTest(unittest.TestCase):
+    def test_shared_inventory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_path = os.path.join(tmpdir, 'recording.json.gz')
+            _write_lambda_archive(archive_path)
+            inventory = RegionalInventory(ReplaySession(archive_path, latency=0.01))
+
+            # two checkers sharing an inventory scan the regions once
+            checker = LambdaEdgeChecker(inventory.session, inventory)
+            other_checker = LambdaEdgeChecker(inventory.session, inventory)
+            checker.prefetch()
+            functions = checker._get_function_list()
+            self.assertEqual([function['FunctionName'] for function in functions], ['a', 'b'])
+            self.assertIs(other_checker._get_inventory().scan('lambda', None), inventory.scan('lambda', None))
+            self.assertEqual(other_checker._get_function_list(), functions)
+
+            report = io.StringIO()
+            inventory.write_report(report)
+            inventory.close()
+            self.assertIn('lambda in eu-west-1: 0 resources', report.getvalue())
+            self.assertIn('1 errors', report.getvalue())
+            self.assertIn('lambda total: 2 resources from 3 regions', report.getvalue())
+
+    def test_offline_checker(self):
+        self.assertEqual(LambdaEdgeChecker(None)._get_function_list(), [])
@@ -0,0 +1,76 @@
+"""Test code for the query REPL and the query results it reuses between commands"""
+
+#  Copyright (c) NCC Group and Erik Steringer 2019. This file is part of Principal Mapper.
+#
+#      Principal Mapper is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      Principal Mapper is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with Principal Mapper.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import unittest
+import unittest.mock
+
+from principalmapper.common import Edge
+from principalmapper.querying import query_interface
+from principalmapper.querying.query_utils import get_cache_stats, get_search_list
+from principalmapper.querying.repl import PMapperREPL
+from tests.build_test_graphs import build_playground_graph
+
+
+class REPLTests(unittest.TestCase):
+    def test_query_results_are_reused(self):
+        graph = build_playground_graph()
+        jump_user = graph.get_node_by_searchable_name('user/jumpuser')
+
+        first = query_interface.search_authorization_for(graph, jump_user, 's3:GetObject', '*', {})
+        start_evaluations = query_interface.get_evaluation_count()
+        second = query_interface.search_authorization_for(graph, jump_user, 's3:GetObject', '*', {})
+        self.assertIs(first, second)
+        self.assertEqual(query_interface.get_evaluation_count(), start_evaluations)
+        self.assertEqual(get_cache_stats(graph)['authorization_searches'][:2], (1, 1))
+
+        # assigning edges drops cached results
+        graph.edges = list(graph.edges)
+        self.assertEqual(get_cache_stats(graph), {})
+
+        # so does changing them in place
+        role = graph.get_node_by_searchable_name('role/s3_access_role')
+        self.assertEqual(get_search_list(graph, role), [])
+        graph.edges.append(Edge(role, jump_user, 'can test'))
+        self.assertEqual([path[-1].destination for path in get_search_list(graph, role)][:1], [jump_user])
+        del graph.edges[len(graph.edges) - 1]
+        self.assertEqual(get_search_list(graph, role), [])
+
+    def test_repl_commands(self):
+        graph = build_playground_graph()
+        reloaded_graph = build_playground_graph()
+        repl_obj = PMapperREPL(graph, lambda: reloaded_graph)
+        commands = [
+            '\\timing',
+            "query 'who can do s3:GetObject with *'",
+            "query 'who can do s3:GetObject with *'",
+            'stats',
+            'reload',
+            'exit'
+        ]
+        output = io.StringIO()
+        with unittest.mock.patch('builtins.input', side_effect=commands), contextlib.redirect_stdout(output):
+            repl_obj.begin_repl()
+
+        lines = output.getvalue().splitlines()
+        self.assertIn('Timing is on.', lines)
+        timing_lines = [line for line in lines if line.startswith('Time: ')]
+        self.assertEqual(len(timing_lines), 3)
+        self.assertTrue(timing_lines[1].endswith(' 0 authorization checks'))
+        self.assertTrue(any(line.startswith('authorization_searches: ') and '50.0% hit rate' in line for line in lines))
+        self.assertIs(repl_obj.graph, reloaded_graph)